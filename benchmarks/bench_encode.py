@@ -0,0 +1,57 @@
+"""
+CLIP text encoding microbenchmarks (needs the model configured in src/clip_search.py).
+
+    python -m benchmarks.bench_encode --queries 50
+
+Measures model load time, single-prompt encode_text, batched encode_texts at several batch
+sizes, and encode_query with a cold and a warm text embedding cache.
+"""
+import argparse
+import time
+
+from src import clip_search
+from src.encoder_backends import SAMPLE_QUERIES
+from benchmarks.common import summarize, time_calls, save_results, peak_rss_mb
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CLIP text encoding microbenchmarks.")
+    parser.add_argument("--queries", type=int, default=50, help="Calls per measurement")
+    parser.add_argument("--batch-sizes", default="1,4,16,32", help="Batch sizes for encode_texts")
+    args = parser.parse_args()
+
+    results = {"backend": clip_search.TEXT_BACKEND, "text_only": clip_search.TEXT_ONLY_MODEL}
+    started = time.perf_counter()
+    clip_search.get_text_backend()
+    results["model_load_s"] = time.perf_counter() - started
+
+    prompts = [SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)] for i in range(args.queries)]
+    prompt_iter = iter(prompts * 2)
+    results["encode_text"] = time_calls(lambda: clip_search.encode_text(next(prompt_iter)), args.queries)
+
+    results["encode_texts"] = {}
+    for batch_size in [int(value) for value in args.batch_sizes.split(",")]:
+        batch = (SAMPLE_QUERIES * (batch_size // len(SAMPLE_QUERIES) + 1))[:batch_size]
+        summary = time_calls(lambda: clip_search.encode_texts(batch), max(5, args.queries // batch_size))
+        summary["per_item_ms"] = summary["mean_ms"] / batch_size
+        results["encode_texts"][str(batch_size)] = summary
+
+    # Unique prompts miss the cache; repeating them afterwards hits it
+    cold = []
+    for i in range(args.queries):
+        started = time.perf_counter()
+        clip_search.encode_query(f"{SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)]} variant {i}")
+        cold.append(time.perf_counter() - started)
+    warm = []
+    for i in range(args.queries):
+        started = time.perf_counter()
+        clip_search.encode_query(f"  {SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)].upper()} variant {i} ")
+        warm.append(time.perf_counter() - started)
+    results["encode_query_cold"] = summarize(cold)
+    results["encode_query_warm"] = summarize(warm)
+    results["text_cache"] = clip_search.text_embedding_cache.stats()
+    results["peak_rss_mb"] = peak_rss_mb()
+
+    print(f"encode_text p50 {results['encode_text']['p50_ms']:.1f} ms, "
+          f"cache hit p50 {results['encode_query_warm']['p50_ms']:.3f} ms")
+    save_results("encode", results)
@@ -0,0 +1,32 @@
+"""
+Grid rendering microbenchmark: create_image_grid + HTML serialization for the bundled images.
+
+    python -m benchmarks.bench_render --repeats 200
+"""
+import argparse
+import os
+
+from fasthtml.common import to_xml
+
+from src.chatbot import create_image_grid, LOCAL_IMAGE_DIR
+from benchmarks.common import time_calls, save_results, peak_rss_mb
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Image grid rendering microbenchmark.")
+    parser.add_argument("--repeats", type=int, default=200, help="Renders per measurement")
+    parser.add_argument("--cards", default="6,24,96", help="Grid sizes to render")
+    args = parser.parse_args()
+
+    image_paths = sorted(os.path.join(LOCAL_IMAGE_DIR, name) for name in os.listdir(LOCAL_IMAGE_DIR))
+    results = {}
+    for cards in [int(value) for value in args.cards.split(",")]:
+        paths = (image_paths * (cards // max(1, len(image_paths)) + 1))[:cards]
+        results[str(cards)] = {
+            "build": time_calls(lambda: create_image_grid(paths, "winter hiking boots"), args.repeats),
+            "build_and_render": time_calls(lambda: to_xml(create_image_grid(paths, "winter hiking boots")),
+                                           args.repeats),
+        }
+        print(f"{cards} cards: render p50 {results[str(cards)]['build_and_render']['p50_ms']:.2f} ms")
+    results["peak_rss_mb"] = peak_rss_mb()
+    save_results("render", results)
@@ -0,0 +1,100 @@
+"""
+Vector store and search microbenchmarks on synthetic catalogs.
+
+    python -m benchmarks.bench_search --sizes 1k,100k,1m --queries 200
+
+For each catalog size this measures vector store write/load time, VectorIndex construction,
+single-query top_k_cosine_similarity, batched search, the perform_search scoring + path
+lookup step, and optionally the IVF index.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from src.vector_store import write_vector_store, load_vector_store
+from src.vector_index import VectorIndex
+from src.ann_index import IVFIndex
+from src.clip_search import top_k_cosine_similarity
+from benchmarks.common import summarize, time_calls, synthetic_embeddings, parse_sizes, save_results, peak_rss_mb
+
+
+def bench_catalog(count, queries, k, batch_size, ivf_nprobe):
+    """Run every search benchmark for one synthetic catalog size."""
+    result = {"catalog_size": count}
+    matrix = synthetic_embeddings(count)
+    query_vectors = synthetic_embeddings(queries, seed=1)
+
+    with tempfile.TemporaryDirectory() as directory:
+        ids = [f"{row}.jpg" for row in range(count)]
+        paths = [os.path.join("images", product_id) for product_id in ids]
+
+        started = time.perf_counter()
+        write_vector_store(directory, matrix, ids, paths, normalized=True)
+        result["store_write_s"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        store = load_vector_store(directory)
+        result["store_load_s"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        index = VectorIndex(store.matrix, normalized=store.normalized)
+        # First full scan pages the memory-mapped matrix in
+        index.search(query_vectors[0], k)
+        result["index_build_and_first_query_s"] = time.perf_counter() - started
+
+        query_iter = iter(np.resize(np.arange(queries), queries + 3))
+        result["top_k_cosine_similarity"] = time_calls(
+            lambda: top_k_cosine_similarity(index, query_vectors[next(query_iter)], k), queries)
+
+        def search_and_lookup(query):
+            rows, _ = index.search(query, k)
+            return [store.paths[row] for row in rows]
+
+        query_iter = iter(np.resize(np.arange(queries), queries + 3))
+        result["perform_search_scoring"] = time_calls(
+            lambda: search_and_lookup(query_vectors[next(query_iter)]), queries)
+
+        batch_latencies = []
+        for start in range(0, queries, batch_size):
+            batch = query_vectors[start:start + batch_size]
+            started = time.perf_counter()
+            index.search_batch(batch, k)
+            batch_latencies.append((time.perf_counter() - started) / len(batch))
+        result["search_batch_per_query"] = summarize(batch_latencies)
+
+        if ivf_nprobe:
+            started = time.perf_counter()
+            ivf = IVFIndex.train(index.matrix, max(1, int(np.sqrt(count))), train_size=min(count, 100000))
+            result["ivf_build_s"] = time.perf_counter() - started
+            query_iter = iter(np.resize(np.arange(queries), queries + 3))
+            result["ivf_search"] = time_calls(
+                lambda: ivf.search(query_vectors[next(query_iter)], k, nprobe=ivf_nprobe, matrix=index.matrix),
+                queries)
+
+        del index, store
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vector store / search microbenchmarks.")
+    parser.add_argument("--sizes", default="1k,100k,1m", help="Synthetic catalog sizes")
+    parser.add_argument("--queries", type=int, default=200, help="Queries per measurement")
+    parser.add_argument("--k", type=int, default=6, help="Results per query")
+    parser.add_argument("--batch-size", type=int, default=32, help="Queries per batched search")
+    parser.add_argument("--ivf-nprobe", type=int, default=0, help="Also benchmark an IVF index with this nprobe")
+    args = parser.parse_args()
+
+    results = []
+    for count in parse_sizes(args.sizes):
+        print(f"Catalog of {count} vectors...")
+        result = bench_catalog(count, args.queries, args.k, args.batch_size, args.ivf_nprobe)
+        print(f"  load {result['store_load_s'] * 1000:.1f} ms, "
+              f"top-k p50 {result['top_k_cosine_similarity']['p50_ms']:.2f} ms "
+              f"p99 {result['top_k_cosine_similarity']['p99_ms']:.2f} ms, "
+              f"batched {result['search_batch_per_query']['mean_ms']:.3f} ms/query")
+        results.append(result)
+    save_results("search", results)
@@ -0,0 +1,96 @@
+"""
+Scaling benchmark for sharded multi-process search on a synthetic catalog.
+
+    python -m benchmarks.bench_sharded --size 1m --shards 1,2,4,8 --queries 200
+
+The catalog is written as a normalized vector store, so the workers memory-map it exactly as
+the server does. For each shard count this measures single-query latency, batched throughput
+and the speedup over one shard, next to the single-process VectorIndex baseline.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from src.vector_store import write_vector_store, load_vector_store
+from src.vector_index import VectorIndex
+from src.sharded_search import ShardedIndex
+from benchmarks.common import time_calls, synthetic_embeddings, parse_sizes, save_results
+
+
+def batch_throughput(search_batch, query_vectors, batch_size, k):
+    """Queries per second when queries are submitted `batch_size` at a time."""
+    started = time.perf_counter()
+    for start in range(0, len(query_vectors), batch_size):
+        search_batch(query_vectors[start:start + batch_size], k)
+    return len(query_vectors) / (time.perf_counter() - started)
+
+
+def bench_sharding(count, shard_counts, queries, k, batch_size):
+    """Run the single-process baseline and every shard count on one catalog."""
+    matrix = synthetic_embeddings(count)
+    query_vectors = synthetic_embeddings(queries, seed=1)
+    results = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        ids = [f"{row}.jpg" for row in range(count)]
+        write_vector_store(directory, matrix, ids, [os.path.join("images", product_id) for product_id in ids],
+                           normalized=True)
+        del matrix
+        store = load_vector_store(directory)
+
+        baseline = VectorIndex(store.matrix, normalized=True)
+        expected, _ = baseline.search_batch(query_vectors, k)
+        query_iter = iter(np.resize(np.arange(queries), queries + 3))
+        results.append({
+            "mode": "single-process",
+            "shards": 0,
+            "single_query": time_calls(lambda: baseline.search(query_vectors[next(query_iter)], k), queries),
+            "batch_qps": batch_throughput(baseline.search_batch, query_vectors, batch_size, k),
+        })
+
+        for shards in shard_counts:
+            index = ShardedIndex(store.matrix, shards=shards, normalized=True)
+            try:
+                rows, _ = index.search_batch(query_vectors, k)
+                query_iter = iter(np.resize(np.arange(queries), queries + 3))
+                results.append({
+                    "mode": "sharded",
+                    "shards": shards,
+                    "single_query": time_calls(lambda: index.search(query_vectors[next(query_iter)], k), queries),
+                    "batch_qps": batch_throughput(index.search_batch, query_vectors, batch_size, k),
+                    "matches_exact": bool((rows == expected).all()),
+                })
+            finally:
+                index.close()
+        del baseline, store
+
+    one_shard = next((row for row in results if row["shards"] == 1), None)
+    for row in results:
+        if one_shard is not None:
+            row["single_speedup"] = one_shard["single_query"]["p50_ms"] / row["single_query"]["p50_ms"]
+            row["batch_speedup"] = row["batch_qps"] / one_shard["batch_qps"]
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sharded search scaling benchmark.")
+    parser.add_argument("--size", default="1m", help="Synthetic catalog size")
+    parser.add_argument("--shards", default="1,2,4,8", help="Comma-separated shard counts")
+    parser.add_argument("--queries", type=int, default=200, help="Queries per measurement")
+    parser.add_argument("--k", type=int, default=6, help="Results per query")
+    parser.add_argument("--batch-size", type=int, default=32, help="Queries per batched search")
+    args = parser.parse_args()
+
+    count = parse_sizes(args.size)[0]
+    shard_counts = [int(value) for value in args.shards.split(",")]
+    print(f"Catalog of {count} vectors on {os.cpu_count()} CPUs")
+    results = bench_sharding(count, shard_counts, args.queries, args.k, args.batch_size)
+    print(f"{'mode':>15} {'shards':>6} {'p50 ms':>8} {'p95 ms':>8} {'batch q/s':>10} {'speedup':>8} {'batch x':>8}")
+    for row in results:
+        print(f"{row['mode']:>15} {row['shards']:>6} {row['single_query']['p50_ms']:>8.2f} "
+              f"{row['single_query']['p95_ms']:>8.2f} {row['batch_qps']:>10.1f} "
+              f"{row.get('single_speedup', 0):>8.2f} {row.get('batch_speedup', 0):>8.2f}")
+    save_results("sharded", {"catalog_size": count, "runs": results})
@@ -0,0 +1,119 @@
+"""
+Shared helpers for the benchmark scripts: timing, percentiles, RSS and JSON result files.
+"""
+import json
+import os
+import platform
+import resource
+import subprocess
+import time
+
+import numpy as np
+
+RESULTS_DIR = os.path.join("benchmarks", "results")
+DIM = 512  # CLIP ViT-B/32 embedding size
+
+
+def summarize(latencies):
+    """
+    Summarize a list of latencies (seconds).
+
+    Returns:
+        dict: count, mean and p50/p95/p99/max in milliseconds.
+    """
+    latencies = np.asarray(latencies, dtype=np.float64) * 1000
+    if not len(latencies):
+        return {"count": 0}
+    return {
+        "count": int(len(latencies)),
+        "mean_ms": float(latencies.mean()),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "max_ms": float(latencies.max()),
+    }
+
+
+def time_calls(fn, repeats, warmup=3):
+    """Call fn() `warmup` times untimed, then `repeats` times timed; return the summary."""
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - started)
+    return summarize(latencies)
+
+
+def peak_rss_mb(pid=None):
+    """Peak resident set size in MB of this process, or of another process on Linux."""
+    if pid is None:
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        scale = 1024 * 1024 if platform.system() == "Darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    try:
+        with open(f"/proc/{pid}/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def synthetic_embeddings(count, dim=DIM, seed=0, chunk_size=100000):
+    """Random unit-length float32 embeddings, generated in chunks to bound peak memory."""
+    rng = np.random.default_rng(seed)
+    matrix = np.empty((count, dim), dtype=np.float32)
+    for start in range(0, count, chunk_size):
+        chunk = rng.standard_normal((min(chunk_size, count - start), dim), dtype=np.float32)
+        matrix[start:start + len(chunk)] = chunk / np.linalg.norm(chunk, axis=1, keepdims=True)
+    return matrix
+
+
+def parse_sizes(text):
+    """Parse catalog sizes such as "1k,100k,1m" into integers."""
+    multipliers = {"k": 1000, "m": 1000000}
+    sizes = []
+    for value in text.lower().split(","):
+        value = value.strip()
+        sizes.append(int(float(value[:-1]) * multipliers[value[-1]]) if value[-1] in multipliers else int(value))
+    return sizes
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+
+def save_results(name, results, out_dir=RESULTS_DIR):
+    """
+    Save benchmark results as JSON with enough context to compare runs.
+
+    Parameters:
+        name (str): Benchmark name, used in the file name.
+        results: JSON-serializable results.
+        out_dir (str): Output directory.
+
+    Returns:
+        str: Path of the written file.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(out_dir, f"{name}-{stamp}.json")
+    with open(path, "w") as file:
+        json.dump({
+            "benchmark": name,
+            "timestamp": stamp,
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "peak_rss_mb": peak_rss_mb(),
+            "results": results,
+        }, file, indent=2)
+    print(f"Results saved to {path}")
+    return path
@@ -0,0 +1,49 @@
+"""
+Compare two saved benchmark result files and flag regressions.
+
+    python -m benchmarks.compare benchmarks/results/search-A.json benchmarks/results/search-B.json
+"""
+import argparse
+import json
+
+
+def flatten(value, prefix=""):
+    """Flatten nested result dicts/lists into {"a.b.0.c": number}."""
+    items = {}
+    if isinstance(value, dict):
+        for key, child in value.items():
+            items.update(flatten(child, f"{prefix}{key}."))
+    elif isinstance(value, list):
+        for index, child in enumerate(value):
+            # Key list entries by catalog size when available, so reordered runs still line up
+            label = child.get("catalog_size", index) if isinstance(child, dict) else index
+            items.update(flatten(child, f"{prefix}{label}."))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        items[prefix[:-1]] = value
+    return items
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two benchmark JSON files.")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative change flagged as a regression")
+    args = parser.parse_args()
+
+    with open(args.baseline) as file:
+        baseline = flatten(json.load(file)["results"])
+    with open(args.candidate) as file:
+        candidate = flatten(json.load(file)["results"])
+
+    regressions = 0
+    for key in sorted(set(baseline) & set(candidate)):
+        before, after = baseline[key], candidate[key]
+        if not before:
+            continue
+        change = (after - before) / abs(before)
+        # Latencies, timings and memory are lower-is-better; throughput is higher-is-better
+        worse = change < -args.threshold if "throughput" in key or "rps" in key else change > args.threshold
+        regressions += worse
+        if worse or abs(change) > args.threshold:
+            print(f"{'REGRESSION' if worse else 'improved':>10}  {key}: {before:.4g} -> {after:.4g} ({change:+.1%})")
+    print(f"{regressions} regression(s) beyond {args.threshold:.0%}")
@@ -0,0 +1,160 @@
+"""
+End-to-end load generator for /chat and /generate.
+
+    python -m benchmarks.load_test --spawn-server --users 50 --turns 6
+
+With --spawn-server the app is started with the offline stub LLM (benchmarks/stub_server.py),
+so the test runs without network access; otherwise point --url at a running server. Each
+simulated user keeps its own session cookie and sends `turns` chat messages plus one
+/generate search. Streamed chat replies are read to the end; their time to first event and
+to the complete reply are reported as "/chat first token" and "/chat reply". Reports
+p50/p95/p99 latency per endpoint, throughput, status codes and the server's peak RSS.
+"""
+import argparse
+import http.cookiejar
+import re
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import summarize, save_results, peak_rss_mb
+
+USER_MESSAGES = [
+    "I need shoes for a winter hike",
+    "Something waterproof, for men",
+    "Dark colors, brown or black",
+    "Ankle height would be great",
+    "Mostly for rocky trails",
+    "Budget is not a concern",
+]
+
+
+# Stream URL of an assistant bubble that is filled in over server-sent events
+STREAM_URL = re.compile(r'data-stream="([^"]+)"')
+
+
+def _request(opener, url, data=None, timeout=60):
+    body = urllib.parse.urlencode(data).encode() if data is not None else None
+    started = time.perf_counter()
+    text = ""
+    try:
+        with opener.open(url, data=body, timeout=timeout) as response:
+            text = response.read().decode("utf-8", "replace")
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception:
+        status = "error"
+    return time.perf_counter() - started, status, text
+
+
+def _read_stream(opener, url, started, timeout=60):
+    """Read a reply stream to its "done" event; returns (first event latency, total latency, status)."""
+    first = None
+    try:
+        with opener.open(url, timeout=timeout) as response:
+            for line in response:
+                if first is None and line.startswith(b"event:"):
+                    first = time.perf_counter() - started
+                if line.strip() == b"event: done":
+                    break
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception:
+        status = "error"
+    total = time.perf_counter() - started
+    return (first if first is not None else total), total, status
+
+
+def simulate_user(base_url, turns, user_id):
+    """Run one user's conversation; return (endpoint, latency, status) samples."""
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    samples = [("/", *_request(opener, base_url + "/")[:2])]
+    for turn in range(turns):
+        message = USER_MESSAGES[(user_id + turn) % len(USER_MESSAGES)]
+        started = time.perf_counter()
+        latency, status, text = _request(opener, base_url + "/chat", {"msg": message})
+        samples.append(("/chat", latency, status))
+        stream = STREAM_URL.search(text)
+        if stream:
+            first, total, stream_status = _read_stream(opener, base_url + stream.group(1), started)
+            samples.append(("/chat first token", first, stream_status))
+            samples.append(("/chat reply", total, stream_status))
+    samples.append(("/generate", *_request(opener, base_url + "/generate", {"prompt": "winter hiking boots"})[:2]))
+    return samples
+
+
+def wait_until_ready(base_url, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(base_url + "/ready", timeout=5) as response:
+                if response.status == 200:
+                    return True
+        except Exception:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def run_load(base_url, users, turns):
+    """Run all users concurrently and summarize the results."""
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        samples = [sample for user in pool.map(lambda user_id: simulate_user(base_url, turns, user_id), range(users))
+                   for sample in user]
+    wall_seconds = time.perf_counter() - started
+
+    latencies, statuses = defaultdict(list), defaultdict(Counter)
+    for endpoint, latency, status in samples:
+        latencies[endpoint].append(latency)
+        statuses[endpoint][str(status)] += 1
+    return {
+        "users": users,
+        "turns": turns,
+        "wall_s": wall_seconds,
+        "requests": len(samples),
+        "throughput_rps": len(samples) / wall_seconds,
+        "endpoints": {endpoint: {**summarize(values), "statuses": dict(statuses[endpoint])}
+                      for endpoint, values in latencies.items()},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test /chat and /generate.")
+    parser.add_argument("--url", default="http://127.0.0.1:5055", help="Server base URL")
+    parser.add_argument("--spawn-server", action="store_true", help="Start the app with the stub LLM")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Stub LLM round trip (s)")
+    parser.add_argument("--users", type=int, default=50, help="Concurrent users")
+    parser.add_argument("--turns", type=int, default=6, help="Chat messages per user")
+    parser.add_argument("--ready-timeout", type=float, default=300, help="Seconds to wait for /ready")
+    args = parser.parse_args()
+
+    server = None
+    if args.spawn_server:
+        port = urllib.parse.urlparse(args.url).port or 5055
+        server = subprocess.Popen([sys.executable, "-m", "benchmarks.stub_server", "--port", str(port),
+                                   "--llm-latency", str(args.llm_latency)])
+    try:
+        if not wait_until_ready(args.url, args.ready_timeout):
+            sys.exit(f"Server at {args.url} did not become ready")
+        results = run_load(args.url, args.users, args.turns)
+        results["server_peak_rss_mb"] = peak_rss_mb(server.pid) if server else None
+        results["client_peak_rss_mb"] = peak_rss_mb()
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    print(f"{results['requests']} requests in {results['wall_s']:.1f}s ({results['throughput_rps']:.1f} req/s)")
+    for endpoint, summary in results["endpoints"].items():
+        if summary["count"]:
+            print(f"  {endpoint:<18} p50 {summary['p50_ms']:8.1f} ms  p95 {summary['p95_ms']:8.1f} ms  "
+                  f"p99 {summary['p99_ms']:8.1f} ms  {summary['statuses']}")
+    save_results("load", results)
@@ -0,0 +1,29 @@
+"""
+Runs the app with the offline stub LLM provider in place of Gemini, for load testing.
+
+    python -m benchmarks.stub_server --port 5055 --llm-latency 0.3
+"""
+import argparse
+
+import uvicorn
+
+import main
+from src import chatbot
+from src.llm import StubProvider
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the app with a stub LLM.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Simulated LLM round trip (s)")
+    parser.add_argument("--search-every", type=int, default=3, help="Function call every N user turns")
+    parser.add_argument("--llm-cache", action="store_true",
+                        help="Keep the LLM response cache (off by default so every turn pays the simulated latency)")
+    args = parser.parse_args()
+
+    # initialize_chat reads the module-level provider, so the seeded history and response cache are kept
+    chatbot.llm_provider = StubProvider(latency_seconds=args.llm_latency, search_every=args.search_every)
+    if not args.llm_cache:
+        chatbot.response_cache = None
+    uvicorn.run(main.app, host=args.host, port=args.port, log_level="warning")
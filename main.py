@@ -1,10 +1,22 @@
 from fasthtml.common import *
 from claudette import *
-import os, uvicorn
+import os, uvicorn, asyncio, mimetypes, hmac, json, time
 from PIL import Image
+from starlette.responses import StreamingResponse
+from starlette.datastructures import UploadFile
 # from fastcore.parallel import threaded
 from src.chatbot import initialize_chat, \
-    process_response, function_declarations, generate_custom
+    process_response, function_declarations, generate_custom, llm_stats, render_results_page, search_results, \
+    generate_similar, generate_from_image, catalog, card_cache, speculative_search
+from src.executor import BoundedExecutor, QueueFullError
+from src.sessions import SessionManager
+from src.thumbnails import safe_image_path, source_digest, get_thumbnail, THUMBNAIL_FORMATS, VERSION_LENGTH
+from src.settings import get_setting
+from src.clip_search import start_warmup, warmup_state, is_ready, text_embedding_cache, text_encoder, \
+    image_encoder, neighbor_stats, index_registry, INDEX_VERSIONS_DIR
+from src.index_registry import set_active, rollback_version
+from src.speculative_search import speculative_query
+from src.metrics import registry, span, first_token_seconds, TracingMiddleware, SamplingProfiler
 
 
 # Simulate LLM response (this can be replaced with actual LLM calls)
@@ -67,6 +79,15 @@ def ChatMessage(msg, user):
         Hidden(msg, name="messages"),
     )
 
+# Assistant bubble filled in over /chat_stream as the reply is generated
+def StreamingChatMessage(stream_id):
+    """Generate an assistant bubble that the page script streams the reply into."""
+    return Div(cls="chat chat-start")(
+        Div("Assistant", cls="chat-header"),
+        Div(Span(cls="loading loading-dots loading-sm"), cls="chat-bubble chat-bubble-secondary",
+            data_stream=f"/chat_stream/{stream_id}"),
+    )
+
 # Chat input component
 def ChatInput():
     """Input field for user messages in the chat interface."""
@@ -77,14 +98,117 @@ def ChatInput():
         cls="input input-bordered w-full",
         hx_swap_oob='true')
 
-# Initialize FastHTML app
-app = FastHTML(hdrs=hdrs)
+# Initialize FastHTML app; the CLIP model and indexes load in the background after startup
+app = FastHTML(hdrs=hdrs, on_startup=[start_warmup])
+
+# Per-request timing spans, request latency histograms and the opt-in sampling profiler
+profiler = SamplingProfiler(
+    every=get_setting("metrics", "profile_every", 0),
+    output_dir=get_setting("metrics", "profile_dir", os.path.join(".cache", "profiles")),
+    engine=get_setting("metrics", "profiler", "auto"),
+)
+app.add_middleware(TracingMiddleware, slow_ms=get_setting("metrics", "slow_request_ms"), profiler=profiler)
+
+# Each visitor gets their own chat with a bounded history window
+sessions = SessionManager(
+    initialize_chat,
+    max_sessions=get_setting("sessions", "max_sessions", 1000),
+    idle_timeout=get_setting("sessions", "idle_timeout_seconds", 1800),
+    history_turns=get_setting("sessions", "history_turns", 8),
+    summary_chars=get_setting("sessions", "summary_chars", 500),
+)
+
+def session_id(session):
+    """Return the visitor's session id, assigning one in the signed session cookie if needed."""
+    if 'sid' not in session:
+        session['sid'] = SessionManager.new_session_id()
+    return session['sid']
+
+# CLIP encoding and vector search run off the event loop on a bounded pool;
+# when it is saturated, requests are rejected with 503 instead of queueing without limit
+search_executor = BoundedExecutor(
+    max_workers=get_setting("server", "search_workers", 4),
+    max_pending=get_setting("server", "search_queue_size", 32),
+)
+
+# Upper bound on a single Gemini round trip
+LLM_TIMEOUT = get_setting("server", "llm_timeout_seconds", 30)
 
-# Store the latest image grid content
-app.state.latest_image_grid = "<div>Initial Image Grid</div>"
+# Stream assistant replies token by token into the chat bubble instead of waiting for the whole reply
+STREAM_REPLIES = get_setting("llm", "stream", True)
 
-# Initialize chat with the chatbot
-chat = initialize_chat()
+# Background chat turns; referenced here so they are not garbage collected while running
+chat_tasks = set()
+
+# Prefetch a search from the conversation while the LLM call is in flight (uses idle search workers only)
+SPECULATIVE_SEARCH = get_setting("speculative", "enabled", False)
+SPECULATIVE_MIN_CHARS = get_setting("speculative", "min_chars", 12)
+
+def start_speculation(chat_session, msg):
+    """Start this turn's speculative search on an idle search worker; returns its future or None."""
+    if not SPECULATIVE_SEARCH or len(msg.strip()) < SPECULATIVE_MIN_CHARS:
+        return None
+    # Never queue speculative work ahead of real searches
+    if search_executor.stats()["in_flight"] >= search_executor.max_workers:
+        speculative_search.record_skip()
+        return None
+    query = speculative_query(chat_session.chat.history, msg)
+    future = asyncio.ensure_future(search_executor.run(speculative_search.run, query))
+    # Failed or unused speculations are dropped silently
+    future.add_done_callback(lambda done: done.cancelled() or done.exception())
+    return future
+
+def speculation_result(future, response):
+    """
+    The finished Speculation of a turn whose reply calls the search function, or None.
+
+    Only replies with a function call count towards the speculation statistics; otherwise the
+    speculation is cancelled (a queued one never runs).
+    """
+    if future is None:
+        return None
+    if response.function_call is None:
+        future.cancel()
+        return None
+    if not future.done():
+        speculative_search.record_late()
+        return None
+    if future.cancelled() or future.exception() is not None:
+        return None
+    return future.result()
+
+def warmup_metrics():
+    """Warmup state as numbers: readiness, time to ready and per-resource load seconds."""
+    return {
+        "ready": warmup_state["status"] == "ready",
+        "failed": warmup_state["status"] == "failed",
+        "time_to_ready_seconds": warmup_state["time_to_ready"] or 0.0,
+        "load_seconds": dict(warmup_state["loaded"]),
+    }
+
+# Everything exported by /metrics besides the span and request histograms
+registry.register("text_cache", text_embedding_cache.stats, "Query embedding cache", counters=("hits", "misses"))
+registry.register("text_encoder", text_encoder.stats, "Batched CLIP text encoder", counters=("batches", "items"))
+registry.register("search_executor", search_executor.stats, "Search thread pool", counters=("rejected",))
+registry.register("sessions", sessions.stats, "Chat sessions", counters=("evicted",))
+registry.register("image_encoder", image_encoder.stats, "Batched CLIP image encoder", counters=("batches", "items"))
+registry.register("neighbors", neighbor_stats, "More-like-this neighbor lists",
+                  counters=("precomputed_hits", "hits", "misses"))
+registry.register("index", index_registry.stats, "Versioned search index", counters=("swaps", "failed_swaps"))
+registry.register("catalog", catalog.stats, "Image catalog manifest", counters=("scans",))
+registry.register("card_cache", card_cache.stats, "Rendered image card fragments", counters=("hits", "misses"))
+registry.register("speculative", speculative_search.stats, "Speculative search during LLM turns",
+                  counters=("started", "skipped", "late", "exact_hits", "reranked", "misses",
+                            "seconds_spent", "seconds_saved"))
+registry.register("search_results", search_results.stats, "Cached search rankings", counters=("expired",))
+registry.register("llm", llm_stats, "LLM provider",
+                  counters=("latency_calls", "latency_errors", "cache_hits", "cache_misses"))
+registry.register("warmup", warmup_metrics, "Model and index warmup")
+registry.register("profiler", profiler.stats, "Sampling profiler", counters=("requests", "written"))
+
+def busy_response():
+    """Response returned when the search executor has no free capacity."""
+    return Response("Server is busy, please retry shortly.", status_code=503, headers={"Retry-After": "1"})
 
 # Configuration for local images
 LOCAL_IMAGE_DIR = "images"  # Directory containing images
@@ -92,24 +216,202 @@ SUPPORTED_FORMATS = ['.jpg', '.jpeg', '.png', '.gif']  # Allowed image formats
 IMAGES_TO_DISPLAY = 6  # Number of images to display at once
 
 @app.post("/generate")
-def generate(prompt: str = ""):
+async def generate(session, prompt: str = ""):
     """Handle 'Generate' button click to create a new set of images."""
     try:
-        image_grid, clear_input = generate_custom(prompt)
-        app.state.latest_image_grid = image_grid
+        image_grid, clear_input = await search_executor.run(generate_custom, prompt)
+        with span("render_html"):
+            grid_html = to_xml(image_grid)
+        sessions.get(session_id(session)).set_grid(grid_html)
         return image_grid, clear_input
+    except QueueFullError:
+        return busy_response()
     except Exception as e:
         return Div(f"Error: {str(e)}", cls="text-red-500")
 
-# Serve static images
+@app.get("/similar/{product_id}")
+async def similar(session, product_id: str):
+    """'More like this': products nearest to a catalog product's stored vector, without model inference."""
+    try:
+        image_grid = await search_executor.run(generate_similar, product_id)
+    except QueueFullError:
+        return busy_response()
+    except KeyError:
+        return Div(f"Unknown product: {product_id}", cls="text-red-500", id="display-list2")
+    with span("render_html"):
+        grid_html = to_xml(image_grid)
+    sessions.get(session_id(session)).set_grid(grid_html)
+    return image_grid
+
+# Largest accepted query image upload, in bytes
+UPLOAD_MAX_BYTES = get_setting("uploads", "max_bytes", 10 * 1024 * 1024)
+
+@app.post("/search_image")
+async def search_image(request, session, image: UploadFile):
+    """Search by uploaded photo: decoding, preprocessing and the batched vision forward pass run off the event loop."""
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > UPLOAD_MAX_BYTES + 65536:
+        return Response("Image is too large.", status_code=413)
+    data = await image.read(UPLOAD_MAX_BYTES + 1)
+    if len(data) > UPLOAD_MAX_BYTES:
+        return Response("Image is too large.", status_code=413)
+    try:
+        image_grid = await search_executor.run(generate_from_image, data)
+    except QueueFullError:
+        return busy_response()
+    except ValueError as e:
+        return Div(str(e), cls="text-red-500", id="display-list2")
+    with span("render_html"):
+        grid_html = to_xml(image_grid)
+    sessions.get(session_id(session)).set_grid(grid_html)
+    return image_grid
+
+@app.get("/results/{result_id}")
+def results_page(result_id: str, cursor: int = 0, limit: int = IMAGES_TO_DISPLAY):
+    """Next page of a cached search ranking (infinite scroll); cards are streamed as they render."""
+    return StreamingResponse(render_results_page(result_id, cursor, limit), media_type="text/html",
+                             headers={"Cache-Control": "private, max-age=60"})
+
+def parse_byte_range(range_header, size):
+    """Parse a single 'bytes=start-end' Range header into inclusive offsets, or None if unsatisfiable."""
+    unit, _, spec = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    start, _, end = spec.strip().partition("-")
+    try:
+        if start:
+            start, end = int(start), int(end) if end else size - 1
+        else:
+            # Suffix range: the last N bytes
+            start, end = max(0, size - int(end)), size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        return None
+    return start, min(end, size - 1)
+
+def cached_file_response(request, path, etag, immutable):
+    """Serve a file with a strong ETag, long-lived caching when immutable, and single-range support."""
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "public, max-age=31536000, immutable" if immutable else "public, no-cache",
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if range_header and request.headers.get("if-range", etag) == etag:
+        size = os.path.getsize(path)
+        byte_range = parse_byte_range(range_header, size)
+        if byte_range is None:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+        start, end = byte_range
+        with open(path, "rb") as file:
+            file.seek(start)
+            body = file.read(end - start + 1)
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        return Response(body, status_code=206, headers=headers, media_type=mimetypes.guess_type(path)[0])
+
+    return FileResponse(path, headers=headers)
+
+# Serve static images and their resized derivatives
 @app.get("/images/{image_name}")
-def serve_image(image_name: str):
-    """Serve images from the local directory."""
-    return FileResponse(os.path.join(LOCAL_IMAGE_DIR, image_name))
+def serve_image(request, image_name: str, w: int = 0, fmt: str = "", v: str = ""):
+    """Serve an image (or a w-pixel-wide thumbnail of it) from the local directory."""
+    path = safe_image_path(LOCAL_IMAGE_DIR, image_name)
+    if path is None:
+        return Response("Image not found", status_code=404)
+
+    digest = source_digest(path)
+    # Only URLs carrying the exact version the cards emit may be cached forever
+    immutable = v == digest[:VERSION_LENGTH]
+    if not w:
+        return cached_file_response(request, path, f'"{digest}"', immutable)
+
+    fmt = fmt if fmt in THUMBNAIL_FORMATS else "webp"
+    thumbnail, digest = get_thumbnail(path, w, fmt)
+    return cached_file_response(request, thumbnail, f'"{os.path.basename(thumbnail)}"', immutable)
+
+async def stream_chat_turn(chat_session, msg, reply):
+    """
+    Run one chat turn in the background, pushing the reply into `reply` as it is generated.
+
+    Text deltas are sent as "token" events. The moment the model requests a search, the
+    search starts on the search executor while the rest of the reply is still drained; the
+    bubble text is then replaced with a "replace" event. A turn that times out or fails is
+    rolled back out of the chat history, and every turn ends with a final event.
+    """
+    search = None
+    speculation = None
+    text = []
+    try:
+        async with chat_session.lock:
+            # Bound the history sent with this turn
+            sessions.trim_history(chat_session)
+            history = list(chat_session.chat.history)
+
+            speculation = start_speculation(chat_session, msg)
+            started = time.perf_counter()
+            deadline = time.monotonic() + LLM_TIMEOUT
+            chunks = chat_session.chat.stream_message_async(msg, tools=[{
+                'function_declarations': function_declarations
+            }])
+            with span("llm"):
+                try:
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(chunks.__anext__(), deadline - time.monotonic())
+                        except StopAsyncIteration:
+                            break
+                        if started is not None:
+                            first_token_seconds.observe(chat_session.chat.provider.name, time.perf_counter() - started)
+                            started = None
+                        if chunk.function_call is not None and search is None:
+                            reply.push("replace", "Searching for matching shoes...")
+                            # CLIP encode + search run on the search executor while the stream finishes
+                            search = asyncio.ensure_future(
+                                search_executor.run(process_response, chunk, speculation_result(speculation, chunk)))
+                        elif chunk.text and search is None:
+                            text.append(chunk.text)
+                            reply.push("token", chunk.text)
+                except BaseException:
+                    # An interrupted stream leaves a half-finished turn; setting the history drops it
+                    chat_session.chat.history = history
+                    await chunks.aclose()
+                    raise
+                await chunks.aclose()
+
+        if search is not None:
+            with span("process_response"):
+                has_function_call, function_call_response = await search
+            if has_function_call:
+                # Pushed to the visitor's open tabs over /grid_events
+                image_grid, _ = function_call_response
+                with span("render_html"):
+                    grid_html = to_xml(image_grid)
+                chat_session.set_grid(grid_html)
+            reply.push("replace", "Found matching shoes based on your requirements!" if has_function_call
+                       else "".join(text))
+        elif not text:
+            reply.push("replace", "Sorry, I didn't get that. Could you rephrase?")
+    except QueueFullError:
+        reply.push("replace", "Server is busy, please retry shortly.")
+    except asyncio.TimeoutError:
+        reply.push("replace", "Sorry, that took too long. Could you say that again?")
+    except Exception as e:
+        reply.push("replace", f"An error occurred, but let's continue our conversation... Error: {str(e)}")
+    finally:
+        if search is not None and not search.done():
+            search.cancel()
+        if search is None and speculation is not None:
+            # No function call: the speculative ranking is never needed
+            speculation.cancel()
+        reply.finish()
 
 # Chat endpoint
 @app.post("/chat")
-def handle_chat(msg: str, messages: list[str] = None):
+async def handle_chat(msg: str, session, messages: list[str] = None):
     """Handle chat messages sent by the user."""
     if not messages:
         messages = []
@@ -117,26 +419,54 @@ def handle_chat(msg: str, messages: list[str] = None):
     has_function_call = False
     # Check for exit command
     if msg.strip().lower() in ['quit', 'exit', 'bye']:
+        sessions.end(session_id(session))
         return (
             ChatMessage(msg, True),
             ChatMessage("Thank you for shopping with us! Goodbye!", False),
             ChatInput()
         )
 
+    if STREAM_REPLIES:
+        # The model call starts now; the bubble connects to /chat_stream and receives tokens as they arrive
+        chat_session = sessions.get(session_id(session))
+        reply = chat_session.new_reply()
+        task = asyncio.create_task(stream_chat_turn(chat_session, msg, reply))
+        chat_tasks.add(task)
+        task.add_done_callback(chat_tasks.discard)
+        return (
+            ChatMessage(msg, True),
+            StreamingChatMessage(reply.stream_id),
+            ChatInput())
+
+    speculation = None
     try:
-        # Send message to the chatbot
-        response = chat.send_message(
-            msg,
-            tools=[{
-                'function_declarations': function_declarations
-            }]
-        )
-        print(response)
-        # Process function calls if any
-        has_function_call, function_call_response = process_response(response)
+        chat_session = sessions.get(session_id(session))
+        async with chat_session.lock:
+            # Bound the history sent with this turn
+            sessions.trim_history(chat_session)
+            speculation = start_speculation(chat_session, msg)
+
+            # Send message to the chatbot without blocking the event loop
+            with span("llm"):
+                response = await asyncio.wait_for(
+                    chat_session.chat.send_message_async(
+                        msg,
+                        tools=[{
+                            'function_declarations': function_declarations
+                        }]
+                    ),
+                    timeout=LLM_TIMEOUT
+                )
+        # Process function calls if any (CLIP encode + search run on the search executor)
+        with span("process_response"):
+            has_function_call, function_call_response = await search_executor.run(
+                process_response, response, speculation_result(speculation, response))
         if has_function_call:
-            app.state.latest_image_grid = function_call_response
-            print("UI Updated")
+            # Pushed to the visitor's open tabs over /grid_events
+            image_grid, _ = function_call_response
+            with span("render_html"):
+                grid_html = to_xml(image_grid)
+            chat_session.set_grid(grid_html)
 
         # Prepare response text
         response_text = "Found matching shoes based on your requirements!" if has_function_call else response.text
@@ -145,17 +475,31 @@ def handle_chat(msg: str, messages: list[str] = None):
             ChatMessage(msg, True),
             ChatMessage(response_text, False),
             ChatInput())
+    except QueueFullError:
+        return busy_response()
+    except asyncio.TimeoutError:
+        return (
+            ChatMessage(msg, True),
+            ChatMessage("Sorry, that took too long. Could you say that again?", False),
+            ChatInput()
+        )
     except Exception as e:
         return (
             ChatMessage(msg, True),
             ChatMessage(f"An error occurred, but let's continue our conversation... Error: {str(e)}", False),
             ChatInput()
         )
+    finally:
+        if speculation is not None:
+            # Timed-out or failed turns never use it; a queued speculation then never runs
+            speculation.cancel()
 
 # Main page route
 @app.get("/")
-def index():
+def index(session):
     """Render the main application page."""
+    chat_session = sessions.get(session_id(session))
+
     # Header section
     header = Div(cls="w-full bg-primary text-white p-4 mb-6 shadow-lg")(
         Div(cls="max-w-7xl mx-auto")(
@@ -167,6 +511,20 @@ def index():
     chat_column = Div(cls="w-1/3 h-[calc(100vh-5rem)] p-6 border-r")(
         Div(cls="bg-white rounded-lg shadow-lg p-4 h-full")(
             H2("Shopping Assistant", cls="mb-4 text-xl font-semibold"),
+            Script("""
+            // Assistant bubbles with data-stream receive their reply over server-sent events
+            function streamReplies() {
+                document.querySelectorAll(".chat-bubble[data-stream]").forEach((bubble) => {
+                    const source = new EventSource(bubble.dataset.stream);
+                    bubble.removeAttribute("data-stream");
+                    let text = "";
+                    source.addEventListener("token", (event) => { text += JSON.parse(event.data); bubble.textContent = text; });
+                    source.addEventListener("replace", (event) => { text = JSON.parse(event.data); bubble.textContent = text; });
+                    source.addEventListener("done", () => source.close());
+                });
+            }
+            document.body.addEventListener("htmx:afterSwap", streamReplies);
+            """),
             Form(
                 hx_post="/chat",
                 hx_target="#chatlist",
@@ -200,16 +558,37 @@ def index():
                     Button("Generate", cls="btn btn-primary")
                 )
             ),
-            Div(app.state.latest_image_grid, id='display-list'),
+            Form(
+                hx_post="/search_image",
+                hx_target="#display-list2",
+                hx_swap="outerHTML",
+                hx_encoding="multipart/form-data"
+            )(
+                Div(cls="flex space-x-2 mb-4")(
+                    Input(type="file", name="image", accept="image/*", cls="file-input file-input-bordered flex-grow"),
+                    Button("Search by photo", cls="btn btn-secondary")
+                )
+            ),
+            Div(NotStr(chat_session.grid_html), id='display-list', data_version=chat_session.grid_version),
             Script("""
-            setInterval(async () => {
-                const response = await fetch('/get_latest_images');
-                const text = await response.text();
-                // Replace the display-list content with the updated grid
-                document.getElementById("display-list").outerHTML = text;
-            }, 2000); // Poll every 5 seconds
+            const display = document.getElementById("display-list");
+            if (window.EventSource) {
+                // The server pushes a new grid only when this session's search results change
+                const source = new EventSource('/grid_events?version=' + display.dataset.version);
+                source.onmessage = (event) => { display.innerHTML = event.data; htmx.process(display); };
+            } else {
+                // Fallback: conditional polling, answered with 304 while the grid is unchanged
+                let etag = null;
+                setInterval(async () => {
+                    const response = await fetch('/get_latest_images', {headers: etag ? {'If-None-Match': etag} : {}});
+                    if (response.status === 304) return;
+                    etag = response.headers.get('ETag');
+                    display.innerHTML = await response.text();
+                    htmx.process(display);
+                }, 2000);
+            }
             """),
-            Div(app.state.latest_image_grid, id='display-list2'),
+            Div(NotStr(chat_session.grid_html), id='display-list2'),
         )
     )
     
@@ -218,10 +597,111 @@ def index():
     
     return Div(cls="min-h-screen")(header, main_content)
 
+@app.get("/health")
+def health():
+    """Liveness probe: the process is up and serving requests. Also reports LLM latency and cache hits."""
+    return JSONResponse({"status": "ok", "llm": llm_stats()})
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus scrape endpoint: span/request histograms, cache hit ratios, queue depths and warmup state."""
+    return Response(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/ready")
+def ready():
+    """Readiness probe: 200 once the model and indexes are warmed up, 503 with progress until then."""
+    return JSONResponse(warmup_state, status_code=200 if is_ready() else 503)
+
+# Shared secret for the /admin routes (sent as "Authorization: Bearer <token>"); they are disabled while it is empty
+ADMIN_TOKEN = get_setting("admin", "token")
+
+def admin_authorized(request):
+    """Check the request's bearer token against ADMIN_TOKEN in constant time."""
+    token = request.headers.get("authorization", "").removeprefix("Bearer ").strip()
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), str(ADMIN_TOKEN).encode())
+
+@app.get("/admin/index")
+def admin_index_status(request):
+    """Active and published index versions, swap counters and versions still draining."""
+    if not admin_authorized(request):
+        return Response("Forbidden", status_code=403)
+    return JSONResponse(index_registry.status())
+
+@app.post("/admin/index")
+async def admin_index(request, action: str = "reload", version: str = ""):
+    """
+    Switch the search index: "activate" a published version, "rollback" to the previous one, or
+    "reload" the manifest now. The new version is loaded and warmed before it is swapped in;
+    other workers follow through the manifest watcher.
+    """
+    if not admin_authorized(request):
+        return Response("Forbidden", status_code=403)
+    try:
+        if action == "activate":
+            set_active(INDEX_VERSIONS_DIR, version)
+        elif action == "rollback":
+            rollback_version(INDEX_VERSIONS_DIR)
+        elif action != "reload":
+            return JSONResponse({"error": f"Unknown action: {action}"}, status_code=400)
+        swapped = await asyncio.to_thread(index_registry.reload)
+    except (KeyError, ValueError) as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except Exception as e:
+        return JSONResponse({"error": str(e), **index_registry.status()}, status_code=500)
+    return JSONResponse({"swapped": swapped, **index_registry.status()})
+
 @app.get("/get_latest_images")
-def get_latest_images():
-    """Fetch the latest image grid."""
-    return app.state.latest_image_grid
+def get_latest_images(request, session):
+    """Fetch the latest image grid (polling fallback for clients without EventSource)."""
+    chat_session = sessions.get(session_id(session))
+    etag = f'"grid-{chat_session.session_id[:8]}-{chat_session.grid_version}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return HTMLResponse(chat_session.grid_html, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+@app.get("/chat_stream/{stream_id}")
+async def chat_stream(request, session, stream_id: str):
+    """Server-sent events carrying one streamed assistant reply; resumes after Last-Event-ID on reconnect."""
+    reply = sessions.get(session_id(session)).replies.get(stream_id)
+    if reply is None:
+        # 204 tells EventSource not to reconnect
+        return Response(status_code=204)
+    last_event_id = request.headers.get("last-event-id")
+    start = int(last_event_id) + 1 if last_event_id and last_event_id.isdigit() else 0
+
+    async def stream():
+        async for index, event, data in reply.follow(start):
+            yield f"id: {index}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+        yield "event: done\ndata: {}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Seconds between keep-alive comments on idle grid streams
+GRID_KEEPALIVE = 15
+
+@app.get("/grid_events")
+async def grid_events(request, session, version: int = 0):
+    """Server-sent events stream that pushes the session's grid whenever it changes."""
+    sid = session_id(session)
+    # EventSource sends the last seen event id when it reconnects
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id and last_event_id.isdigit():
+        version = int(last_event_id)
+
+    async def stream():
+        seen = version
+        while True:
+            chat_session = sessions.get(sid)
+            if chat_session.grid_version != seen:
+                seen = chat_session.grid_version
+                data = "\n".join(f"data: {line}" for line in chat_session.grid_html.splitlines())
+                yield f"id: {seen}\n{data}\n\n"
+            elif not await chat_session.wait_for_grid(seen, GRID_KEEPALIVE):
+                yield ": keep-alive\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 if __name__ == '__main__':
     uvicorn.run("main:app", host='0.0.0.0', port=int(os.getenv("PORT", default=5000)))
@@ -0,0 +1,432 @@
+"""
+Approximate nearest-neighbor search for large catalogs: an inverted-file (IVF) index with
+k-means coarse quantization and optional product quantization (PQ), in pure NumPy.
+
+Each vector is assigned to its closest coarse centroid ("inverted list"). A query only scores
+the vectors in its `nprobe` closest lists, which trades recall for latency. With PQ enabled,
+list members are scored from compact uint8 codes and the best candidates are re-ranked
+exactly against the vector store matrix.
+
+The index stores vector store row numbers and is persisted next to the store:
+    python -m src.ann_index build --lists 1024 --pq 64
+    python -m src.ann_index report --k 6 --nprobe 1,2,4,8,16,32
+"""
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from .vector_index import VectorIndex, l2_normalize, top_k_rows
+
+ANN_INDEX_DIR = "ivf"
+META_FILE = "meta.json"
+PQ_CODEBOOK_SIZE = 256
+ASSIGN_CHUNK_SIZE = 65536
+
+
+def _assign(vectors, centroids, spherical):
+    """Return the closest centroid for each vector, processed in chunks to bound memory."""
+    labels = np.empty(len(vectors), dtype=np.int64)
+    half_norms = None if spherical else 0.5 * np.einsum("ij,ij->i", centroids, centroids)
+    for start in range(0, len(vectors), ASSIGN_CHUNK_SIZE):
+        chunk = np.asarray(vectors[start:start + ASSIGN_CHUNK_SIZE], dtype=np.float32)
+        scores = chunk @ centroids.T
+        if half_norms is not None:
+            # argmin ||x - c||^2 == argmax (x.c - ||c||^2 / 2)
+            scores -= half_norms
+        labels[start:start + len(chunk)] = np.argmax(scores, axis=1)
+    return labels
+
+
+def kmeans(vectors, n_clusters, n_iter=20, seed=0, spherical=False):
+    """
+    Lloyd's k-means.
+
+    Parameters:
+        vectors (np.ndarray): (count x dim) training vectors.
+        n_clusters (int): Number of centroids.
+        n_iter (int): Number of assignment/update rounds.
+        seed (int): Random seed for initialization and empty-cluster reseeding.
+        spherical (bool): Assign by dot product and keep centroids unit-length (cosine k-means).
+
+    Returns:
+        np.ndarray: (n_clusters x dim) float32 centroids.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+
+    for _ in range(n_iter):
+        labels = _assign(vectors, centroids, spherical)
+        counts = np.bincount(labels, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():
+            # Re-seed empty clusters with random training points
+            centroids[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        if spherical:
+            centroids = l2_normalize(centroids)
+    return centroids
+
+
+class ProductQuantizer:
+    """
+    Splits vectors into `n_subvectors` chunks and encodes each chunk as the index of its
+    closest entry in a 256-entry codebook, so a 512-d float32 vector becomes e.g. 64 bytes.
+
+    Parameters:
+        codebooks (np.ndarray): (n_subvectors x 256 x sub_dim) float32 codebooks.
+    """
+
+    def __init__(self, codebooks):
+        self.codebooks = np.asarray(codebooks, dtype=np.float32)
+
+    @property
+    def n_subvectors(self):
+        return self.codebooks.shape[0]
+
+    @classmethod
+    def train(cls, vectors, n_subvectors, n_iter=15, seed=0):
+        """Train one codebook per subspace with k-means."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.shape[1] % n_subvectors:
+            raise ValueError(f"Dimension {vectors.shape[1]} is not divisible by {n_subvectors} subvectors")
+        sub_dim = vectors.shape[1] // n_subvectors
+        codebook_size = min(PQ_CODEBOOK_SIZE, len(vectors))
+        codebooks = np.zeros((n_subvectors, PQ_CODEBOOK_SIZE, sub_dim), dtype=np.float32)
+        for m in range(n_subvectors):
+            subspace = vectors[:, m * sub_dim:(m + 1) * sub_dim]
+            codebooks[m, :codebook_size] = kmeans(subspace, codebook_size, n_iter=n_iter, seed=seed + m)
+        return cls(codebooks)
+
+    def encode(self, vectors):
+        """Encode (count x dim) vectors into (count x n_subvectors) uint8 codes."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        sub_dim = self.codebooks.shape[2]
+        codes = np.empty((len(vectors), self.n_subvectors), dtype=np.uint8)
+        for m in range(self.n_subvectors):
+            subspace = vectors[:, m * sub_dim:(m + 1) * sub_dim]
+            codes[:, m] = _assign(subspace, self.codebooks[m], spherical=False)
+        return codes
+
+    def inner_product_table(self, query_vector):
+        """Precompute the query's dot product with every codebook entry: (n_subvectors x 256)."""
+        sub_queries = query_vector.reshape(self.n_subvectors, -1)
+        return np.einsum("mkd,md->mk", self.codebooks, sub_queries)
+
+    def score(self, table, codes):
+        """Approximate query.x for encoded vectors from a precomputed inner product table."""
+        return table[np.arange(self.n_subvectors), codes].sum(axis=1)
+
+
+class IVFIndex:
+    """
+    Inverted-file index over vector store rows.
+
+    Parameters:
+        centroids (np.ndarray): (n_lists x dim) unit-length coarse centroids.
+        lists (list): One int64 array of store rows per centroid.
+        quantizer (ProductQuantizer): Optional PQ encoder for the residuals.
+        codes (list): One (len(list) x n_subvectors) uint8 code array per list, when quantized.
+        nprobe (int): Default number of lists scanned per query.
+    """
+
+    def __init__(self, centroids, lists, quantizer=None, codes=None, nprobe=8):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.lists = list(lists)
+        self.quantizer = quantizer
+        self.codes = list(codes) if codes is not None else None
+        self.nprobe = nprobe
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(rows) for rows in self.lists)
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def train(cls, matrix, n_lists, pq_subvectors=0, train_size=100000, n_iter=20, nprobe=8, seed=0):
+        """
+        Train coarse centroids (and PQ codebooks) on a sample and index every row of the matrix.
+
+        Parameters:
+            matrix (np.ndarray): (count x dim) embedding matrix, e.g. the vector store memmap.
+            n_lists (int): Number of inverted lists; around sqrt(count) is a good start.
+            pq_subvectors (int): Number of PQ subvectors, or 0 to keep exact scoring within lists.
+            train_size (int): Maximum number of rows sampled for training.
+            n_iter (int): k-means iterations.
+            nprobe (int): Default nprobe stored with the index.
+            seed (int): Random seed.
+
+        Returns:
+            IVFIndex: Trained and populated index.
+        """
+        rng = np.random.default_rng(seed)
+        sample_rows = np.sort(rng.choice(len(matrix), min(train_size, len(matrix)), replace=False))
+        sample = l2_normalize(matrix[sample_rows])
+
+        centroids = kmeans(sample, n_lists, n_iter=n_iter, seed=seed, spherical=True)
+        quantizer = None
+        if pq_subvectors:
+            residuals = sample - centroids[_assign(sample, centroids, spherical=True)]
+            quantizer = ProductQuantizer.train(residuals, pq_subvectors, seed=seed)
+
+        index = cls(centroids, [np.empty(0, dtype=np.int64) for _ in range(len(centroids))],
+                    quantizer=quantizer,
+                    codes=[np.empty((0, pq_subvectors), dtype=np.uint8) for _ in range(len(centroids))]
+                    if quantizer else None,
+                    nprobe=nprobe)
+        index.add(matrix, np.arange(len(matrix), dtype=np.int64))
+        return index
+
+    def reset(self):
+        """Empty every inverted list while keeping the trained centroids and codebooks."""
+        with self._lock:
+            self.lists = [np.empty(0, dtype=np.int64) for _ in range(self.n_lists)]
+            if self.quantizer is not None:
+                self.codes = [np.empty((0, self.quantizer.n_subvectors), dtype=np.uint8)
+                              for _ in range(self.n_lists)]
+
+    def add(self, vectors, rows):
+        """
+        Incrementally insert vectors under the given store rows, without retraining.
+
+        Parameters:
+            vectors (np.ndarray): (count x dim) embeddings of the new products.
+            rows (np.ndarray): Their row numbers in the vector store.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        labels = np.empty(len(rows), dtype=np.int64)
+        chunk_codes = []
+        for start in range(0, len(rows), ASSIGN_CHUNK_SIZE):
+            chunk = l2_normalize(vectors[start:start + ASSIGN_CHUNK_SIZE])
+            chunk_labels = _assign(chunk, self.centroids, spherical=True)
+            labels[start:start + len(chunk)] = chunk_labels
+            if self.quantizer is not None:
+                chunk_codes.append(self.quantizer.encode(chunk - self.centroids[chunk_labels]))
+        codes = np.vstack(chunk_codes) if chunk_codes else None
+
+        order = np.argsort(labels, kind="stable")
+        boundaries = np.searchsorted(labels[order], np.arange(self.n_lists + 1))
+        with self._lock:
+            for list_id in np.flatnonzero(np.diff(boundaries)):
+                members = order[boundaries[list_id]:boundaries[list_id + 1]]
+                # Replace (not mutate) the arrays so concurrent searches see a consistent list
+                self.lists[list_id] = np.concatenate([self.lists[list_id], rows[members]])
+                if codes is not None:
+                    self.codes[list_id] = np.vstack([self.codes[list_id], codes[members]])
+
+    def remove(self, rows):
+        """
+        Drop store rows from their inverted lists (and their PQ codes), e.g. before re-adding changed vectors.
+
+        Parameters:
+            rows (np.ndarray): Row numbers in the vector store.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        with self._lock:
+            for list_id, members in enumerate(self.lists):
+                keep = ~np.isin(members, rows)
+                if keep.all():
+                    continue
+                self.lists[list_id] = members[keep]
+                if self.codes is not None:
+                    self.codes[list_id] = self.codes[list_id][keep]
+
+    def search(self, query_vector, k, nprobe=None, matrix=None, rerank=4):
+        """
+        Approximate top-k search.
+
+        Parameters:
+            query_vector (np.ndarray): Query embedding of length dim.
+            k (int): Number of matches to return.
+            nprobe (int): Lists to scan; defaults to the index's nprobe.
+            matrix (np.ndarray): Normalized vector store matrix. Required without PQ; with PQ it
+                is used to re-rank the best `k * rerank` candidates exactly.
+            rerank (int): Candidate multiplier for exact re-ranking of PQ results.
+
+        Returns:
+            tuple: (rows, scores) arrays of length <= k, best first.
+        """
+        query = l2_normalize(query_vector).ravel()
+        nprobe = min(nprobe or self.nprobe, self.n_lists)
+        probe, _ = top_k_rows(self.centroids @ query, nprobe)
+
+        lists, codes = self.lists, self.codes
+        rows = np.concatenate([lists[list_id] for list_id in probe])
+        if not len(rows):
+            return rows, np.empty(0, dtype=np.float32)
+
+        if self.quantizer is None:
+            if matrix is None:
+                raise ValueError("An IVF index without PQ needs the vector matrix to score candidates")
+            # Sorted rows turn the memmap gather into a forward scan
+            rows = np.sort(rows)
+            best, best_scores = top_k_rows(np.asarray(matrix[rows] @ query), k)
+            return rows[best], best_scores
+
+        # q.x ~= q.centroid + q.residual, with q.residual read from the PQ lookup table
+        table = self.quantizer.inner_product_table(query)
+        centroid_scores = self.centroids[probe] @ query
+        scores = np.concatenate([
+            centroid_scores[i] + self.quantizer.score(table, codes[list_id])
+            for i, list_id in enumerate(probe)
+        ])
+        if matrix is None:
+            best, best_scores = top_k_rows(scores, k)
+            return rows[best], best_scores
+
+        candidates, _ = top_k_rows(scores, k * rerank)
+        candidate_rows = np.sort(rows[candidates])
+        best, best_scores = top_k_rows(np.asarray(matrix[candidate_rows] @ query), k)
+        return candidate_rows[best], best_scores
+
+    def save(self, directory):
+        """
+        Persist the index as .npy arrays plus a small JSON metadata file.
+
+        Every file is written under a temporary name and renamed into place, the metadata
+        last, so a reader never loads a partially written file.
+        """
+        os.makedirs(directory, exist_ok=True)
+        lists, codes = self.lists, self.codes
+        sizes = np.array([len(rows) for rows in lists], dtype=np.int64)
+        arrays = {
+            "centroids.npy": self.centroids,
+            "list_offsets.npy": np.concatenate([[0], np.cumsum(sizes)]),
+            "list_rows.npy": np.concatenate(lists),
+        }
+        if self.quantizer is not None:
+            arrays["pq_codebooks.npy"] = self.quantizer.codebooks
+            arrays["pq_codes.npy"] = np.vstack(codes)
+        tmp_suffix = f".{os.getpid()}.tmp"
+        for name, array in arrays.items():
+            # np.save appends .npy to names without it, so write through a file handle
+            with open(os.path.join(directory, name + tmp_suffix), "wb") as file:
+                np.save(file, array)
+        with open(os.path.join(directory, META_FILE + tmp_suffix), "w") as file:
+            json.dump({
+                "n_lists": self.n_lists,
+                "count": int(sizes.sum()),
+                "nprobe": self.nprobe,
+                "pq_subvectors": self.quantizer.n_subvectors if self.quantizer is not None else 0,
+            }, file)
+        for name in list(arrays) + [META_FILE]:
+            os.replace(os.path.join(directory, name + tmp_suffix), os.path.join(directory, name))
+
+
+def ivf_index_exists(directory):
+    """Check whether a directory contains a saved IVF index."""
+    return os.path.exists(os.path.join(directory, META_FILE))
+
+
+def load_ivf_index(directory):
+    """
+    Load an IVF index saved with IVFIndex.save.
+
+    Parameters:
+        directory (str): Index directory.
+
+    Returns:
+        tuple: (IVFIndex, metadata dict).
+    """
+    with open(os.path.join(directory, META_FILE), "r") as file:
+        meta = json.load(file)
+    offsets = np.load(os.path.join(directory, "list_offsets.npy"))
+    flat_rows = np.load(os.path.join(directory, "list_rows.npy"))
+    lists = [flat_rows[offsets[i]:offsets[i + 1]] for i in range(meta["n_lists"])]
+
+    quantizer, codes = None, None
+    if meta["pq_subvectors"]:
+        quantizer = ProductQuantizer(np.load(os.path.join(directory, "pq_codebooks.npy")))
+        flat_codes = np.load(os.path.join(directory, "pq_codes.npy"))
+        codes = [flat_codes[offsets[i]:offsets[i + 1]] for i in range(meta["n_lists"])]
+
+    index = IVFIndex(np.load(os.path.join(directory, "centroids.npy")), lists,
+                     quantizer=quantizer, codes=codes, nprobe=meta["nprobe"])
+    return index, meta
+
+
+def recall_report(ann_index, exact_index, queries, k, nprobe_values, rerank=4):
+    """
+    Measure recall@k and latency of the IVF index against exact search for several nprobe values.
+
+    Parameters:
+        ann_index (IVFIndex): Index under test.
+        exact_index (VectorIndex): Exact index over the same rows (ground truth and re-rank matrix).
+        queries (np.ndarray): (queries x dim) query embeddings.
+        k (int): Number of neighbours compared.
+        nprobe_values (list): nprobe settings to evaluate.
+        rerank (int): Candidate multiplier for PQ re-ranking.
+
+    Returns:
+        list: One dict per nprobe with recall, mean/p95 latency (ms) and exact-search latency.
+    """
+    exact_latencies, truth = [], []
+    for query in queries:
+        start = time.perf_counter()
+        rows, _ = exact_index.search(query, k)
+        exact_latencies.append(time.perf_counter() - start)
+        truth.append(set(rows.tolist()))
+
+    report = []
+    for nprobe in nprobe_values:
+        latencies, hits = [], 0
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            rows, _ = ann_index.search(query, k, nprobe=nprobe, matrix=exact_index.matrix, rerank=rerank)
+            latencies.append(time.perf_counter() - start)
+            hits += len(expected.intersection(rows.tolist()))
+        report.append({
+            "nprobe": nprobe,
+            "recall": hits / max(1, sum(len(expected) for expected in truth)),
+            "mean_ms": 1000 * float(np.mean(latencies)),
+            "p95_ms": 1000 * float(np.percentile(latencies, 95)),
+            "exact_mean_ms": 1000 * float(np.mean(exact_latencies)),
+        })
+    return report
+
+
+if __name__ == "__main__":
+    from .vector_store import load_vector_store
+
+    parser = argparse.ArgumentParser(description="Build or evaluate the IVF approximate index.")
+    parser.add_argument("command", choices=["build", "report"])
+    parser.add_argument("--store", default="vector_store", help="Vector store directory")
+    parser.add_argument("--lists", type=int, default=0, help="Inverted lists (default: ~sqrt(count))")
+    parser.add_argument("--pq", type=int, default=0, help="PQ subvectors (0 disables PQ)")
+    parser.add_argument("--nprobe", default="8", help="Default nprobe (build) or comma-separated values (report)")
+    parser.add_argument("--k", type=int, default=6, help="Neighbours compared in the report")
+    parser.add_argument("--queries", type=int, default=200, help="Number of report queries")
+    args = parser.parse_args()
+
+    store = load_vector_store(args.store)
+    exact = VectorIndex(store.matrix, normalized=store.normalized)
+    index_dir = os.path.join(args.store, ANN_INDEX_DIR)
+
+    if args.command == "build":
+        n_lists = args.lists or max(1, int(np.sqrt(len(store))))
+        start = time.perf_counter()
+        ivf = IVFIndex.train(exact.matrix, n_lists, pq_subvectors=args.pq, nprobe=int(args.nprobe))
+        ivf.save(index_dir)
+        print(f"Indexed {len(ivf)} vectors into {n_lists} lists in {time.perf_counter() - start:.1f}s -> {index_dir}")
+    else:
+        ivf, _ = load_ivf_index(index_dir)
+        # Perturbed catalog vectors stand in for text queries, so no model is needed
+        rng = np.random.default_rng(0)
+        sample = exact.matrix[np.sort(rng.choice(len(exact), min(args.queries, len(exact)), replace=False))]
+        queries = l2_normalize(sample + rng.normal(scale=0.05, size=sample.shape).astype(np.float32))
+        nprobe_values = [int(value) for value in args.nprobe.split(",")]
+        print(f"{'nprobe':>7} {'recall@' + str(args.k):>10} {'mean ms':>9} {'p95 ms':>8} {'exact ms':>9}")
+        for row in recall_report(ivf, exact, queries, args.k, nprobe_values):
+            print(f"{row['nprobe']:>7} {row['recall']:>10.3f} {row['mean_ms']:>9.2f} "
+                  f"{row['p95_ms']:>8.2f} {row['exact_mean_ms']:>9.2f}")
@@ -0,0 +1,127 @@
+"""
+Micro-batching scheduler: gathers concurrent encode requests into one batched model call.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class BatchEncoder:
+    """
+    Collects items submitted from many threads and encodes them together.
+
+    A background thread waits for the first pending item, then keeps collecting until either
+    `max_batch_size` items are queued or `max_wait_ms` has passed, and runs `encode_batch`
+    once for the whole group. Each caller gets its own result back through a Future.
+
+    Parameters:
+        encode_batch (callable): Takes a list of items and returns a sequence of results in the same order.
+        max_batch_size (int): Largest batch passed to encode_batch.
+        max_wait_ms (float): How long to wait for more items after the first one arrives.
+        name (str): Name of the worker thread.
+    """
+
+    def __init__(self, encode_batch, max_batch_size=16, max_wait_ms=5, name="batch-encoder"):
+        self.encode_batch = encode_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.name = name
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._queue_delay_total = 0.0
+        self._queue_delay_max = 0.0
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                    self._thread.start()
+
+    def submit(self, item):
+        """
+        Queue an item for encoding.
+
+        Parameters:
+            item: A single input accepted by encode_batch.
+
+        Returns:
+            Future: Resolves to the encoded result for this item.
+        """
+        self._ensure_started()
+        future = Future()
+        self._queue.put((item, future, time.perf_counter()))
+        return future
+
+    def encode(self, item, timeout=None):
+        """
+        Encode a single item through the batching queue and wait for the result.
+
+        Raises:
+            TimeoutError: If no result arrives within `timeout` seconds (None waits indefinitely).
+        """
+        return self.submit(item).result(timeout=timeout)
+
+    def _collect(self):
+        """Block for the first item, then gather more until the batch is full or the window closes."""
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            items = [item for item, _, _ in batch]
+            futures = [future for _, future, _ in batch]
+            try:
+                results = self.encode_batch(items)
+                if len(results) != len(items):
+                    raise ValueError(f"{self.name}: encode_batch returned {len(results)} results for {len(items)} items")
+                for future, result in zip(futures, results):
+                    future.set_result(result)
+            except Exception as e:
+                # Every caller must be woken up, or it waits forever
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+
+            delays = [started - queued_at for _, _, queued_at in batch]
+            with self._stats_lock:
+                self._batches += 1
+                self._items += len(batch)
+                self._queue_delay_total += sum(delays)
+                self._queue_delay_max = max(self._queue_delay_max, max(delays))
+
+    def queue_depth(self):
+        """Number of items waiting for the next batch."""
+        return self._queue.qsize()
+
+    def stats(self):
+        """Return batch count, fill rate and queueing delay metrics."""
+        with self._stats_lock:
+            batches, items = self._batches, self._items
+            delay_total, delay_max = self._queue_delay_total, self._queue_delay_max
+        mean_batch_size = items / batches if batches else 0.0
+        return {
+            "batches": batches,
+            "items": items,
+            "mean_batch_size": mean_batch_size,
+            "fill_rate": mean_batch_size / self.max_batch_size,
+            "mean_queue_delay_ms": 1000 * delay_total / items if items else 0.0,
+            "max_queue_delay_ms": 1000 * delay_max,
+            "queue_depth": self.queue_depth(),
+        }
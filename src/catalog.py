@@ -0,0 +1,180 @@
+"""
+In-memory catalog manifest and rendered-fragment cache for the product grid.
+
+The manifest lists the images directory once and keeps each image's path, size, mtime and
+content version in memory, so rendering a grid does not stat or glob the filesystem. It is
+refreshed when the directory's mtime changes (files added, removed or renamed), checked at
+most every `check_interval` seconds, plus a full rescan every `rescan_interval` seconds to
+catch images overwritten in place.
+"""
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from .thumbnails import source_version
+
+
+class CatalogEntry:
+    """One image of the catalog."""
+
+    __slots__ = ("name", "path", "mtime_ns", "size", "_version")
+
+    def __init__(self, name, path, mtime_ns, size):
+        self.name = name
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self._version = None
+
+    @property
+    def version(self):
+        """Short content version used as the ?v= cache-busting parameter, hashed on first use."""
+        if self._version is None:
+            self._version = source_version(self.path)
+        return self._version
+
+
+class CatalogManifest:
+    """
+    Thread-safe listing of the images directory.
+
+    Parameters:
+        image_dir (str): Directory of product images.
+        formats (list): Allowed file extensions, e.g. ['.jpg', '.png'].
+        check_interval (float): Minimum seconds between directory mtime checks.
+        rescan_interval (float): Seconds between full rescans.
+    """
+
+    def __init__(self, image_dir, formats, check_interval=2.0, rescan_interval=300.0):
+        self.image_dir = image_dir
+        self.formats = {ext.lower() for ext in formats}
+        self.check_interval = check_interval
+        self.rescan_interval = rescan_interval
+        self.scans = 0
+        self._entries = None
+        self._names = []
+        self._dir_mtime_ns = None
+        self._checked_at = 0.0
+        self._scanned_at = 0.0
+        self._lock = threading.Lock()
+
+    def _scan(self):
+        """List the directory, keeping entries (and their hashed versions) of unchanged files. Caller holds the lock."""
+        previous = self._entries or {}
+        entries = {}
+        try:
+            self._dir_mtime_ns = os.stat(self.image_dir).st_mtime_ns
+            with os.scandir(self.image_dir) as listing:
+                for item in listing:
+                    if not item.is_file() or os.path.splitext(item.name)[1].lower() not in self.formats:
+                        continue
+                    stat = item.stat()
+                    entry = previous.get(item.name)
+                    if entry is None or entry.mtime_ns != stat.st_mtime_ns or entry.size != stat.st_size:
+                        entry = CatalogEntry(item.name, os.path.join(self.image_dir, item.name),
+                                             stat.st_mtime_ns, stat.st_size)
+                    entries[item.name] = entry
+        except FileNotFoundError:
+            self._dir_mtime_ns = None
+        self._entries = entries
+        self._names = sorted(entries)
+        self._scanned_at = time.monotonic()
+        self.scans += 1
+
+    def _refresh(self):
+        """Rescan if the directory changed or the rescan interval passed; stat at most every check_interval."""
+        now = time.monotonic()
+        if self._entries is not None and now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if self._entries is not None and now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+            try:
+                dir_mtime_ns = os.stat(self.image_dir).st_mtime_ns
+            except FileNotFoundError:
+                dir_mtime_ns = None
+            if self._entries is None or dir_mtime_ns != self._dir_mtime_ns or now - self._scanned_at > self.rescan_interval:
+                self._scan()
+
+    def __len__(self):
+        self._refresh()
+        return len(self._entries)
+
+    def get(self, name):
+        """
+        Look up an image by file name.
+
+        Parameters:
+            name (str): File name (or a path; only the base name is used).
+
+        Returns:
+            CatalogEntry or None: The entry, or None if the image is not in the catalog.
+        """
+        self._refresh()
+        return self._entries.get(os.path.basename(name))
+
+    def random_paths(self, count):
+        """Return up to `count` distinct random image paths."""
+        self._refresh()
+        names = self._names
+        return [self._entries[name].path for name in random.sample(names, min(count, len(names)))]
+
+    def stats(self):
+        """Return the number of cataloged images and directory scans."""
+        return {"images": len(self._entries or {}), "scans": self.scans}
+
+
+class FragmentCache:
+    """
+    Bounded LRU of rendered HTML fragments.
+
+    Parameters:
+        max_size (int): Maximum number of cached fragments.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_render(self, key, render):
+        """
+        Return the cached fragment for a key, rendering and caching it on a miss.
+
+        Parameters:
+            key (tuple): Cache key; must change whenever the rendered output would.
+            render (callable): Returns the HTML string.
+
+        Returns:
+            str: The HTML fragment.
+        """
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return html
+            self.misses += 1
+        html = render()
+        with self._lock:
+            self._entries[key] = html
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return html
+
+    def stats(self):
+        """Return hit/miss counters and the current size."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+        }
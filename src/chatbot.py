@@ -1,28 +1,76 @@
-import google.generativeai as genai
 import os
 from fasthtml.common import *
-import google.generativeai as genai
 import json
-import yaml
-import random
-from pathlib import Path
-from clip_search import perform_search
+from urllib.parse import quote
+from .clip_search import rank_search, index_snapshot, similar_products, encode_image_query, rank_vector
+from .settings import config, get_setting
+from .search_sessions import SearchResultsCache
+from .thumbnails import THUMBNAIL_WIDTHS
+from .catalog import CatalogManifest, FragmentCache
+from .keyword_index import ATTRIBUTES
+from .metrics import span
+from .llm import create_provider, ResponseCache, CachingChat
+from .speculative_search import SpeculativeSearch
 
-# Load the configuration file to retrieve API keys and other settings
-try:
-    with open('config.yaml', 'rt') as f:
-        config = yaml.safe_load(f.read())
-except:
-    print("Got an Error While Reading Config")
+# LLM provider (Gemini by default; "stub"/"replay" run offline), see the llm section of config.yaml
+llm_settings = {
+    "generation_config": {
+        "temperature": 0.7,
+        "top_p": 0.8,
+        "top_k": 40
+    },
+    **(config.get('llm') or {})
+}
+llm_provider = create_provider(llm_settings, api_key=config.get('gemini-api-key'))
 
-# Set your API key for Google Generative AI
-genai.configure(api_key=config['gemini-api-key'])
+# Identical turns (same history, same message) are answered from this cache
+response_cache = ResponseCache(max_size=llm_settings.get('cache_size', 1024)) \
+    if llm_settings.get('cache_size', 1024) else None
+
+
+def llm_stats():
+    """
+    Provider call latency and response cache counters.
+
+    Returns:
+        dict: Provider name, latency stats and cache stats (None when caching is disabled).
+    """
+    return {
+        "provider": llm_provider.name,
+        "latency": llm_provider.latency.stats(),
+        "cache": response_cache.stats() if response_cache is not None else None,
+    }
 
 # Configuration for handling local images
 LOCAL_IMAGE_DIR = "images"  # Directory where local images are stored
 SUPPORTED_FORMATS = ['.jpg', '.jpeg', '.png', '.gif']  # Allowed image formats
 IMAGES_TO_DISPLAY = 6  # Number of images to display at once
 
+# Directory listing kept in memory, so grids never stat or glob the images directory
+catalog = CatalogManifest(
+    LOCAL_IMAGE_DIR, SUPPORTED_FORMATS,
+    check_interval=get_setting("catalog", "check_interval_seconds", 2.0),
+    rescan_interval=get_setting("catalog", "rescan_interval_seconds", 300.0),
+)
+# Rendered card HTML keyed on (image, label, product id, image version)
+card_cache = FragmentCache(max_size=get_setting("catalog", "card_cache_size", 10000))
+
+# Each search ranks this many products once; further pages are slices of the cached ranking
+RESULTS_DEPTH = get_setting("results", "depth", 500)
+MAX_PAGE_SIZE = 48
+# Neighbors ranked for "more like this"; matches the default of `python -m src.similar_search`
+SIMILAR_DEPTH = get_setting("similar", "depth", 48)
+search_results = SearchResultsCache(
+    max_entries=get_setting("results", "max_entries", 1000),
+    ttl=get_setting("results", "ttl_seconds", 1800),
+)
+# Rankings prefetched while the LLM answers, reused when the model searches for something close
+speculative_search = SpeculativeSearch(
+    depth=RESULTS_DEPTH,
+    threshold=get_setting("speculative", "threshold", 0.9),
+    min_candidates=IMAGES_TO_DISPLAY,
+)
+
 # Instructions for the LLM to guide its interaction
 instructions_for_llm = """
 You are a knowledgeable shoe recommendation assistant. Help the customer find the perfect shoes based on their preferences.
@@ -59,45 +107,93 @@ def get_random_images(count=IMAGES_TO_DISPLAY):
     Returns:
         list: List of paths to the selected images.
     """
-    image_files = []
-    for ext in SUPPORTED_FORMATS:
-        image_files.extend(Path(LOCAL_IMAGE_DIR).glob(f'*{ext}'))
-    
-    if not image_files:
+    if not len(catalog):
         raise Exception("No images found in the specified directory")
-    
+
     # Select random unique images
-    selected_images = random.sample(image_files, min(count, len(image_files)))
-    return [str(img) for img in selected_images]
+    return catalog.random_paths(count)
 
-def create_image_card(image_path, prompt):
+def create_image_card(image_path, prompt, product_id=None):
     """
     Create a card component for a single image.
 
     Parameters:
         image_path (str): Path to the image.
         prompt (str): Prompt or description for the image.
+        product_id (str): Vector store id; adds a "More like this" button when given.
 
     Returns:
         Card or Div: The generated card component.
     """
-    if os.path.exists(image_path):
+    entry = catalog.get(image_path)
+    if entry is not None:
+        # Versioned thumbnail URLs can be cached forever by the browser
+        image_url = f"/images/{entry.name}"
+        version = entry.version
+        srcset = ", ".join(f"{image_url}?w={width}&fmt=webp&v={version} {width}w" for width in THUMBNAIL_WIDTHS)
         return Card(
-            Img(src=f"/images/{os.path.basename(image_path)}", 
+            Img(src=f"{image_url}?w={THUMBNAIL_WIDTHS[0]}&fmt=jpeg&v={version}",
+                srcset=srcset,
+                sizes="(min-width: 1024px) 33vw, (min-width: 768px) 50vw, 100vw",
+                loading="lazy",
                 alt="Local image", 
                 cls="w-full h-64 object-cover"),
             Div(P(B("Prompt: "), prompt, cls="text-sm"), cls="p-2"),
+            *([Button("More like this",
+                      hx_get=f"/similar/{quote(product_id)}",
+                      hx_target="#display-list2",
+                      hx_swap="outerHTML",
+                      cls="btn btn-sm btn-outline m-2")] if product_id is not None else []),
         )
     else:
         return Div(f"Image not found: {image_path}", cls="text-red-500")
 
-def create_image_grid(image_paths, prompt):
+def card_html(image_path, prompt, product_id=None):
+    """
+    HTML of an image card, rendered once per (image, label, product id, image version).
+
+    Parameters:
+        image_path (str): Path to the image.
+        prompt (str): Prompt or description for the image.
+        product_id (str): Vector store id, for "More like this".
+
+    Returns:
+        str: The card's HTML.
+    """
+    entry = catalog.get(image_path)
+    key = (os.path.basename(image_path), prompt, product_id, entry.version if entry is not None else None)
+    return card_cache.get_or_render(key, lambda: to_xml(create_image_card(image_path, prompt, product_id)))
+
+def load_more_sentinel(result_id, cursor):
+    """
+    Placeholder that fetches the next page when scrolled into view and replaces itself with it.
+
+    Parameters:
+        result_id (str): Cached ranking id.
+        cursor (int): Offset of the next page, or None when the ranking is exhausted.
+
+    Returns:
+        Div or None: The sentinel, or None at the end of the results.
+    """
+    if cursor is None:
+        return None
+    return Div(
+        P("Loading more...", cls="text-sm text-gray-500"),
+        hx_get=f"/results/{result_id}?cursor={cursor}",
+        hx_trigger="revealed",
+        hx_swap="outerHTML",
+        cls="p-2"
+    )
+
+def create_image_grid(image_paths, prompt, more=None, product_ids=None):
     """
     Create the complete image grid with a status message.
 
     Parameters:
         image_paths (list): List of paths to images.
         prompt (str): Search prompt or description.
+        more (Div): Optional load-more sentinel placed after the cards.
+        product_ids (list): Vector store ids aligned with image_paths, for "More like this".
 
     Returns:
         Div: A container with the image grid and status message.
@@ -110,29 +206,100 @@ def create_image_grid(image_paths, prompt):
         ),
         # Image grid
         Div(
-            *[create_image_card(img_path, prompt if prompt else f"Random {i+1}") 
-              for i, img_path in enumerate(image_paths)],
+            NotStr("".join(card_html(img_path, prompt if prompt else f"Random {i+1}",
+                                     product_ids[i] if product_ids is not None else None)
+                           for i, img_path in enumerate(image_paths))),
+            *([more] if more is not None else []),
             cls="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-8"
         ),
         id='display-list2'
     )
 
-def generate_custom(prompt):
+def render_ranking(snapshot, label, embedding, rows, scores, filters=None):
+    """
+    Cache a ranking for pagination and render its first page.
+
+    Parameters:
+        snapshot (IndexSnapshot): Index version the rows were ranked on.
+        label (str): Shown as the search prompt.
+        embedding (np.ndarray): Query embedding.
+        rows (np.ndarray): Ranked vector store rows.
+        scores (np.ndarray): Scores aligned with rows.
+        filters (dict): Attribute filters applied to the search.
+
+    Returns:
+        Div: The image grid.
+    """
+    store = snapshot.store
+    # Product ids let later pages be served from a newer index version
+    results = search_results.create(label, filters, embedding, rows, scores,
+                                    version=snapshot.version, ids=[store.ids[row] for row in rows])
+    page_rows, next_cursor = results.page(0, IMAGES_TO_DISPLAY)
+    with span("path_lookup"):
+        image_paths = [store.paths[row] for row in page_rows]
+        product_ids = [store.ids[row] for row in page_rows]
+
+    # Create image grid with status message
+    with span("render_cards"):
+        return create_image_grid(image_paths, label, more=load_more_sentinel(results.result_id, next_cursor),
+                                 product_ids=product_ids)
+
+def generate_similar(product_id):
+    """
+    Image grid of the products most similar to a catalog product, from its stored vector.
+
+    Parameters:
+        product_id (str): Vector store id of the product.
+
+    Returns:
+        Div: The image grid.
+
+    Raises:
+        KeyError: If the product is not in the catalog.
+    """
+    with index_snapshot() as snapshot:
+        embedding, rows, scores = similar_products(product_id, SIMILAR_DEPTH, snapshot=snapshot)
+        return render_ranking(snapshot, f"More like {product_id}", embedding, rows, scores)
+
+def generate_from_image(data):
+    """
+    Image grid of the products most similar to an uploaded photo.
+
+    Parameters:
+        data (bytes): Encoded image, already checked against the upload size limit.
+
+    Returns:
+        Div: The image grid.
+
+    Raises:
+        ValueError: If the upload is not a readable image or has too many pixels.
+    """
+    embedding = encode_image_query(data)
+    with index_snapshot() as snapshot:
+        rows, scores = rank_vector(embedding, RESULTS_DEPTH, snapshot=snapshot)
+        return render_ranking(snapshot, "Uploaded photo", embedding, rows, scores)
+
+def generate_custom(prompt, filters=None, speculation=None):
     """
     Generate a custom image grid based on a search prompt.
 
     Parameters:
         prompt (str): Text prompt for the search.
+        filters (dict): Optional attribute filters (gender, color, occasion, style).
+        speculation (Speculation): Ranking prefetched during the LLM turn, reused when close enough.
 
     Returns:
         tuple: Image grid and input field components.
     """
-    # Get top matching images based on the prompt
-    image_paths = perform_search(prompt)  # Call search function
-    
-    # Create image grid with status message
-    image_grid = create_image_grid(image_paths, prompt)
-    
+    # Rank the catalog once and cache the ranking for the following pages
+    with index_snapshot() as snapshot:
+        reused = speculative_search.reuse(speculation, prompt, filters, snapshot) if speculation is not None else None
+        if reused is not None:
+            embedding, rows, scores = reused
+        else:
+            embedding, rows, scores = rank_search(prompt, filters=filters, depth=RESULTS_DEPTH, snapshot=snapshot)
+        image_grid = render_ranking(snapshot, prompt, embedding, rows, scores, filters)
+
     # Clear the input field
     clear_input = Input(
         id="new-prompt",
@@ -143,6 +310,34 @@ def generate_custom(prompt):
     )
     return image_grid, clear_input
 
+def render_results_page(result_id, cursor, limit=IMAGES_TO_DISPLAY):
+    """
+    Render one page of a cached ranking, card by card, so the response can be streamed.
+
+    Parameters:
+        result_id (str): Cached ranking id.
+        cursor (int): Offset of the first result.
+        limit (int): Page size, capped at MAX_PAGE_SIZE.
+
+    Yields:
+        str: HTML of each card, then the next load-more sentinel.
+    """
+    results = search_results.get(result_id)
+    if results is None:
+        yield to_xml(Div("These results have expired, please search again.", cls="text-gray-500 p-2"))
+        return
+    # Look the page up before streaming, so no index version is held while the client reads
+    with index_snapshot() as snapshot:
+        store = snapshot.store
+        page_rows, next_cursor = results.page(cursor, min(max(1, limit), MAX_PAGE_SIZE),
+                                              version=snapshot.version, row_of=store.row_of)
+        page = [(store.paths[row], store.ids[row]) for row in page_rows]
+    for image_path, product_id in page:
+        yield card_html(image_path, results.query, product_id)
+    more = load_more_sentinel(result_id, next_cursor)
+    if more is not None:
+        yield to_xml(more)
+
 # Function declaration for Gemini API
 function_declarations = [{
     "name": "perform_search_wrapper",
@@ -154,6 +349,15 @@ function_declarations = [{
             "text_query": {
                 "type": "string",
                 "description": "Comprehensive search query based on user requirements"
+            },
+            # Optional structured filters; only set when the user stated the preference
+            **{
+                name: {
+                    "type": "string",
+                    "enum": values,
+                    "description": f"Required {name}, only if the user specified it"
+                }
+                for name, values in ATTRIBUTES.items()
             }
         },
         "required": ["text_query"]
@@ -167,14 +371,7 @@ def initialize_chat():
     Returns:
         Chat: Chat instance with predefined instructions.
     """
-    model = genai.GenerativeModel("gemini-pro",
-                                generation_config={
-                                    "temperature": 0.7,
-                                    "top_p": 0.8,
-                                    "top_k": 40
-                                })
-    
-    chat = model.start_chat(history=[
+    chat = llm_provider.start_chat(history=[
         {
             "role": "user",
             "parts": [instructions_for_llm]
@@ -184,38 +381,44 @@ def initialize_chat():
             "parts": ["Hello! I'm your shoe shopping assistant. What type of shoes are you looking for today?"]
         }
     ])
+    if response_cache is not None:
+        chat = CachingChat(chat, response_cache)
     return chat
 
-def perform_search_wrapper(text_query: str):
+def perform_search_wrapper(text_query: str, speculation=None, **filters):
     """
     Call this function to look for the desired shoes.
 
     Args:
         text_query (str): Input text query containing user shoe requirements curated by LLM.
+        speculation (Speculation): Speculative ranking of this turn, if one finished in time.
+        **filters: Optional attribute filters (gender, color, occasion, style).
 
     Returns:
         tuple: Image grid and input field components.
     """
-    print("\nSearching for shoes with criteria:", text_query)
-    response = generate_custom(text_query)
+    print("\nSearching for shoes with criteria:", text_query, filters or "")
+    response = generate_custom(text_query, filters=filters, speculation=speculation)
     return response
 
-def process_response(response):
+def process_response(response, speculation=None):
     """
     Process the model's response and handle function calls.
 
     Parameters:
-        response (Response): Model's response to process.
+        response (LLMResponse): Model's response to process.
+        speculation (Speculation): Speculative ranking of this turn, if one finished in time.
 
     Returns:
         tuple: Status and processed response, if applicable.
     """
     try:
-        function_call = response.candidates[0].content.parts[0].function_call
-        args = function_call.args
-        if function_call.name == "perform_search_wrapper":
+        function_call = response.function_call
+        if function_call is not None and function_call.name == "perform_search_wrapper":
+            args = function_call.args
             # Parse arguments and call the function
-            response = perform_search_wrapper(args["text_query"])
+            filters = {name: args[name] for name in ATTRIBUTES if args.get(name)}
+            response = perform_search_wrapper(args["text_query"], speculation=speculation, **filters)
             return True, response
     except Exception as e:
         print(f"Error processing response: {str(e)}")
@@ -1,45 +1,251 @@
-import pandas as pd
+import atexit
+import io
+import os
 import re
-from transformers import CLIPTokenizerFast, CLIPProcessor, CLIPModel
-import torch
+import threading
+import time
 from PIL import Image
 import PIL
-import json
 import numpy as np
-import pandas as pd
-from sklearn.metrics.pairwise import cosine_similarity
-import ast
+from .vector_store import vector_store_exists, convert_csv_to_store
+from .keyword_index import reciprocal_rank_fusion
+from .settings import get_setting
+from .embedding_cache import EmbeddingCache
+from .batch_encoder import BatchEncoder
+from .metrics import span
+from .similar_search import drop_self
+from .index_registry import IndexRegistry, IndexSnapshot
 
-# Read path dictionary from the file
-# This dictionary contains mappings of product names to their respective image file paths
-with open("paths_dict.json", 'r') as file:
-    image_paths_dict = json.load(file)
+# Importing this module is cheap: the vector store, indexes, tokenizer and model are loaded
+# on first use (or by warmup() in the background), not at import time.
+IMPORTED_AT = time.monotonic()
 
-# Reading Vectors Stored
-# The CSV file contains precomputed embeddings for images
-vectors_df = pd.read_csv('vectors.csv')
+# Binary vector store (memory-mapped embedding matrix + id/path sidecar)
+VECTOR_STORE_DIR = "vector_store"
 
-# Convert string representation of vectors back to numpy arrays
-# Each embedding is stored as a string; it needs to be converted back to a numpy array
-vectors_df['image_embed'] = vectors_df['image_embed'].apply(lambda x: np.array(ast.literal_eval(f'[{x}]')))  # Wrap string in brackets
+# Published index versions (see index_registry.py); the vector store above is served until one exists
+INDEX_VERSIONS_DIR = get_setting("index", "versions_dir", "index_versions")
 
-## Loading Embeddings Model
+# Legacy notebook outputs, converted once into the vector store if it does not exist yet
+VECTORS_CSV = "vectors.csv"
+PATHS_JSON = "paths_dict.json"
+
+# Optional approximate (IVF) index for large catalogs, persisted next to the vector store,
+# or "sharded" exact search scored in parallel by worker processes
+SEARCH_INDEX = get_setting("search", "index", "exact")
+ANN_NPROBE = get_setting("search", "nprobe", 8)
+SEARCH_SHARDS = get_setting("search", "shards") or os.cpu_count() or 1
 
-# Initializing the CLIP model
+# Hybrid search: attribute filters always pre-filter when a keyword index exists; "rrf" also
+# fuses the cosine ranking with BM25 over product text
+SEARCH_FUSION = get_setting("search", "fusion", "cosine")
+RRF_K = get_setting("search", "rrf_k", 60)
+RRF_DEPTH = get_setting("search", "rrf_depth", 100)
+MIN_FILTER_MATCHES = get_setting("search", "min_filter_matches", 6)
 
-# Check for available hardware and set the appropriate device (CUDA, MPS, or CPU)
-device = "cuda" if torch.cuda.is_available() else \
-         ("mps" if torch.backends.mps.is_available() else "cpu")
+## Loading Embeddings Model
 
 model_id = "openai/clip-vit-base-patch32"  # Pretrained CLIP model identifier
 
 # Path to the model can be specified if loading locally
 model_id = r"""Path to model"""
 
-# Initialize the tokenizer, processor, and the CLIP model
-tokenizer = CLIPTokenizerFast.from_pretrained(model_id)
-processor = CLIPProcessor.from_pretrained(model_id)
-model = CLIPModel.from_pretrained(model_id).to(device)
+# Serving only encodes text queries, so by default only the text tower is loaded;
+# the vision tower is loaded separately the first time an image is embedded
+TEXT_ONLY_MODEL = get_setting("model", "text_only", True)
+
+# Text encoder backend used for queries: "torch", "int8" or "onnx" (see encoder_backends.py)
+TEXT_BACKEND = get_setting("model", "text_backend", "torch")
+TEXT_THREADS = get_setting("model", "threads")
+# The exported graph is keyed on the model id, so switching models never loads a stale graph
+_onnx_base, _onnx_ext = os.path.splitext(get_setting("model", "onnx_path", os.path.join(".cache", "clip_text.onnx")))
+TEXT_ONNX_PATH = f"{_onnx_base}.{re.sub(r'[^A-Za-z0-9._-]+', '-', model_id).strip('-')}{_onnx_ext or '.onnx'}"
+
+_resources = {}
+_resources_lock = threading.RLock()
+
+# Progress of lazy loading / warmup, reported by the readiness endpoint
+warmup_state = {
+    "status": "idle",  # idle -> warming -> ready | failed
+    "loaded": {},  # resource name -> load time in seconds
+    "error": None,
+    "time_to_ready": None,  # seconds from import to ready
+}
+
+
+def _lazy(name, loader):
+    """Load a shared resource once (thread-safe) and remember how long it took."""
+    resource = _resources.get(name)
+    if resource is None:
+        with _resources_lock:
+            resource = _resources.get(name)
+            if resource is None:
+                started = time.perf_counter()
+                resource = loader()
+                _resources[name] = resource
+                warmup_state["loaded"][name] = round(time.perf_counter() - started, 3)
+    return resource
+
+
+def _open_snapshot(version, directory):
+    if directory == VECTOR_STORE_DIR and not vector_store_exists(VECTOR_STORE_DIR):
+        convert_csv_to_store(VECTORS_CSV, PATHS_JSON, VECTOR_STORE_DIR)
+    # The matrix is memory-mapped, so workers share the OS page cache instead of parsing their own copy
+    return IndexSnapshot(version, directory, search_index=SEARCH_INDEX, shards=SEARCH_SHARDS,
+                         neighbor_cache_size=get_setting("similar", "cache_size", 10000))
+
+
+# The active index version; new versions published to INDEX_VERSIONS_DIR are loaded in the
+# background and swapped in without interrupting queries
+index_registry = IndexRegistry(INDEX_VERSIONS_DIR, VECTOR_STORE_DIR, _open_snapshot,
+                               watch_interval=get_setting("index", "watch_interval_seconds", 5))
+
+
+def index_snapshot():
+    """
+    Hold the active index version for the duration of a query.
+
+    Rows ranked on a snapshot must be mapped to products with the same snapshot, so callers
+    that rank and then render keep it across both steps.
+
+    Returns:
+        contextmanager: Yields an IndexSnapshot.
+    """
+    return index_registry.use()
+
+
+def get_device():
+    """Check for available hardware and pick the appropriate device (CUDA, MPS, or CPU)."""
+    def load():
+        import torch
+        return "cuda" if torch.cuda.is_available() else \
+               ("mps" if torch.backends.mps.is_available() else "cpu")
+    return _lazy("device", load)
+
+
+def get_tokenizer():
+    """Return the CLIP tokenizer, loading it on first use."""
+    def load():
+        from transformers import CLIPTokenizerFast
+        return CLIPTokenizerFast.from_pretrained(model_id)
+    return _lazy("tokenizer", load)
+
+
+def get_processor():
+    """Return the CLIP image processor, loading it on first use."""
+    def load():
+        from transformers import CLIPProcessor
+        return CLIPProcessor.from_pretrained(model_id)
+    return _lazy("processor", load)
+
+
+def get_model():
+    """Return the full CLIP model (text and vision towers), loading it on first use."""
+    def load():
+        from transformers import CLIPModel
+        return CLIPModel.from_pretrained(model_id).to(get_device()).eval()
+    return _lazy("model", load)
+
+
+def get_text_model():
+    """Return the model used for text features: the text tower alone in text-only mode."""
+    if not TEXT_ONLY_MODEL:
+        return get_model()
+
+    def load():
+        from transformers import CLIPTextModelWithProjection
+        return CLIPTextModelWithProjection.from_pretrained(model_id).to(get_device()).eval()
+    return _lazy("text_model", load)
+
+
+def load_text_model(device="cpu"):
+    """Load a private, uncached copy of the text model, for backends that quantize or export their own."""
+    if not TEXT_ONLY_MODEL:
+        from transformers import CLIPModel
+        return CLIPModel.from_pretrained(model_id).to(device).eval()
+    from transformers import CLIPTextModelWithProjection
+    return CLIPTextModelWithProjection.from_pretrained(model_id).to(device).eval()
+
+
+def text_model_loader(backend):
+    """Model loader for a text backend: the shared text model for "torch", a private CPU copy otherwise."""
+    return get_text_model if backend == "torch" else load_text_model
+
+
+def get_vision_model():
+    """Return the model used for image features: the vision tower alone in text-only mode."""
+    if not TEXT_ONLY_MODEL:
+        return get_model()
+
+    def load():
+        from transformers import CLIPVisionModelWithProjection
+        return CLIPVisionModelWithProjection.from_pretrained(model_id).to(get_device()).eval()
+    return _lazy("vision_model", load)
+
+
+def get_text_backend():
+    """Return the configured text encoder backend, creating it on first use."""
+    def load():
+        from .encoder_backends import create_backend
+        backend = create_backend(TEXT_BACKEND, get_tokenizer(), text_model_loader(TEXT_BACKEND), device=get_device(),
+                                 threads=TEXT_THREADS, onnx_path=TEXT_ONNX_PATH)
+        if TEXT_BACKEND != "torch":
+            # The int8/onnx backends hold their own weights; keep no fp32 text tower next to them
+            _resources.pop("text_model", None)
+        return backend
+    return _lazy("text_backend", load)
+
+
+def text_features(inputs):
+    """Run the text model on tokenized inputs and return the projected text embeddings."""
+    text_model = get_text_model()
+    if TEXT_ONLY_MODEL:
+        return text_model(**inputs).text_embeds
+    return text_model.get_text_features(**inputs)
+
+
+def image_features(pixel_values):
+    """Run the vision model on preprocessed pixels and return the projected image embeddings."""
+    vision_model = get_vision_model()
+    if TEXT_ONLY_MODEL:
+        return vision_model(pixel_values=pixel_values).image_embeds
+    return vision_model.get_image_features(pixel_values)
+
+
+def warmup():
+    """
+    Load every resource the search path needs and run one dummy query.
+
+    Progress is recorded in warmup_state; time_to_ready is measured from module import.
+    """
+    warmup_state["status"] = "warming"
+    try:
+        with index_snapshot() as snapshot:
+            snapshot.warm()
+            warmup_state["loaded"].update(snapshot.load_times)
+        get_text_backend()
+        # The first forward pass allocates buffers; pay for it before real traffic arrives
+        encode_texts(["warmup"])
+        warmup_state["time_to_ready"] = round(time.monotonic() - IMPORTED_AT, 3)
+        warmup_state["status"] = "ready"
+        print(f"Search ready in {warmup_state['time_to_ready']}s")
+        # Later index versions are picked up from the manifest without a restart
+        index_registry.start_watcher()
+    except Exception as e:
+        warmup_state["status"] = "failed"
+        warmup_state["error"] = str(e)
+        print(f"Search warmup failed: {str(e)}")
+
+
+def start_warmup():
+    """Run warmup() in a background thread so the server can answer health checks meanwhile."""
+    thread = threading.Thread(target=warmup, name="clip-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def is_ready():
+    return warmup_state["status"] == "ready"
 
 ## Utils
 
@@ -54,14 +260,65 @@ def encode_text(prompt):
         torch.Tensor: Text embedding vector.
     """
     # Create transformer-readable tokens
-    inputs = tokenizer(prompt, return_tensors="pt")  # pt: Returns PyTorch tensors
+    inputs = get_tokenizer()(prompt, return_tensors="pt").to(get_device())  # pt: Returns PyTorch tensors
 
     # Use CLIP to encode tokens into a meaningful embedding
-    text_emb = model.get_text_features(**inputs)
+    text_emb = text_features(inputs)
 
     return text_emb
 
 
+def encode_texts(prompts):
+    """
+    Encodes a batch of text prompts in one padded forward pass.
+
+    Parameters:
+        prompts (list): Input text prompts.
+
+    Returns:
+        np.ndarray: (len(prompts) x dim) text embedding matrix.
+    """
+    # Padding, truncation and inference mode are handled by the configured backend
+    return get_text_backend().encode(list(prompts))
+
+
+# Gathers concurrent query encodes into one batched forward pass
+text_encoder = BatchEncoder(
+    encode_texts,
+    max_batch_size=get_setting("text_batching", "max_batch_size", 16),
+    max_wait_ms=get_setting("text_batching", "max_wait_ms", 5),
+    name="clip-text-encoder",
+)
+# Longest a query waits for its batch to be encoded before the search fails
+TEXT_ENCODE_TIMEOUT = get_setting("text_batching", "timeout_seconds", 30)
+
+
+# Cache of query embeddings keyed on normalized text, so repeated queries skip the CLIP forward pass;
+# the model and backend are part of the key, as their embeddings differ
+text_embedding_cache = EmbeddingCache(
+    max_size=get_setting("text_cache", "max_size", 1024),
+    ttl=get_setting("text_cache", "ttl_seconds", 3600),
+    persist_path=get_setting("text_cache", "persist_path"),
+    namespace=f"{model_id}:{TEXT_BACKEND}",
+)
+if text_embedding_cache.persist_path:
+    atexit.register(text_embedding_cache.save)
+
+
+def encode_query(text):
+    """
+    Encode a search query into a NumPy embedding, served from the text embedding cache when possible.
+
+    Parameters:
+        text (str): Input text query.
+
+    Returns:
+        np.ndarray: Text embedding vector.
+    """
+    with span("encode_text"):
+        return text_embedding_cache.get_or_compute(text, lambda query: text_encoder.encode(query, timeout=TEXT_ENCODE_TIMEOUT))
+
+
 def get_image_embd(path):
     """
     Encodes an image into a feature embedding using the CLIP model.
@@ -76,67 +333,241 @@ def get_image_embd(path):
     image = Image.open(path)
     
     # Preprocess the image to make it suitable for the CLIP model
-    image = processor(
+    image = get_processor()(
         text=None,
         images=image,
         return_tensors='pt'
-    )['pixel_values'].to(device)
+    )['pixel_values'].to(get_device())
     
     # Use CLIP to generate image features
-    img_emb = model.get_image_features(image)
+    img_emb = image_features(image)
 
     return img_emb
 
 
-def top_k_cosine_similarity(df, input_vector, k):
+# Uploaded query images: pixel count is checked from the header, before the image is decoded
+UPLOAD_MAX_PIXELS = get_setting("uploads", "max_pixels", 25000000)
+# CLIP's vision tower works at 224 px; JPEGs are decoded at reduced scale down to at least this size
+DECODE_DRAFT_SIZE = (448, 448)
+
+
+def preprocess_image(data):
+    """
+    Decode uploaded image bytes and preprocess them for the vision tower.
+
+    Parameters:
+        data (bytes): Encoded image (JPEG, PNG, WebP, ...).
+
+    Returns:
+        np.ndarray: (3 x 224 x 224) float32 pixel values.
+
+    Raises:
+        ValueError: If the data is not a readable image or has too many pixels.
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        width, height = image.size
+        if width * height > UPLOAD_MAX_PIXELS:
+            raise ValueError(f"Image is too large ({width}x{height} pixels)")
+        image.draft("RGB", DECODE_DRAFT_SIZE)
+        image = image.convert("RGB")
+    except (PIL.UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        raise ValueError(f"Could not read the image: {str(e)}")
+    pixel_values = get_processor()(images=image, return_tensors="np")["pixel_values"][0]
+    return pixel_values.astype(np.float32)
+
+
+def encode_images(pixel_values_list):
+    """
+    Encode preprocessed images in one forward pass of the vision tower.
+
+    Parameters:
+        pixel_values_list (list): (3 x 224 x 224) pixel arrays from preprocess_image.
+
+    Returns:
+        np.ndarray: (len(pixel_values_list) x dim) image embeddings.
+    """
+    import torch
+
+    pixel_values = torch.from_numpy(np.stack(pixel_values_list)).to(get_device())
+    with torch.inference_mode():
+        return image_features(pixel_values).cpu().numpy().astype(np.float32)
+
+
+# Gathers concurrent uploads into one batched vision forward pass
+image_encoder = BatchEncoder(
+    encode_images,
+    max_batch_size=get_setting("uploads", "max_batch_size", 8),
+    max_wait_ms=get_setting("uploads", "max_wait_ms", 10),
+    name="clip-image-encoder",
+)
+IMAGE_ENCODE_TIMEOUT = get_setting("uploads", "encode_timeout_seconds", 30)
+
+
+def encode_image_query(data):
+    """
+    Embed an uploaded query image. Call from a worker thread, not the event loop.
+
+    Parameters:
+        data (bytes): Encoded image.
+
+    Returns:
+        np.ndarray: Image embedding vector.
+    """
+    with span("decode_image"):
+        pixel_values = preprocess_image(data)
+    with span("encode_image"):
+        return image_encoder.encode(pixel_values, timeout=IMAGE_ENCODE_TIMEOUT)
+
+
+def neighbor_stats():
+    """Return the "more like this" cache counters of the active index version, or {} before warmup."""
+    if not is_ready():
+        return {}
+    with index_snapshot() as snapshot:
+        return snapshot.neighbor_cache.stats()
+
+
+def similar_products(product_id, k, snapshot=None):
+    """
+    Rank the products most similar to a catalog product from its stored vector (no model inference).
+
+    Parameters:
+        product_id (str): Vector store id of the product.
+        k (int): Number of neighbors.
+        snapshot (IndexSnapshot): Index version to search; the active one when omitted.
+
+    Returns:
+        tuple: (product embedding, rows, scores), best first, excluding the product itself.
+
+    Raises:
+        KeyError: If the product is not in the vector store.
+    """
+    if snapshot is None:
+        with index_snapshot() as snapshot:
+            return similar_products(product_id, k, snapshot)
+
+    store = snapshot.store
+    row = store.row_of[product_id]
+
+    def compute(row, k):
+        rows, scores = rank_vector(store.matrix[row], k + 1, snapshot=snapshot)
+        return drop_self(row, rows, scores, k)
+
+    rows, scores = snapshot.neighbor_cache.get(row, k, compute)
+    return np.asarray(store.matrix[row], dtype=np.float32), rows, scores
+
+
+def top_k_cosine_similarity(index, input_vector, k):
     """
-    Calculate cosine similarity with all vectors in the DataFrame and return the top k matches.
+    Calculate cosine similarity against every vector in the index and return the top k matches.
 
     Parameters:
-        df (pd.DataFrame): DataFrame containing product names and image embeddings.
-                           Schema: ['product_name', 'image_embed']
+        index (VectorIndex): Pre-normalized embedding index.
         input_vector (list or np.array): Input vector for comparison.
         k (int): Number of top matches to return.
 
     Returns:
-        pd.DataFrame: DataFrame containing top k matching products with their similarity scores.
+        tuple: Row indices of the top k matches and their similarity scores, best first.
     """
-    # Convert input_vector to a 2D array (required for cosine_similarity)
-    input_vector = np.array(input_vector).reshape(1, -1)
-    
-    # Convert all image embeddings to a 2D numpy array
-    embeddings = np.vstack(df['image_embed'].values)
-    
-    # Compute cosine similarities
-    similarities = cosine_similarity(input_vector, embeddings).flatten()
-    
-    # Add similarity scores to the DataFrame
-    df['similarity'] = similarities
-    
-    # Get the top k matches based on similarity scores
-    top_k_matches = df.nlargest(k, 'similarity')
-    
-    # Drop the similarity column to keep the DataFrame clean (optional)
-    return top_k_matches[['product_name', 'similarity']]
+    return index.search(input_vector, k)
+
+
+def rank_vector(query_vector, depth, candidates=None, snapshot=None):
+    """
+    Rank catalog rows by cosine similarity to an embedding with the configured index.
+
+    Parameters:
+        query_vector (np.ndarray): Text or image embedding.
+        depth (int): Number of ranked rows to return.
+        candidates (np.ndarray): Optional rows to restrict the search to (always scored exactly).
+        snapshot (IndexSnapshot): Index version to search; the active one when omitted.
+
+    Returns:
+        tuple: (rows, scores), best first.
+    """
+    if snapshot is None:
+        with index_snapshot() as snapshot:
+            return rank_vector(query_vector, depth, candidates, snapshot)
+
+    vector_index, ann_index, sharded_index = snapshot.vector_index, snapshot.ann_index, snapshot.sharded_index
+    with span("vector_scoring"):
+        if candidates is not None:
+            return vector_index.search_rows(query_vector, candidates, depth)
+        if ann_index is not None:
+            return ann_index.search(query_vector, k=depth, nprobe=ANN_NPROBE, matrix=vector_index.matrix)
+        if sharded_index is not None:
+            return sharded_index.search(query_vector, depth)
+        return top_k_cosine_similarity(index=vector_index, input_vector=query_vector, k=depth)
+
+
+def rank_search(input_text, filters=None, depth=6, snapshot=None):
+    """
+    Rank catalog rows for a text query in one scoring pass.
 
+    Parameters:
+        input_text (str): The text query to search.
+        filters (dict): Optional attribute filters, e.g. {"color": "black", "gender": ["men", "unisex"]}.
+        depth (int): Number of ranked rows to return.
+        snapshot (IndexSnapshot): Index version to search; the active one when omitted.
 
-def perform_search(input_text):
+    Returns:
+        tuple: (query embedding, rows, scores), best first.
+    """
+    if snapshot is None:
+        with index_snapshot() as snapshot:
+            return rank_search(input_text, filters, depth, snapshot)
+
+    # Encode the input text to get its feature embedding
+    text_querry = encode_query(input_text)
+
+    keyword_index = snapshot.keyword_index
+    fuse = SEARCH_FUSION == "rrf" and keyword_index is not None
+    fused_depth = max(depth, RRF_DEPTH) if fuse else depth
+
+    # Pre-filter candidates by bitmap intersection, so only matching vectors are scored
+    candidates = keyword_index.filter_rows(filters) if filters and keyword_index is not None else None
+    boosted = None
+    if candidates is not None and len(candidates) < MIN_FILTER_MATCHES:
+        # Zero-shot tags can be wrong, so a filter too narrow to fill a page only boosts the
+        # matching products (fused as an extra ranking) instead of requiring them
+        boosted, candidates = candidates, None
+
+    # Find the most similar images
+    rows, scores = rank_vector(text_querry, fused_depth, candidates=candidates, snapshot=snapshot)
+
+    rankings = [rows]
+    if fuse:
+        with span("keyword_scoring"):
+            keyword_rows, _ = keyword_index.bm25(input_text, rows=candidates, limit=fused_depth)
+        rankings.append(keyword_rows)
+    if boosted is not None and len(boosted):
+        boosted_rows, _ = rank_vector(text_querry, len(boosted), candidates=boosted, snapshot=snapshot)
+        rankings.append(boosted_rows)
+    if len(rankings) > 1:
+        rows, scores = reciprocal_rank_fusion(rankings, k=RRF_K)
+
+    return text_querry, rows[:depth], scores[:depth]
+
+
+def perform_search(input_text, filters=None, k=6):
     """
     Perform a search for the most similar images based on the input text.
 
     Parameters:
         input_text (str): The text query to search.
+        filters (dict): Optional attribute filters (see rank_search).
+        k (int): Number of images to return.
 
     Returns:
         list: List of file paths for the top matching images.
     """
-    # Encode the input text to get its feature embedding
-    text_querry = encode_text(prompt=input_text).detach().numpy()[0]
-    
-    # Find the top 6 most similar images
-    results = top_k_cosine_similarity(df=vectors_df, input_vector=text_querry, k=6)
-    
-    # Map product names to their respective image file paths
-    file_paths = [image_paths_dict[file_name] for file_name in results['product_name'].values] 
-    
+    with index_snapshot() as snapshot:
+        _, rows, _ = rank_search(input_text, filters=filters, depth=k, snapshot=snapshot)
+
+        # Map matrix rows to their respective image file paths
+        with span("path_lookup"):
+            paths = snapshot.store.paths
+            file_paths = [paths[row] for row in rows]
+
     return file_paths
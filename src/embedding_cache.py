@@ -0,0 +1,155 @@
+"""
+Bounded LRU + TTL cache for query text embeddings.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_query(text):
+    """Normalize query text for cache lookups: collapse whitespace and lowercase."""
+    return " ".join(text.split()).lower()
+
+
+class EmbeddingCache:
+    """
+    Thread-safe cache mapping normalized query text to its embedding vector.
+
+    Entries are evicted least-recently-used once `max_size` is reached, and treated as
+    missing once they are older than `ttl` seconds. Keys are prefixed with `namespace`, so
+    embeddings of another model or encoder backend (e.g. in a persisted cache) never match.
+
+    Parameters:
+        max_size (int): Maximum number of cached embeddings.
+        ttl (float): Entry lifetime in seconds, or None for no expiry.
+        persist_path (str): Optional .npz file the cache is loaded from and saved to.
+        namespace (str): Identifies what produced the embeddings, e.g. model id and backend.
+    """
+
+    def __init__(self, max_size=1024, ttl=3600, persist_path=None, namespace=""):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.persist_path = persist_path
+        # Normalized queries never contain a newline, so the prefix cannot be part of a query
+        self.namespace = namespace
+        self._prefix = f"{namespace}\n"
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (vector, created_at)
+        self._lock = threading.Lock()
+        if persist_path and os.path.exists(persist_path):
+            self.load(persist_path)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _expired(self, created_at, now):
+        return self.ttl is not None and now - created_at > self.ttl
+
+    def _key(self, text):
+        return self._prefix + normalize_query(text)
+
+    def get(self, text):
+        """
+        Look up the cached embedding for a query.
+
+        Parameters:
+            text (str): Raw query text.
+
+        Returns:
+            np.ndarray or None: The cached vector, or None on a miss.
+        """
+        key = self._key(text)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry[1], time.time()):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, text, vector):
+        """Store an embedding, evicting the least recently used entries beyond max_size."""
+        key = self._key(text)
+        vector = np.array(vector, dtype=np.float32)
+        vector.setflags(write=False)
+        with self._lock:
+            self._entries[key] = (vector, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, text, compute):
+        """
+        Return the cached embedding for a query, computing and caching it on a miss.
+
+        The computation runs outside the lock, so concurrent misses for different queries
+        do not serialize behind each other.
+
+        Parameters:
+            text (str): Raw query text.
+            compute (callable): Called with the text to produce the embedding on a miss.
+
+        Returns:
+            np.ndarray: The query embedding.
+        """
+        vector = self.get(text)
+        if vector is None:
+            vector = np.asarray(compute(text), dtype=np.float32)
+            self.put(text, vector)
+        return vector
+
+    def stats(self):
+        """Return hit/miss counters and the current size."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+        }
+
+    def save(self, path=None):
+        """Write the unexpired entries to an .npz file so a restarted worker starts warm."""
+        path = path or self.persist_path
+        if not path:
+            return
+        now = time.time()
+        with self._lock:
+            items = [(key, vector, created_at) for key, (vector, created_at) in self._entries.items()
+                     if not self._expired(created_at, now)]
+        if not items:
+            return
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # np.savez appends .npz to names without it, so write through a file handle
+        with open(path + ".tmp", "wb") as file:
+            np.savez(file,
+                     keys=np.array([key for key, _, _ in items]),
+                     vectors=np.vstack([vector for _, vector, _ in items]),
+                     created_at=np.array([created_at for _, _, created_at in items]))
+        os.replace(path + ".tmp", path)
+
+    def load(self, path):
+        """Load entries saved with save(), skipping expired ones and those of another namespace."""
+        try:
+            data = np.load(path)
+        except Exception as e:
+            print(f"Could not load embedding cache from {path}: {str(e)}")
+            return
+        now = time.time()
+        with self._lock:
+            for key, vector, created_at in zip(data["keys"], data["vectors"], data["created_at"]):
+                if str(key).startswith(self._prefix) and not self._expired(float(created_at), now):
+                    vector.setflags(write=False)
+                    self._entries[str(key)] = (vector, float(created_at))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
@@ -0,0 +1,289 @@
+"""
+Pluggable CPU backends for the CLIP text encoder.
+
+    torch  fp32 eager PyTorch under torch.inference_mode()
+    int8   PyTorch dynamic int8 quantization of the Linear layers
+    onnx   Text tower exported to ONNX and run with onnxruntime (optional dependency)
+
+Parity check and latency/RSS comparison against the fp32 baseline:
+    python -m src.encoder_backends --compare --threads 4
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import time
+
+import numpy as np
+import torch
+
+from .vector_index import l2_normalize
+
+# CLIP's text tower accepts at most 77 tokens
+MAX_TEXT_TOKENS = 77
+
+SAMPLE_QUERIES = [
+    "winter hiking boots",
+    "black leather formal shoes for men",
+    "white running sneakers",
+    "women's red high heels for a party",
+    "waterproof high ankle boots",
+    "casual canvas slip-on shoes",
+    "kids sports shoes with velcro",
+    "brown suede loafers",
+    "comfortable sandals for the beach",
+    "pink ballet flats for a wedding",
+]
+
+
+def set_torch_threads(threads):
+    """Set PyTorch intra-op threads; None keeps the library default."""
+    if threads:
+        torch.set_num_threads(int(threads))
+
+
+class TextTower(torch.nn.Module):
+    """Exposes the projected text embedding of a CLIPModel or CLIPTextModelWithProjection as forward()."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        if hasattr(self.model, "get_text_features"):
+            return self.model.get_text_features(input_ids=input_ids, attention_mask=attention_mask)
+        return self.model(input_ids=input_ids, attention_mask=attention_mask).text_embeds
+
+
+class TorchBackend:
+    """
+    fp32 eager PyTorch text encoder.
+
+    Parameters:
+        tokenizer: CLIP tokenizer.
+        model_loader (callable): Returns the CLIP text model (loaded lazily by the caller); the int8
+            backend quantizes it in place, so it must return a private copy.
+        device (str): Torch device.
+        threads (int): Intra-op threads, or None for the default.
+    """
+
+    name = "torch"
+
+    def __init__(self, tokenizer, model_loader, device="cpu", threads=None, **_):
+        set_torch_threads(threads)
+        self.tokenizer = tokenizer
+        self.device = device
+        self.tower = TextTower(self._prepare(model_loader())).eval()
+
+    def _prepare(self, model):
+        return model
+
+    def encode(self, prompts):
+        """
+        Encode a batch of prompts.
+
+        Parameters:
+            prompts (list): Input text prompts.
+
+        Returns:
+            np.ndarray: (len(prompts) x dim) float32 text embeddings.
+        """
+        inputs = self.tokenizer(prompts, padding=True, truncation=True, max_length=MAX_TEXT_TOKENS,
+                                return_tensors="pt").to(self.device)
+        with torch.inference_mode():
+            text_emb = self.tower(inputs["input_ids"], inputs["attention_mask"])
+        return text_emb.cpu().numpy().astype(np.float32)
+
+
+class QuantizedTorchBackend(TorchBackend):
+    """PyTorch text encoder with dynamically int8-quantized Linear layers (CPU only)."""
+
+    name = "int8"
+
+    def __init__(self, tokenizer, model_loader, device="cpu", threads=None, **_):
+        super().__init__(tokenizer, model_loader, device="cpu", threads=threads)
+
+    def _prepare(self, model):
+        # The loader returns a private copy, so it is quantized in place instead of duplicated
+        return torch.ao.quantization.quantize_dynamic(model.to("cpu").eval(), {torch.nn.Linear}, dtype=torch.qint8,
+                                                      inplace=True)
+
+
+class OnnxBackend:
+    """
+    Text tower exported to ONNX and run with onnxruntime on the CPU.
+
+    The graph is exported from the PyTorch model the first time; later starts only load the
+    .onnx file, so the PyTorch weights are never materialized.
+
+    Parameters:
+        tokenizer: CLIP tokenizer.
+        model_loader (callable): Returns the CLIP text model; only called to export the graph.
+        threads (int): onnxruntime intra-op threads, or None for the default.
+        onnx_path (str): Location of the exported graph.
+    """
+
+    name = "onnx"
+
+    def __init__(self, tokenizer, model_loader, device="cpu", threads=None, onnx_path=".cache/clip_text.onnx", **_):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("The onnx text backend needs the 'onnx' and 'onnxruntime' packages")
+
+        self.tokenizer = tokenizer
+        if not os.path.exists(onnx_path):
+            export_onnx(tokenizer, model_loader(), onnx_path)
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = int(threads)
+        options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+
+    def encode(self, prompts):
+        """Encode a batch of prompts; see TorchBackend.encode."""
+        inputs = self.tokenizer(prompts, padding=True, truncation=True, max_length=MAX_TEXT_TOKENS,
+                                return_tensors="np")
+        return self.session.run(["text_embeds"], {
+            "input_ids": inputs["input_ids"].astype(np.int64),
+            "attention_mask": inputs["attention_mask"].astype(np.int64),
+        })[0].astype(np.float32)
+
+
+def export_onnx(tokenizer, model, onnx_path):
+    """Export the CLIP text tower to ONNX with dynamic batch and sequence axes."""
+    directory = os.path.dirname(onnx_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tower = TextTower(model.to("cpu")).eval()
+    dummy = tokenizer(SAMPLE_QUERIES[:2], padding=True, return_tensors="pt")
+    torch.onnx.export(
+        tower,
+        (dummy["input_ids"], dummy["attention_mask"]),
+        onnx_path + ".tmp",
+        input_names=["input_ids", "attention_mask"],
+        output_names=["text_embeds"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "sequence"},
+            "attention_mask": {0: "batch", 1: "sequence"},
+            "text_embeds": {0: "batch"},
+        },
+        opset_version=17,
+    )
+    os.replace(onnx_path + ".tmp", onnx_path)
+
+
+BACKENDS = {backend.name: backend for backend in (TorchBackend, QuantizedTorchBackend, OnnxBackend)}
+
+
+def create_backend(name, tokenizer, model_loader, device="cpu", threads=None, onnx_path=".cache/clip_text.onnx"):
+    """
+    Instantiate a text encoder backend by name.
+
+    Parameters:
+        name (str): "torch", "int8" or "onnx".
+        tokenizer: CLIP tokenizer.
+        model_loader (callable): Returns the CLIP text model.
+        device (str): Torch device (the int8 and onnx backends always run on the CPU).
+        threads (int): Intra-op thread count, or None for the default.
+        onnx_path (str): Exported graph location for the onnx backend.
+
+    Returns:
+        A backend with an encode(prompts) -> np.ndarray method.
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown text encoder backend: {name} (choose from {', '.join(BACKENDS)})")
+    return BACKENDS[name](tokenizer, model_loader, device=device, threads=threads, onnx_path=onnx_path)
+
+
+def _benchmark_backend(name, threads, repeats):
+    """Load one backend in a fresh process and measure load time, latency and peak RSS."""
+    from . import clip_search
+
+    started = time.perf_counter()
+    backend = create_backend(name, clip_search.get_tokenizer(), clip_search.text_model_loader(name),
+                             device="cpu", threads=threads, onnx_path=clip_search.TEXT_ONNX_PATH)
+    backend.encode(SAMPLE_QUERIES[:1])
+    load_seconds = time.perf_counter() - started
+
+    single = []
+    for _ in range(repeats):
+        for query in SAMPLE_QUERIES:
+            started = time.perf_counter()
+            backend.encode([query])
+            single.append(time.perf_counter() - started)
+    batch = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        embeddings = backend.encode(SAMPLE_QUERIES)
+        batch.append(time.perf_counter() - started)
+
+    return {
+        "backend": name,
+        "load_s": load_seconds,
+        "single_p50_ms": 1000 * float(np.percentile(single, 50)),
+        "single_p95_ms": 1000 * float(np.percentile(single, 95)),
+        "batch_ms": 1000 * float(np.median(batch)),
+        # ru_maxrss is reported in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "embeddings": embeddings,
+    }
+
+
+def compare_backends(names, threads=None, repeats=5, k=6):
+    """
+    Benchmark backends against each other and check top-k parity with the fp32 baseline.
+
+    Each backend runs in its own spawned process so its RSS is measured in isolation.
+
+    Parameters:
+        names (list): Backend names; "torch" is always included as the baseline.
+        threads (int): Intra-op threads for every backend.
+        repeats (int): Passes over the sample queries.
+        k (int): Result depth for the parity check.
+
+    Returns:
+        list: One result dict per backend, including embedding cosine vs fp32 and top-k overlap.
+    """
+    from . import clip_search
+
+    names = ["torch"] + [name for name in names if name != "torch"]
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for name in names:
+        with context.Pool(1) as pool:
+            results.append(pool.apply(_benchmark_backend, (name, threads, repeats)))
+
+    baseline = results[0]["embeddings"]
+    with clip_search.index_snapshot() as snapshot:
+        index = snapshot.vector_index
+        baseline_rows, _ = index.search_batch(baseline, k)
+        all_rows = [index.search_batch(result["embeddings"], k)[0] for result in results]
+    for result, rows in zip(results, all_rows):
+        result["cosine_vs_fp32"] = float(np.mean(np.sum(l2_normalize(baseline) * l2_normalize(result["embeddings"]), axis=1)))
+        result["topk_overlap"] = float(np.mean([len(set(a) & set(b)) / k for a, b in zip(baseline_rows.tolist(), rows.tolist())]))
+        result["topk_identical"] = bool((rows == baseline_rows).all())
+        del result["embeddings"]
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare CLIP text encoder backends.")
+    parser.add_argument("--compare", action="store_true", help="Run the parity check and benchmark")
+    parser.add_argument("--backends", default="torch,int8,onnx", help="Comma-separated backends")
+    parser.add_argument("--threads", type=int, default=None, help="Intra-op threads")
+    parser.add_argument("--repeats", type=int, default=5, help="Passes over the sample queries")
+    parser.add_argument("--k", type=int, default=6, help="Result depth for the parity check")
+    args = parser.parse_args()
+
+    if args.compare:
+        print(f"{'backend':>8} {'load s':>7} {'p50 ms':>7} {'p95 ms':>7} {'batch ms':>9} "
+              f"{'rss MB':>7} {'cos':>6} {'top-k':>6} {'same':>5}")
+        for row in compare_backends(args.backends.split(","), threads=args.threads, repeats=args.repeats, k=args.k):
+            print(f"{row['backend']:>8} {row['load_s']:>7.2f} {row['single_p50_ms']:>7.2f} "
+                  f"{row['single_p95_ms']:>7.2f} {row['batch_ms']:>9.2f} {row['peak_rss_mb']:>7.0f} "
+                  f"{row['cosine_vs_fp32']:>6.4f} {row['topk_overlap']:>6.2f} {str(row['topk_identical']):>5}")
+    else:
+        parser.print_help()
@@ -0,0 +1,79 @@
+"""
+Bounded offload executor for CPU-bound work (CLIP encoding, vector search) called from async handlers.
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFullError(Exception):
+    """Raised when the executor already has its maximum number of running and queued tasks."""
+
+
+class BoundedExecutor:
+    """
+    Thread pool with a hard cap on running + queued tasks.
+
+    PyTorch and NumPy release the GIL inside their kernels, so a thread pool is enough to keep
+    the event loop free while CLIP and the similarity scan run. When the cap is reached, new
+    work is rejected immediately with QueueFullError instead of piling up behind slow requests.
+
+    Parameters:
+        max_workers (int): Number of worker threads.
+        max_pending (int): Tasks allowed to wait for a free worker.
+        name (str): Thread name prefix.
+    """
+
+    def __init__(self, max_workers=4, max_pending=32, name="search"):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self._in_flight = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    def _release(self, _future):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Run a blocking function on the pool and await its result.
+
+        Parameters:
+            fn (callable): Function to run.
+            *args, **kwargs: Arguments passed to fn.
+
+        Returns:
+            The function's return value.
+
+        Raises:
+            QueueFullError: If the executor is saturated.
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise QueueFullError("Search executor is saturated")
+        with self._lock:
+            self._in_flight += 1
+        # The slot is released when the task itself finishes, even if the awaiting request is cancelled.
+        # The task runs in a copy of the caller's context, so its timing spans join the request trace
+        future = self._executor.submit(contextvars.copy_context().run, functools.partial(fn, *args, **kwargs))
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def stats(self):
+        """Return running/queued task counts and the number of rejected submissions."""
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "capacity": self.max_workers + self.max_pending,
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
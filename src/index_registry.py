@@ -0,0 +1,493 @@
+"""
+Versioned search index snapshots with zero-downtime hot swap.
+
+A published version is a full copy of a vector store directory (embeddings, sidecar, IVF and
+keyword indexes, neighbor table) under <versions>/vNNNN. <versions>/MANIFEST.json names the
+active version and the one it replaced. Running servers watch the manifest. When the active
+version changes, they load and warm it in a background thread and then swap the active
+snapshot reference. Queries hold a reference to the snapshot they started on, so they finish
+on it. A replaced snapshot is closed when its last reference is released.
+
+    python -m src.index_registry publish --store vector_store   # copy the store as the next version and activate it
+    python -m src.index_registry activate v0003
+    python -m src.index_registry rollback
+    python -m src.index_registry list
+    python -m src.index_registry prune --keep 3
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from .vector_store import load_vector_store
+from .vector_index import VectorIndex
+from .ann_index import ANN_INDEX_DIR, ivf_index_exists, load_ivf_index
+from .keyword_index import KEYWORD_INDEX_DIR, keyword_index_exists, load_keyword_index
+from .similar_search import NeighborCache, load_neighbor_table
+
+MANIFEST_FILE = "MANIFEST.json"
+VERSION_PATTERN = re.compile(r"^v(\d+)$")
+# Rows read per step when pulling a new version's matrix into the page cache
+WARM_CHUNK_ROWS = 65536
+
+
+def load_manifest(versions_dir):
+    """
+    Read the manifest of a versions directory.
+
+    Returns:
+        dict or None: {"active", "previous", "versions": {name: info}}, or None if nothing was published.
+    """
+    path = os.path.join(versions_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def _save_manifest(versions_dir, manifest):
+    path = os.path.join(versions_dir, MANIFEST_FILE)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(tmp_path, path)
+
+
+def set_active(versions_dir, version):
+    """
+    Make a published version the active one; running servers pick it up from the manifest.
+
+    Raises:
+        KeyError: If the version was not published.
+    """
+    manifest = load_manifest(versions_dir) or {"active": None, "previous": None, "versions": {}}
+    if version not in manifest["versions"]:
+        raise KeyError(f"Unknown index version: {version}")
+    if manifest["active"] != version:
+        manifest["previous"], manifest["active"] = manifest["active"], version
+        _save_manifest(versions_dir, manifest)
+    return version
+
+
+def rollback_version(versions_dir):
+    """
+    Reactivate the version that the active one replaced.
+
+    Returns:
+        str: The reactivated version.
+
+    Raises:
+        ValueError: If there is no previous version to return to.
+    """
+    manifest = load_manifest(versions_dir)
+    if manifest is None or not manifest.get("previous"):
+        raise ValueError("No previous index version to roll back to")
+    return set_active(versions_dir, manifest["previous"])
+
+
+def publish_version(store_dir, versions_dir, activate=True):
+    """
+    Copy a vector store directory as the next index version.
+
+    The copy is written under a temporary name and renamed into place, so watchers never see
+    a partial version.
+
+    Parameters:
+        store_dir (str): Vector store directory built by the indexer.
+        versions_dir (str): Directory of published versions.
+        activate (bool): Also make the new version the active one.
+
+    Returns:
+        str: The new version name, e.g. "v0004".
+    """
+    os.makedirs(versions_dir, exist_ok=True)
+    manifest = load_manifest(versions_dir) or {"active": None, "previous": None, "versions": {}}
+    numbers = [int(match.group(1)) for match in map(VERSION_PATTERN.match, os.listdir(versions_dir)) if match]
+    version = f"v{max(numbers, default=0) + 1:04d}"
+
+    tmp_dir = os.path.join(versions_dir, f".{version}.tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    shutil.copytree(store_dir, tmp_dir, ignore=shutil.ignore_patterns("*.tmp"))
+    os.rename(tmp_dir, os.path.join(versions_dir, version))
+
+    store = load_vector_store(os.path.join(versions_dir, version))
+    manifest["versions"][version] = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "count": len(store),
+                                     "source": os.path.abspath(store_dir)}
+    _save_manifest(versions_dir, manifest)
+    if activate:
+        set_active(versions_dir, version)
+    return version
+
+
+def prune_versions(versions_dir, keep=3):
+    """
+    Delete old versions, keeping the newest `keep` plus the active and previous ones.
+
+    Returns:
+        list: Deleted version names.
+    """
+    manifest = load_manifest(versions_dir)
+    if manifest is None:
+        return []
+    ordered = sorted(manifest["versions"], key=lambda name: int(VERSION_PATTERN.match(name).group(1)))
+    protected = set(ordered[-keep:]) if keep > 0 else set()
+    protected.update(version for version in (manifest["active"], manifest["previous"]) if version)
+    deleted = [version for version in ordered if version not in protected]
+    for version in deleted:
+        del manifest["versions"][version]
+    _save_manifest(versions_dir, manifest)
+    for version in deleted:
+        shutil.rmtree(os.path.join(versions_dir, version), ignore_errors=True)
+    return deleted
+
+
+class IndexSnapshot:
+    """
+    The search artifacts of one index version, loaded on first use and reference counted.
+
+    Parameters:
+        version (str): Version name (the directory name for an unversioned store).
+        directory (str): Vector store directory of this version.
+        search_index (str): "exact", "ivf" or "sharded" (see search.index).
+        shards (int): Worker processes for "sharded".
+        neighbor_cache_size (int): "More like this" lists computed on demand that are kept.
+    """
+
+    def __init__(self, version, directory, search_index="exact", shards=1, neighbor_cache_size=10000):
+        self.version = version
+        self.directory = directory
+        self.search_index = search_index
+        self.shards = shards
+        self.neighbor_cache_size = neighbor_cache_size
+        self.load_times = {}  # resource name -> load time in seconds
+        self.refs = 0
+        self.retired = False
+        self.closed = False
+        self._resources = {}
+        self._lock = threading.RLock()
+
+    def _lazy(self, name, loader):
+        """
+        Load a resource of this version once (thread-safe) and remember how long it took.
+
+        Raises:
+            RuntimeError: If the snapshot was closed; readers must hold it with IndexRegistry.use().
+        """
+        resource = self._resources.get(name)
+        if resource is None:
+            with self._lock:
+                if self.closed:
+                    raise RuntimeError(f"Index snapshot {self.version} is closed; hold it with IndexRegistry.use()")
+                resource = self._resources.get(name)
+                if resource is None:
+                    started = time.perf_counter()
+                    resource = loader()
+                    self._resources[name] = resource
+                    self.load_times[name] = round(time.perf_counter() - started, 3)
+        return resource
+
+    def loaded(self, name):
+        """Return a resource if it is already loaded, without loading it."""
+        return self._resources.get(name)
+
+    @property
+    def store(self):
+        """The memory-mapped vector store."""
+        return self._lazy("vector_store", lambda: load_vector_store(self.directory))
+
+    @property
+    def vector_index(self):
+        """Exact cosine index; rows are normalized once (or already on disk), never per query."""
+        return self._lazy("vector_index", lambda: VectorIndex(self.store.matrix, normalized=self.store.normalized))
+
+    def _load_ann_index(self):
+        if self.search_index != "ivf":
+            return False
+        ann_dir = os.path.join(self.directory, ANN_INDEX_DIR)
+        if not ivf_index_exists(ann_dir):
+            print(f"No IVF index found in {ann_dir}, falling back to exact search")
+            return False
+        index, meta = load_ivf_index(ann_dir)
+        if meta["count"] != len(self.store):
+            print("IVF index does not match the vector store, falling back to exact search")
+            return False
+        return index
+
+    @property
+    def ann_index(self):
+        """The IVF index when configured and present, otherwise None."""
+        return self._lazy("ann_index", self._load_ann_index) or None
+
+    def _load_sharded_index(self):
+        if self.search_index != "sharded":
+            return False
+        # Imported here: the worker pool is only started in sharded mode
+        from .sharded_search import open_sharded_index
+        return open_sharded_index(self.store.matrix, shards=self.shards, normalized=self.store.normalized)
+
+    @property
+    def sharded_index(self):
+        """The multi-process sharded index when search.index is "sharded", otherwise None."""
+        return self._lazy("sharded_index", self._load_sharded_index) or None
+
+    def _load_keyword_index(self):
+        keyword_dir = os.path.join(self.directory, KEYWORD_INDEX_DIR)
+        if not keyword_index_exists(keyword_dir):
+            return False
+        index = load_keyword_index(keyword_dir)
+        if len(index) != len(self.store):
+            print("Keyword index does not match the vector store, ignoring filters and keyword scores")
+            return False
+        return index
+
+    @property
+    def keyword_index(self):
+        """The keyword/attribute index, or None."""
+        return self._lazy("keyword_index", self._load_keyword_index) or None
+
+    @property
+    def neighbor_cache(self):
+        """Neighbor lists for "more like this", with this version's precomputed table if there is one."""
+        return self._lazy("neighbor_cache", lambda: NeighborCache(
+            max_size=self.neighbor_cache_size, table=load_neighbor_table(self.directory, len(self.store))))
+
+    def warm(self):
+        """Load every artifact, pull the matrix into the page cache and run one search, so the first query is fast."""
+        index = self.vector_index
+        for name in ("ann_index", "sharded_index", "keyword_index", "neighbor_cache"):
+            getattr(self, name)
+        started = time.perf_counter()
+        for start in range(0, len(index.matrix), WARM_CHUNK_ROWS):
+            np.asarray(index.matrix[start:start + WARM_CHUNK_ROWS]).sum()
+        if len(index.matrix):
+            index.search(index.matrix[0], 1)
+        self.load_times["page_in"] = round(time.perf_counter() - started, 3)
+
+    def acquire(self):
+        with self._lock:
+            self.refs += 1
+
+    def release(self):
+        with self._lock:
+            self.refs -= 1
+            close = self.retired and self.refs == 0
+        if close:
+            self.close()
+
+    def retire(self):
+        """Mark the snapshot as replaced; it is closed once no query holds it."""
+        with self._lock:
+            self.retired = True
+            close = self.refs == 0
+        if close:
+            self.close()
+
+    def close(self):
+        """
+        Stop the sharded workers and drop the loaded artifacts (memory maps are unmapped once
+        unreferenced). Loading anything from a closed snapshot raises.
+        """
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            sharded_index = self._resources.get("sharded_index")
+            self._resources = {}
+        if sharded_index:
+            sharded_index.close()
+
+
+class IndexRegistry:
+    """
+    Holds the active IndexSnapshot and swaps it when the manifest changes.
+
+    Parameters:
+        versions_dir (str): Directory of published versions and MANIFEST.json.
+        fallback_dir (str): Unversioned vector store served while nothing is published.
+        open_snapshot (callable): open_snapshot(version, directory) -> IndexSnapshot.
+        watch_interval (float): Seconds between manifest checks by the watcher (0 disables it).
+    """
+
+    def __init__(self, versions_dir, fallback_dir, open_snapshot, watch_interval=5.0):
+        self.versions_dir = versions_dir
+        self.fallback_dir = fallback_dir
+        self.open_snapshot = open_snapshot
+        self.watch_interval = watch_interval
+        self.swaps = 0
+        self.failed_swaps = 0
+        self.last_error = None
+        self.loading = None
+        self._active = None
+        self._draining = []
+        self._manifest_mtime = None
+        self._lock = threading.Lock()  # guards the active reference and reference acquisition
+        self._swap_lock = threading.Lock()  # one version loads at a time
+        self._watcher = None
+        self._stop = threading.Event()
+
+    def _target(self):
+        """(version, directory) the manifest asks for, or the unversioned store."""
+        manifest = load_manifest(self.versions_dir)
+        if manifest is None or not manifest.get("active"):
+            return os.path.basename(os.path.normpath(self.fallback_dir)), self.fallback_dir
+        return manifest["active"], os.path.join(self.versions_dir, manifest["active"])
+
+    def _current(self):
+        """Return the active snapshot, opening the manifest's version on first use."""
+        snapshot = self._active
+        if snapshot is None:
+            with self._swap_lock:
+                if self._active is None:
+                    self._manifest_mtime = self._read_mtime()
+                    self._active = self.open_snapshot(*self._target())
+                snapshot = self._active
+        return snapshot
+
+    @contextmanager
+    def use(self):
+        """
+        Hold the active snapshot for the duration of a query.
+
+        Yields:
+            IndexSnapshot: A snapshot that stays open until the block exits, even if it is swapped out meanwhile.
+        """
+        self._current()
+        with self._lock:
+            snapshot = self._active
+            snapshot.acquire()
+        try:
+            yield snapshot
+        finally:
+            snapshot.release()
+
+    def reload(self):
+        """
+        Load the manifest's active version in the calling thread and swap it in.
+
+        The new snapshot is fully warmed before the swap; queries already running keep the
+        old one until they finish.
+
+        Returns:
+            bool: True if a new version was swapped in, False if it was already active.
+        """
+        with self._swap_lock:
+            self._manifest_mtime = self._read_mtime()
+            version, directory = self._target()
+            if self._active is not None and self._active.version == version:
+                return False
+            self.loading = version
+            started = time.perf_counter()
+            snapshot = self.open_snapshot(version, directory)
+            try:
+                snapshot.warm()
+            except Exception as e:
+                snapshot.close()
+                self.failed_swaps += 1
+                self.last_error = f"{version}: {str(e)}"
+                raise
+            finally:
+                self.loading = None
+            with self._lock:
+                previous, self._active = self._active, snapshot
+                self.swaps += 1
+            print(f"Swapped in index version {version} ({len(snapshot.store)} products, "
+                  f"loaded in {time.perf_counter() - started:.1f}s)")
+            if previous is not None:
+                self._draining.append(previous)
+                previous.retire()
+            self._draining = [old for old in self._draining if not old.closed]
+            return True
+
+    def _read_mtime(self):
+        try:
+            return os.stat(os.path.join(self.versions_dir, MANIFEST_FILE)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def check(self):
+        """Reload if the manifest changed since it was last read."""
+        if self._read_mtime() != self._manifest_mtime:
+            return self.reload()
+        return False
+
+    def _watch(self):
+        while not self._stop.wait(self.watch_interval):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Index reload failed: {str(e)}")
+
+    def start_watcher(self):
+        """Poll the manifest in a background thread."""
+        if self.watch_interval and self._watcher is None:
+            self._watcher = threading.Thread(target=self._watch, name="index-watcher", daemon=True)
+            self._watcher.start()
+
+    def stop_watcher(self):
+        self._stop.set()
+
+    def status(self):
+        """Active version, published versions and swap state."""
+        manifest = load_manifest(self.versions_dir) or {}
+        return {
+            "active": self._active.version if self._active is not None else None,
+            "manifest_active": manifest.get("active"),
+            "previous": manifest.get("previous"),
+            "versions": manifest.get("versions", {}),
+            "loading": self.loading,
+            "last_error": self.last_error,
+            **self.stats(),
+        }
+
+    def stats(self):
+        """Swap counters, queries on the active version and snapshots still draining."""
+        active = self._active
+        # Only what is already loaded: a snapshot swapped out meanwhile must not load anything
+        store = active.loaded("vector_store") if active is not None else None
+        draining = [old for old in self._draining if not old.closed]
+        return {
+            "swaps": self.swaps,
+            "failed_swaps": self.failed_swaps,
+            "products": len(store) if store is not None else 0,
+            "active_queries": active.refs if active is not None else 0,
+            "draining_versions": len(draining),
+            "draining_queries": sum(old.refs for old in draining),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Publish and switch versioned search indexes.")
+    parser.add_argument("--versions", default="index_versions", help="Directory of published versions")
+    commands = parser.add_subparsers(dest="command", required=True)
+    publish = commands.add_parser("publish", help="Copy a vector store as the next version")
+    publish.add_argument("--store", default="vector_store", help="Vector store directory to publish")
+    publish.add_argument("--no-activate", action="store_true", help="Publish without making it active")
+    activate = commands.add_parser("activate", help="Make a published version active")
+    activate.add_argument("version")
+    commands.add_parser("rollback", help="Reactivate the previous version")
+    commands.add_parser("list", help="List published versions")
+    prune = commands.add_parser("prune", help="Delete old versions")
+    prune.add_argument("--keep", type=int, default=3, help="Newest versions kept (besides active/previous)")
+    args = parser.parse_args()
+
+    if args.command == "publish":
+        version = publish_version(args.store, args.versions, activate=not args.no_activate)
+        print(f"Published {version}" + ("" if args.no_activate else " (active)"))
+    elif args.command == "activate":
+        print(f"Active version: {set_active(args.versions, args.version)}")
+    elif args.command == "rollback":
+        print(f"Active version: {rollback_version(args.versions)}")
+    elif args.command == "list":
+        manifest = load_manifest(args.versions) or {"active": None, "previous": None, "versions": {}}
+        for version, info in sorted(manifest["versions"].items()):
+            marker = "*" if version == manifest["active"] else ("<" if version == manifest["previous"] else " ")
+            print(f"{marker} {version}  {info['created']}  {info['count']} products")
+    else:
+        deleted = prune_versions(args.versions, keep=args.keep)
+        print(f"Deleted {len(deleted)} versions: {', '.join(deleted) or '-'}")
@@ -0,0 +1,300 @@
+"""
+Incremental offline embedding builder for the product image catalog.
+
+Replaces the one-image-at-a-time loop in Notebooks/Generte Embeddings.ipynb:
+    python -m src.indexer --images images --store vector_store --workers 4 --batch-size 64
+
+Images are keyed on file name with their mtime, size and content hash recorded in
+<store>/sources.json. Only new or changed images are decoded and embedded; images removed
+from the directory are dropped from the store. Decoding and preprocessing run in a process
+pool, and the CLIP vision tower runs batched under torch.inference_mode().
+
+Files are replaced, never rewritten in place, so a server mapping the store keeps a consistent
+view. Running servers should serve published versions rather than the build directory:
+    python -m src.indexer --images images --store vector_store --publish
+builds in vector_store/ and then publishes it as a new version that servers swap to.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .vector_store import (load_vector_store, vector_store_exists, write_vector_store,
+                           append_to_vector_store, update_vector_store_rows, compact_vector_store)
+from .vector_index import l2_normalize
+from .ann_index import ANN_INDEX_DIR, ivf_index_exists, load_ivf_index
+from .keyword_index import KEYWORD_INDEX_DIR, build_keyword_index
+from .similar_search import NEIGHBORS_FILE
+
+SOURCES_FILE = "sources.json"
+VALID_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp'}
+
+_worker_processor = None
+
+
+def file_sha1(path):
+    """Hex SHA-1 of a file's contents."""
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def scan_images(directory):
+    """
+    List the images in a directory with their change signature.
+
+    Returns:
+        dict: file name -> (path, mtime_ns, size).
+    """
+    images = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file() and os.path.splitext(entry.name)[1].lower() in VALID_EXTENSIONS:
+                stat = entry.stat()
+                images[entry.name] = (os.path.join(directory, entry.name), stat.st_mtime_ns, stat.st_size)
+    return images
+
+
+def load_sources(store_dir):
+    """Read the per-image signatures recorded by the previous run."""
+    path = os.path.join(store_dir, SOURCES_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def save_sources(store_dir, sources):
+    path = os.path.join(store_dir, SOURCES_FILE)
+    with open(path + ".tmp", "w") as file:
+        json.dump(sources, file)
+    os.replace(path + ".tmp", path)
+
+
+def plan_changes(images, sources, store_ids):
+    """
+    Decide which images need embedding.
+
+    Parameters:
+        images (dict): Output of scan_images.
+        sources (dict): Signatures from the previous run: name -> [mtime_ns, size, sha1].
+        store_ids (set): Names currently in the vector store.
+
+    Returns:
+        tuple: (new names, changed names, deleted names, updated sources dict).
+    """
+    new, changed, updated_sources = [], [], {}
+    for name, (path, mtime_ns, size) in images.items():
+        previous = sources.get(name)
+        if name in store_ids and previous and previous[0] == mtime_ns and previous[1] == size:
+            updated_sources[name] = previous
+            continue
+        digest = file_sha1(path)
+        updated_sources[name] = [mtime_ns, size, digest]
+        if name not in store_ids:
+            new.append(name)
+        elif previous and previous[2] != digest:
+            # Touched files with identical content are not re-embedded; images already in a store
+            # converted from vectors.csv have no previous signature and are only recorded
+            changed.append(name)
+    deleted = sorted(store_ids - set(images))
+    return sorted(new), sorted(changed), deleted, updated_sources
+
+
+def _init_worker(model_id):
+    global _worker_processor
+    from transformers import CLIPImageProcessor
+    _worker_processor = CLIPImageProcessor.from_pretrained(model_id)
+
+
+def _preprocess(batch):
+    """Decode and preprocess a batch of (name, path) pairs in a worker process."""
+    from PIL import Image
+
+    names, images, failed = [], [], []
+    for name, path in batch:
+        try:
+            with Image.open(path) as image:
+                images.append(image.convert("RGB"))
+            names.append(name)
+        except Exception as e:
+            failed.append((name, str(e)))
+    if not images:
+        return names, None, failed
+    pixel_values = _worker_processor(images=images, return_tensors="np")["pixel_values"]
+    return names, pixel_values.astype(np.float32), failed
+
+
+def embed_images(items, workers, batch_size):
+    """
+    Embed images with a process pool for decoding and batched CLIP forward passes.
+
+    Parameters:
+        items (list): (name, path) pairs.
+        workers (int): Decode/preprocess processes.
+        batch_size (int): Images per forward pass.
+
+    Returns:
+        tuple: (names, (count x dim) float32 embeddings, failed (name, error) pairs).
+    """
+    import torch
+    from . import clip_search
+
+    batches = [items[start:start + batch_size] for start in range(0, len(items), batch_size)]
+    names, embeddings, failed = [], [], []
+    device = clip_search.get_device()
+    # spawn, not fork: the parent has already started torch's thread pools
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(clip_search.model_id,),
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        # At most 2 * workers batches are submitted at a time, so decoded pixels never pile up
+        # faster than the model consumes them
+        pending = deque()
+        next_batch = 0
+        while pending or next_batch < len(batches):
+            while next_batch < len(batches) and len(pending) < 2 * workers:
+                pending.append(pool.submit(_preprocess, batches[next_batch]))
+                next_batch += 1
+            batch_names, pixel_values, batch_failed = pending.popleft().result()
+            failed.extend(batch_failed)
+            if pixel_values is None:
+                continue
+            with torch.inference_mode():
+                features = clip_search.image_features(torch.from_numpy(pixel_values).to(device))
+            names.extend(batch_names)
+            embeddings.append(features.cpu().numpy().astype(np.float32))
+            print(f"  embedded {len(names)}/{len(items)}", end="\r")
+    dim = embeddings[0].shape[1] if embeddings else 0
+    return names, np.vstack(embeddings) if embeddings else np.empty((0, dim), dtype=np.float32), failed
+
+
+def update_ann_index(store_dir, store, appended_rows, changed_rows, compacted):
+    """
+    Keep a saved IVF index in step with the store: re-assign changed rows and add appended
+    ones, or re-fill every list after compaction.
+    """
+    ann_dir = os.path.join(store_dir, ANN_INDEX_DIR)
+    if not ivf_index_exists(ann_dir):
+        return
+    ivf, _ = load_ivf_index(ann_dir)
+    if compacted:
+        # Row numbers shifted; re-assign every row with the existing centroids/codebooks
+        ivf.reset()
+        ivf.add(store.matrix, np.arange(len(store), dtype=np.int64))
+    elif len(appended_rows) or len(changed_rows):
+        if len(changed_rows):
+            # New vectors may belong to another list and always have new PQ codes
+            ivf.remove(changed_rows)
+        rows = np.concatenate([changed_rows, appended_rows]).astype(np.int64)
+        ivf.add(store.matrix[rows], rows)
+    else:
+        return
+    ivf.save(ann_dir)
+    print(f"Updated IVF index ({len(ivf)} vectors)")
+
+
+def build_index(image_dir, store_dir, workers=4, batch_size=64, tag=True):
+    """
+    Bring the vector store in line with the image directory.
+
+    Parameters:
+        image_dir (str): Directory of product images.
+        store_dir (str): Vector store directory.
+        workers (int): Decode/preprocess processes.
+        batch_size (int): Images per forward pass.
+        tag (bool): Tag product attributes zero-shot for the keyword index.
+
+    Returns:
+        dict: Counts of new, changed, deleted and failed images plus throughput.
+    """
+    started = time.perf_counter()
+    store = load_vector_store(store_dir) if vector_store_exists(store_dir) else None
+    store_ids = set(store.ids) if store is not None else set()
+    images = scan_images(image_dir)
+    previous_sources = load_sources(store_dir)
+    new, changed, deleted, sources = plan_changes(images, previous_sources, store_ids)
+    print(f"{len(images)} images: {len(new)} new, {len(changed)} changed, {len(deleted)} deleted")
+
+    to_embed = [(name, images[name][0]) for name in new + changed]
+    embed_started = time.perf_counter()
+    names, embeddings, failed = embed_images(to_embed, workers, batch_size) if to_embed else ([], None, [])
+    embed_seconds = time.perf_counter() - embed_started
+    for name, error in failed:
+        print(f"Could not embed {name}: {error}")
+        if name in store_ids and name in previous_sources:
+            # Keep the old signature of a changed image, so the next run sees the change and retries it
+            sources[name] = previous_sources[name]
+        else:
+            sources.pop(name, None)
+
+    if names and (store is None or store.normalized):
+        embeddings = l2_normalize(embeddings)
+    vectors = dict(zip(names, embeddings)) if names else {}
+
+    if store is None:
+        ids = [name for name in new if name in vectors]
+        write_vector_store(store_dir, np.vstack([vectors[name] for name in ids]) if ids else np.empty((0, 0)),
+                           ids, [images[name][0] for name in ids], normalized=True)
+        appended_rows, changed_rows, compacted = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), False
+    else:
+        changed_done = [name for name in changed if name in vectors]
+        changed_rows = np.array([store.row_of[name] for name in changed_done], dtype=np.int64)
+        if changed_done:
+            update_vector_store_rows(store, changed_rows, np.vstack([vectors[name] for name in changed_done]))
+            store = load_vector_store(store_dir)
+        compacted = bool(deleted)
+        if compacted:
+            removed = {store.row_of[name] for name in deleted}
+            compact_vector_store(store, [row for row in range(len(store)) if row not in removed])
+            store = load_vector_store(store_dir)
+        appended = [name for name in new if name in vectors]
+        appended_rows = np.arange(len(store), len(store) + len(appended), dtype=np.int64)
+        if appended:
+            append_to_vector_store(store, np.vstack([vectors[name] for name in appended]),
+                                   appended, [images[name][0] for name in appended])
+
+    save_sources(store_dir, sources)
+    store = load_vector_store(store_dir)
+    update_ann_index(store_dir, store, appended_rows, changed_rows, compacted)
+    if names or deleted or not os.path.exists(os.path.join(store_dir, KEYWORD_INDEX_DIR)):
+        # BM25 statistics depend on the whole catalog, so postings are rebuilt; zero-shot tags of
+        # unchanged products are reused and only the embedded images are tagged
+        keyword_index = build_keyword_index(store_dir, tag=tag, retag=set(names))
+        print(f"Rebuilt keyword index ({len(keyword_index.terms)} terms)")
+    neighbors_path = os.path.join(store_dir, NEIGHBORS_FILE)
+    if (names or deleted) and os.path.exists(neighbors_path):
+        # Neighbor lists refer to the old rows; they are computed on demand until precomputed again
+        os.remove(neighbors_path)
+        print("Removed stale neighbor lists; rerun `python -m src.similar_search` to precompute them")
+
+    total_seconds = time.perf_counter() - started
+    throughput = len(names) / embed_seconds if names and embed_seconds > 0 else 0.0
+    print(f"Store has {len(store)} vectors. Embedded {len(names)} images in {embed_seconds:.1f}s "
+          f"({throughput:.1f} images/s), total {total_seconds:.1f}s")
+    return {
+        "new": len(new), "changed": len(changed), "deleted": len(deleted), "failed": len(failed),
+        "images_per_second": throughput, "seconds": total_seconds,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incrementally embed product images into the vector store.")
+    parser.add_argument("--images", default="images", help="Product image directory")
+    parser.add_argument("--store", default="vector_store", help="Vector store directory")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Decode/preprocess processes")
+    parser.add_argument("--batch-size", type=int, default=64, help="Images per CLIP forward pass")
+    parser.add_argument("--no-tag", action="store_true", help="Do not tag attributes zero-shot for the keyword index")
+    parser.add_argument("--publish", metavar="VERSIONS_DIR", nargs="?", const="index_versions",
+                        help="Publish the updated store as a new active index version (default: index_versions)")
+    args = parser.parse_args()
+    build_index(args.images, args.store, workers=args.workers, batch_size=args.batch_size, tag=not args.no_tag)
+    if args.publish:
+        from .index_registry import publish_version
+        print(f"Published index version {publish_version(args.store, args.publish)}; running servers swap to it")
@@ -0,0 +1,430 @@
+"""
+Keyword and attribute index built alongside the vector store, for hybrid search.
+
+    BM25     Inverted index over product names/descriptions (term -> rows, term frequencies)
+    Filters  One bitmap per attribute value (gender, color, occasion, style); a filter is an OR
+             of value bitmaps within an attribute and an AND across attributes
+
+Product text and attributes come from an optional <store>/metadata.json file
+({"<image id>": {"name": ..., "description": ..., "color": ..., ...}}). File names are used as
+names when no metadata is given, and missing attributes can be tagged zero-shot from the
+image embeddings with CLIP text prompts:
+    python -m src.keyword_index build --tag
+    python -m src.keyword_index query "black leather boots" --filter color=black
+"""
+import argparse
+import json
+import os
+import re
+
+import numpy as np
+
+from .vector_index import l2_normalize, top_k_rows
+
+KEYWORD_INDEX_DIR = "keywords"
+METADATA_FILE = "metadata.json"
+META_FILE = "meta.json"
+# Zero-shot tags per product id, kept so incremental builds only tag new and changed images
+TAGS_FILE = "tags.json"
+
+# Attribute vocabulary, matching the preferences gathered in instructions_for_llm
+ATTRIBUTES = {
+    "gender": ["men", "women", "kids", "unisex"],
+    "color": ["black", "white", "brown", "grey", "blue", "red", "pink", "green", "beige", "yellow"],
+    "occasion": ["formal", "casual", "sports", "party", "wedding", "outdoor", "beach"],
+    "style": ["sneakers", "boots", "heels", "sandals", "loafers", "flats", "slippers", "oxfords"],
+}
+
+# Zero-shot prompt per attribute; {} is replaced by the attribute value
+TAG_PROMPTS = {
+    "gender": "a photo of shoes for {}",
+    "color": "a photo of {} shoes",
+    "occasion": "a photo of {} shoes",
+    "style": "a photo of {}",
+}
+
+STOPWORDS = {"a", "an", "and", "the", "for", "of", "with", "in", "on", "to", "or", "by", "shoe", "pair"}
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+TAG_CHUNK_SIZE = 65536
+
+
+def tokenize(text):
+    """
+    Split text into lowercase index terms, dropping stopwords and plural "s".
+
+    Parameters:
+        text (str): Product text or query.
+
+    Returns:
+        list: Terms.
+    """
+    terms = []
+    for token in re.findall(r"[a-z0-9]+", text.lower()):
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        if token not in STOPWORDS:
+            terms.append(token)
+    return terms
+
+
+def name_from_id(image_id):
+    """Readable product name from an image file name, e.g. 'black_leather-boot_12.jpg' -> 'black leather boot 12'."""
+    return re.sub(r"[_\-.]+", " ", os.path.splitext(image_id)[0]).strip()
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Fuse several rankings of rows with reciprocal-rank fusion: score = sum(1 / (k + rank)).
+
+    Parameters:
+        rankings (list): Row arrays, each best first.
+        k (int): RRF damping constant.
+
+    Returns:
+        tuple: (rows, scores) arrays, best first.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, row in enumerate(np.asarray(ranking).tolist()):
+            fused[row] = fused.get(row, 0.0) + 1.0 / (k + rank + 1)
+    rows = np.fromiter(fused.keys(), dtype=np.int64, count=len(fused))
+    scores = np.fromiter(fused.values(), dtype=np.float64, count=len(fused))
+    best, best_scores = top_k_rows(scores, len(rows))
+    return rows[best], best_scores
+
+
+class KeywordIndex:
+    """
+    BM25 inverted index plus packed attribute bitmaps over vector store rows.
+
+    Postings are stored as flat arrays (terms sorted, rows ascending within a term), and
+    every attribute value is a bitmap of ceil(count / 8) bytes. The index is read-only after
+    construction, so one instance can be queried from many threads.
+
+    Parameters:
+        count (int): Number of indexed rows.
+        terms (list): Sorted vocabulary.
+        offsets (np.ndarray): Start of each term's postings (len(terms) + 1 entries).
+        posting_rows (np.ndarray): Rows of all postings.
+        posting_tf (np.ndarray): Term frequency of each posting.
+        doc_lengths (np.ndarray): Terms per row.
+        bitmap_keys (list): "attribute=value" key of each bitmap.
+        bitmaps (np.ndarray): (len(bitmap_keys) x ceil(count / 8)) packed uint8 bitmaps.
+    """
+
+    def __init__(self, count, terms, offsets, posting_rows, posting_tf, doc_lengths, bitmap_keys, bitmaps):
+        self.count = count
+        self.terms = terms
+        self.term_ids = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.posting_rows = posting_rows
+        self.posting_tf = posting_tf
+        self.doc_lengths = doc_lengths
+        self.average_length = float(doc_lengths.mean()) if count else 0.0
+        self.bitmap_keys = bitmap_keys
+        self.bitmap_ids = {key: i for i, key in enumerate(bitmap_keys)}
+        self.bitmaps = bitmaps
+
+    def __len__(self):
+        return self.count
+
+    @classmethod
+    def build(cls, texts, attributes):
+        """
+        Index one text and one attribute dict per vector store row.
+
+        Parameters:
+            texts (list): Product text per row.
+            attributes (list): {attribute: value} dict per row.
+
+        Returns:
+            KeywordIndex: The built index.
+        """
+        count = len(texts)
+        postings, doc_lengths = {}, np.zeros(count, dtype=np.float32)
+        for row, text in enumerate(texts):
+            terms = tokenize(text)
+            doc_lengths[row] = len(terms)
+            for term in terms:
+                row_counts = postings.setdefault(term, {})
+                row_counts[row] = row_counts.get(row, 0) + 1
+
+        terms = sorted(postings)
+        sizes = [len(postings[term]) for term in terms]
+        offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        posting_rows = np.empty(offsets[-1], dtype=np.int32)
+        posting_tf = np.empty(offsets[-1], dtype=np.uint16)
+        for i, term in enumerate(terms):
+            rows = sorted(postings[term])
+            posting_rows[offsets[i]:offsets[i + 1]] = rows
+            posting_tf[offsets[i]:offsets[i + 1]] = [min(postings[term][row], 65535) for row in rows]
+
+        bitmap_keys = [f"{name}={value}" for name, values in ATTRIBUTES.items() for value in values]
+        bits = np.zeros((len(bitmap_keys), count), dtype=bool)
+        key_ids = {key: i for i, key in enumerate(bitmap_keys)}
+        for row, row_attributes in enumerate(attributes):
+            for name, value in row_attributes.items():
+                key_id = key_ids.get(f"{name}={value}")
+                if key_id is not None:
+                    bits[key_id, row] = True
+        return cls(count, terms, offsets, posting_rows, posting_tf, doc_lengths, bitmap_keys,
+                   np.packbits(bits, axis=1))
+
+    def filter_bitmap(self, filters):
+        """
+        Intersect attribute bitmaps.
+
+        Parameters:
+            filters (dict): attribute -> value or list of values. Values of one attribute are
+                OR-ed, attributes are AND-ed; attributes that are not indexed are ignored.
+
+        Returns:
+            np.ndarray or None: Packed bitmap of matching rows, or None when nothing filters.
+        """
+        result = None
+        for name, values in filters.items():
+            if name not in ATTRIBUTES or values in (None, "", []):
+                continue
+            if isinstance(values, str):
+                values = [values]
+            matched = np.zeros(self.bitmaps.shape[1], dtype=np.uint8)
+            for value in values:
+                key_id = self.bitmap_ids.get(f"{name}={str(value).lower()}")
+                if key_id is not None:
+                    matched |= self.bitmaps[key_id]
+            result = matched if result is None else result & matched
+        return result
+
+    def filter_rows(self, filters):
+        """
+        Rows matching every attribute filter.
+
+        Parameters:
+            filters (dict): See filter_bitmap.
+
+        Returns:
+            np.ndarray or None: Ascending row indices, or None when no filter applies.
+        """
+        bitmap = self.filter_bitmap(filters or {})
+        if bitmap is None:
+            return None
+        return np.flatnonzero(np.unpackbits(bitmap, count=self.count)).astype(np.int64)
+
+    def bm25(self, query, rows=None, limit=100):
+        """
+        Rank rows by BM25 against a text query.
+
+        Parameters:
+            query (str): Query text.
+            rows (np.ndarray): Optional ascending candidate rows (e.g. from filter_rows).
+            limit (int): Number of results to return.
+
+        Returns:
+            tuple: (rows, scores) arrays of rows containing at least one query term, best first.
+        """
+        matched_rows, contributions = [], []
+        for term in set(tokenize(query)):
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            term_rows, tf = self.posting_rows[start:end], self.posting_tf[start:end].astype(np.float32)
+            idf = np.log(1.0 + (self.count - len(term_rows) + 0.5) / (len(term_rows) + 0.5))
+            norm = BM25_K1 * (1.0 - BM25_B + BM25_B * self.doc_lengths[term_rows] / max(self.average_length, 1e-6))
+            matched_rows.append(term_rows)
+            contributions.append(idf * tf * (BM25_K1 + 1.0) / (tf + norm))
+        if not matched_rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        unique_rows, inverse = np.unique(np.concatenate(matched_rows), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(contributions)).astype(np.float32)
+        if rows is not None:
+            keep = np.isin(unique_rows, rows, assume_unique=True)
+            unique_rows, scores = unique_rows[keep], scores[keep]
+        best, best_scores = top_k_rows(scores, limit)
+        return unique_rows[best].astype(np.int64), best_scores
+
+    def save(self, directory):
+        """
+        Persist the index as .npy arrays plus a small JSON metadata file.
+
+        Every file is written under a temporary name and renamed into place, the metadata
+        last, so a reader never loads a partially written file.
+        """
+        os.makedirs(directory, exist_ok=True)
+        arrays = {
+            "offsets.npy": self.offsets,
+            "posting_rows.npy": self.posting_rows,
+            "posting_tf.npy": self.posting_tf,
+            "doc_lengths.npy": self.doc_lengths,
+            "bitmaps.npy": self.bitmaps,
+        }
+        tmp_suffix = f".{os.getpid()}.tmp"
+        for name, array in arrays.items():
+            # np.save appends .npy to names without it, so write through a file handle
+            with open(os.path.join(directory, name + tmp_suffix), "wb") as file:
+                np.save(file, array)
+        with open(os.path.join(directory, META_FILE + tmp_suffix), "w") as file:
+            json.dump({"count": self.count, "terms": self.terms, "bitmap_keys": self.bitmap_keys}, file)
+        for name in list(arrays) + [META_FILE]:
+            os.replace(os.path.join(directory, name + tmp_suffix), os.path.join(directory, name))
+
+
+def keyword_index_exists(directory):
+    """Check whether a directory contains a saved keyword index."""
+    return os.path.exists(os.path.join(directory, META_FILE))
+
+
+def load_keyword_index(directory):
+    """
+    Load a keyword index saved with KeywordIndex.save.
+
+    Parameters:
+        directory (str): Index directory.
+
+    Returns:
+        KeywordIndex: The loaded index.
+    """
+    with open(os.path.join(directory, META_FILE), "r") as file:
+        meta = json.load(file)
+    return KeywordIndex(
+        meta["count"], meta["terms"],
+        np.load(os.path.join(directory, "offsets.npy")),
+        np.load(os.path.join(directory, "posting_rows.npy")),
+        np.load(os.path.join(directory, "posting_tf.npy")),
+        np.load(os.path.join(directory, "doc_lengths.npy")),
+        meta["bitmap_keys"],
+        np.load(os.path.join(directory, "bitmaps.npy")),
+    )
+
+
+def load_metadata(store_dir):
+    """Read the optional per-product metadata file; returns {} when there is none."""
+    path = os.path.join(store_dir, METADATA_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def tag_attributes(matrix, encode_texts):
+    """
+    Zero-shot attribute tagging: pick the attribute value whose CLIP text prompt is closest
+    to each image embedding.
+
+    Parameters:
+        matrix (np.ndarray): (count x dim) image embeddings.
+        encode_texts (callable): Encodes a list of prompts into a (prompts x dim) matrix.
+
+    Returns:
+        list: {attribute: value} dict per row.
+    """
+    tags = [{} for _ in range(len(matrix))]
+    for name, values in ATTRIBUTES.items():
+        prompts = l2_normalize(encode_texts([TAG_PROMPTS[name].format(value) for value in values]))
+        for start in range(0, len(matrix), TAG_CHUNK_SIZE):
+            chunk = l2_normalize(matrix[start:start + TAG_CHUNK_SIZE])
+            for offset, best in enumerate(np.argmax(chunk @ prompts.T, axis=1).tolist()):
+                tags[start + offset][name] = values[best]
+    return tags
+
+
+def load_tags(index_dir):
+    """Read the zero-shot tags saved by the previous build: image id -> {attribute: value}."""
+    path = os.path.join(index_dir, TAGS_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def _save_tags(index_dir, tags):
+    os.makedirs(index_dir, exist_ok=True)
+    path = os.path.join(index_dir, TAGS_FILE)
+    with open(f"{path}.{os.getpid()}.tmp", "w") as file:
+        json.dump(tags, file)
+    os.replace(f"{path}.{os.getpid()}.tmp", path)
+
+
+def build_keyword_index(store_dir, tag=False, retag=None):
+    """
+    Build and save the keyword index for a vector store.
+
+    Parameters:
+        store_dir (str): Vector store directory.
+        tag (bool): Tag attributes missing from metadata.json zero-shot with CLIP.
+        retag (set): Image ids whose images changed; the saved tags of every other product are
+            reused, so only these (and untagged products) run through CLIP. None tags every product.
+
+    Returns:
+        KeywordIndex: The saved index.
+    """
+    from .vector_store import load_vector_store
+
+    store = load_vector_store(store_dir)
+    metadata = load_metadata(store_dir)
+    index_dir = os.path.join(store_dir, KEYWORD_INDEX_DIR)
+    tags = None
+    if tag:
+        from .clip_search import encode_texts
+        saved = load_tags(index_dir) if retag is not None else {}
+        pending = [row for row, image_id in enumerate(store.ids) if image_id not in saved or image_id in retag]
+        if len(pending) == len(store):
+            tags = tag_attributes(store.matrix, encode_texts)
+        else:
+            tags = [saved.get(image_id, {}) for image_id in store.ids]
+            if pending:
+                for row, row_tags in zip(pending, tag_attributes(store.matrix[np.array(pending)], encode_texts)):
+                    tags[row] = row_tags
+        print(f"Tagged {len(pending)} products zero-shot")
+        _save_tags(index_dir, dict(zip(store.ids, tags)))
+
+    texts, attributes = [], []
+    for row, image_id in enumerate(store.ids):
+        product = metadata.get(image_id, {})
+        row_attributes = dict(tags[row]) if tags is not None else {}
+        row_attributes.update({name: str(product[name]).lower() for name in ATTRIBUTES if product.get(name)})
+        attributes.append(row_attributes)
+        texts.append(" ".join([product.get("name") or name_from_id(image_id), product.get("description", "")]
+                              + list(row_attributes.values())))
+
+    index = KeywordIndex.build(texts, attributes)
+    index.save(index_dir)
+    return index
+
+
+def parse_filters(values):
+    """Parse repeated attribute=value arguments into a filters dict (repeats are OR-ed)."""
+    filters = {}
+    for item in values or []:
+        name, _, value = item.partition("=")
+        filters.setdefault(name.strip(), []).append(value.strip())
+    return filters
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query the keyword/attribute index.")
+    parser.add_argument("command", choices=["build", "query"])
+    parser.add_argument("text", nargs="?", default="", help="Query text (query)")
+    parser.add_argument("--store", default="vector_store", help="Vector store directory")
+    parser.add_argument("--tag", action="store_true", help="Tag missing attributes zero-shot with CLIP (build)")
+    parser.add_argument("--filter", action="append", help="attribute=value filter (query, repeatable)")
+    parser.add_argument("--k", type=int, default=10, help="Results to show (query)")
+    args = parser.parse_args()
+
+    index_dir = os.path.join(args.store, KEYWORD_INDEX_DIR)
+    if args.command == "build":
+        index = build_keyword_index(args.store, tag=args.tag)
+        print(f"Indexed {len(index)} products, {len(index.terms)} terms -> {index_dir}")
+    else:
+        from .vector_store import load_vector_store
+
+        index, ids = load_keyword_index(index_dir), load_vector_store(args.store).ids
+        candidates = index.filter_rows(parse_filters(args.filter))
+        if candidates is not None:
+            print(f"{len(candidates)} of {len(index)} products match the filters")
+        rows, scores = index.bm25(args.text, rows=candidates, limit=args.k)
+        for row, score in zip(rows.tolist(), scores.tolist()):
+            print(f"{score:8.3f}  {ids[row]}")
@@ -0,0 +1,489 @@
+"""
+LLM provider interface for the shopping assistant chat.
+
+    gemini  google.generativeai adapter (the production model)
+    stub    Deterministic offline provider that emits function calls on a configurable rule
+    replay  Replays recorded responses from a JSONL file, falling back to the stub
+
+Every provider's chats return LLMResponse objects, so the server does not depend on the
+Gemini response layout. Replies can also be streamed as LLMResponse chunks. Responses can
+be cached on (history hash, message), and every provider call is timed.
+"""
+import asyncio
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+
+def content_role(content):
+    """Role of a history entry, for dict entries and Gemini Content objects alike."""
+    return content.get("role") if isinstance(content, dict) else getattr(content, "role", None)
+
+
+def content_parts(content):
+    return content.get("parts", []) if isinstance(content, dict) else getattr(content, "parts", [])
+
+
+def content_text(content):
+    """Concatenate the text parts of a history entry (function calls have no text)."""
+    texts = []
+    for part in content_parts(content):
+        text = part if isinstance(part, str) else getattr(part, "text", "")
+        if text:
+            texts.append(text)
+    return " ".join(texts)
+
+
+class FunctionCall:
+    """A function call requested by the model."""
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __repr__(self):
+        return f"FunctionCall(name={self.name!r}, args={self.args!r})"
+
+
+class LLMResponse:
+    """
+    Provider-independent model reply.
+
+    Attributes:
+        text (str): Reply text (empty when the model only called a function).
+        function_call (FunctionCall): Requested function call, or None.
+    """
+
+    def __init__(self, text="", function_call=None):
+        self.text = text
+        self.function_call = function_call
+
+    def __repr__(self):
+        return f"LLMResponse(text={self.text!r}, function_call={self.function_call!r})"
+
+    def to_history(self):
+        """History entry recording this reply in the offline providers' dict history."""
+        if self.function_call is not None:
+            return {"role": "model", "parts": [
+                f"[{self.function_call.name}: {json.dumps(self.function_call.args, sort_keys=True)}]"]}
+        return {"role": "model", "parts": [self.text]}
+
+
+class LatencyStats:
+    """Thread-safe call counter and latency accumulator for one provider."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.latencies = []  # most recent call latencies, bounded; percentiles are computed over them
+
+    def record(self, seconds, error=False):
+        with self._lock:
+            self.calls += 1
+            self.errors += error
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+            self.latencies.append(seconds)
+            del self.latencies[:-1000]
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "mean_ms": 1000 * self.total_seconds / self.calls if self.calls else 0.0,
+                "p50_ms": 1000 * latencies[len(latencies) // 2] if latencies else 0.0,
+                "p95_ms": 1000 * latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] if latencies else 0.0,
+                "max_ms": 1000 * self.max_seconds,
+            }
+
+
+class ProviderChat:
+    """
+    Base class for a chat conversation held by one session.
+
+    Subclasses implement _send (and optionally _send_async and _stream_async); this class adds timing.
+    """
+
+    def __init__(self, provider):
+        self.provider = provider
+
+    @property
+    def history(self):
+        raise NotImplementedError
+
+    @history.setter
+    def history(self, history):
+        raise NotImplementedError
+
+    def _send(self, msg, tools):
+        raise NotImplementedError
+
+    async def _send_async(self, msg, tools):
+        return await asyncio.to_thread(self._send, msg, tools)
+
+    async def _stream_async(self, msg, tools):
+        # Providers without streaming yield the whole reply as one chunk
+        yield await self._send_async(msg, tools)
+
+    def send_message(self, msg, tools=None):
+        started = time.perf_counter()
+        try:
+            response = self._send(msg, tools)
+        except Exception:
+            self.provider.latency.record(time.perf_counter() - started, error=True)
+            raise
+        self.provider.latency.record(time.perf_counter() - started)
+        return response
+
+    async def send_message_async(self, msg, tools=None):
+        started = time.perf_counter()
+        try:
+            response = await self._send_async(msg, tools)
+        except Exception:
+            self.provider.latency.record(time.perf_counter() - started, error=True)
+            raise
+        self.provider.latency.record(time.perf_counter() - started)
+        return response
+
+    async def stream_message_async(self, msg, tools=None):
+        """
+        Send a message and yield the reply as it is generated.
+
+        Yields:
+            LLMResponse: Chunks carrying a text delta and/or the requested function call.
+        """
+        started = time.perf_counter()
+        try:
+            async for chunk in self._stream_async(msg, tools):
+                yield chunk
+        except Exception:
+            self.provider.latency.record(time.perf_counter() - started, error=True)
+            raise
+        self.provider.latency.record(time.perf_counter() - started)
+
+
+class LLMProvider:
+    """Base class: creates chats and owns the latency statistics."""
+
+    name = "base"
+
+    def __init__(self):
+        self.latency = LatencyStats()
+
+    def start_chat(self, history):
+        raise NotImplementedError
+
+
+class GeminiChat(ProviderChat):
+    def __init__(self, provider, chat):
+        super().__init__(provider)
+        self.chat = chat
+
+    @property
+    def history(self):
+        return self.chat.history
+
+    @history.setter
+    def history(self, history):
+        self.chat.history = history
+
+    @staticmethod
+    def _convert(response):
+        text, function_call = [], None
+        for part in response.candidates[0].content.parts:
+            call = getattr(part, "function_call", None)
+            if call is not None and call.name:
+                function_call = FunctionCall(call.name, dict(call.args))
+            elif getattr(part, "text", ""):
+                text.append(part.text)
+        return LLMResponse(" ".join(text), function_call)
+
+    def _send(self, msg, tools):
+        return self._convert(self.chat.send_message(msg, tools=tools))
+
+    async def _send_async(self, msg, tools):
+        return self._convert(await self.chat.send_message_async(msg, tools=tools))
+
+    async def _stream_async(self, msg, tools):
+        response = await self.chat.send_message_async(msg, tools=tools, stream=True)
+        async for chunk in response:
+            if not chunk.candidates:
+                continue
+            converted = self._convert(chunk)
+            if converted.text or converted.function_call is not None:
+                yield converted
+
+
+class GeminiProvider(LLMProvider):
+    """
+    Adapter for google.generativeai.
+
+    Parameters:
+        api_key (str): Gemini API key.
+        model_name (str): Gemini model name.
+        generation_config (dict): Sampling settings.
+    """
+
+    name = "gemini"
+
+    def __init__(self, api_key, model_name="gemini-pro", generation_config=None):
+        super().__init__()
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(model_name, generation_config=generation_config)
+
+    def start_chat(self, history):
+        return GeminiChat(self, self.model.start_chat(history=history))
+
+
+class StubChat(ProviderChat):
+    def __init__(self, provider, history):
+        super().__init__(provider)
+        self._history = list(history)
+        self.user_turns = 0
+
+    @property
+    def history(self):
+        return self._history
+
+    @history.setter
+    def history(self, history):
+        self._history = list(history)
+
+    def _respond(self, msg):
+        self.user_turns += 1
+        response = self.provider.respond(msg, self._history, self.user_turns)
+        self._history = self._history + [{"role": "user", "parts": [msg]}, response.to_history()]
+        return response
+
+    def _send(self, msg, tools):
+        time.sleep(self.provider.latency_seconds)
+        return self._respond(msg)
+
+    async def _send_async(self, msg, tools):
+        await asyncio.sleep(self.provider.latency_seconds)
+        return self._respond(msg)
+
+    async def _stream_async(self, msg, tools):
+        # Half the round trip passes before the first token; the rest is spread over the words
+        await asyncio.sleep(self.provider.latency_seconds / 2)
+        response = self._respond(msg)
+        if response.function_call is not None:
+            yield response
+            return
+        words = response.text.split(" ")
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(self.provider.latency_seconds / 2 / len(words))
+            yield LLMResponse(word if i == 0 else " " + word)
+
+
+class StubProvider(LLMProvider):
+    """
+    Deterministic offline provider.
+
+    Calls perform_search_wrapper with the user's recent messages when a message matches
+    `search_pattern`, or on every `search_every`-th user turn; otherwise asks a follow-up.
+
+    Parameters:
+        latency_seconds (float): Simulated round trip.
+        search_every (int): Function call every N user turns (0 disables the turn rule).
+        search_pattern (str): Regex that triggers a function call immediately.
+        reply (str): Text of non-function replies.
+    """
+
+    name = "stub"
+
+    def __init__(self, latency_seconds=0.3, search_every=3, search_pattern=r"\b(show|find|search)\b",
+                 reply="Got it. Any preferred color or occasion?"):
+        super().__init__()
+        self.latency_seconds = latency_seconds
+        self.search_every = search_every
+        self.search_pattern = re.compile(search_pattern, re.IGNORECASE) if search_pattern else None
+        self.reply = reply
+
+    def respond(self, msg, history, user_turns):
+        wants_search = (self.search_every and user_turns % self.search_every == 0) or \
+            (self.search_pattern is not None and self.search_pattern.search(msg))
+        if not wants_search:
+            return LLMResponse(self.reply)
+        # Skip the instructions/greeting preamble; use the two previous user messages as context
+        recent = [content_text(content) for content in history[2:] if content_role(content) == "user"][-2:]
+        query = " ".join(recent + [msg])
+        return LLMResponse(function_call=FunctionCall("perform_search_wrapper", {"text_query": query}))
+
+    def start_chat(self, history):
+        return StubChat(self, history)
+
+
+class ReplayProvider(StubProvider):
+    """
+    Replays recorded responses from a JSONL file of
+    {"message": ..., "text": ..., "function_call": {"name": ..., "args": {...}}} lines.
+    Messages without a recording fall back to the stub rule.
+    """
+
+    name = "replay"
+
+    def __init__(self, path, **stub_options):
+        super().__init__(**stub_options)
+        self.recordings = {}
+        with open(path, "r") as file:
+            for line in file:
+                if line.strip():
+                    record = json.loads(line)
+                    self.recordings[record["message"].strip().lower()] = record
+
+    def respond(self, msg, history, user_turns):
+        record = self.recordings.get(msg.strip().lower())
+        if record is None:
+            return super().respond(msg, history, user_turns)
+        function_call = record.get("function_call")
+        return LLMResponse(record.get("text", ""),
+                           FunctionCall(function_call["name"], function_call.get("args", {})) if function_call else None)
+
+
+def history_key(history, msg):
+    """Stable hash of a conversation history plus the next message."""
+    sha1 = hashlib.sha1()
+    for content in history:
+        sha1.update(f"{content_role(content)}\x1f{content_text(content)}\x1e".encode())
+        for part in content_parts(content):
+            call = getattr(part, "function_call", None)
+            if call is not None and getattr(call, "name", ""):
+                sha1.update(f"{call.name}\x1f{json.dumps(dict(call.args), sort_keys=True, default=str)}".encode())
+    sha1.update(msg.strip().lower().encode())
+    return sha1.hexdigest()
+
+
+class ResponseCache:
+    """LRU cache of LLMResponse objects keyed on (history hash, message)."""
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            response = self._entries.get(key)
+            if response is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return response
+
+    def put(self, key, response):
+        with self._lock:
+            self._entries[key] = response
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_ratio": self.hits / total if total else 0.0,
+                "size": len(self._entries)}
+
+
+class CachingChat:
+    """
+    Wraps a provider chat so identical turns (same history, same message) are answered from
+    the response cache without a provider round trip. The cached reply is still appended to
+    the history, so the conversation continues exactly as if the model had answered.
+
+    Only text replies are cached: a function call can only be replayed into the history as
+    text, and a model shown fake textual tool calls starts imitating them.
+    """
+
+    def __init__(self, chat, cache):
+        self.chat = chat
+        self.cache = cache
+
+    @property
+    def provider(self):
+        return self.chat.provider
+
+    @property
+    def history(self):
+        return self.chat.history
+
+    @history.setter
+    def history(self, history):
+        self.chat.history = history
+
+    def _store(self, key, response):
+        if response.function_call is None:
+            self.cache.put(key, response)
+
+    def _cached(self, msg):
+        key = history_key(self.chat.history, msg)
+        response = self.cache.get(key)
+        if response is not None:
+            self.chat.history = list(self.chat.history) + [{"role": "user", "parts": [msg]}, response.to_history()]
+        return key, response
+
+    def send_message(self, msg, tools=None):
+        key, response = self._cached(msg)
+        if response is None:
+            response = self.chat.send_message(msg, tools=tools)
+            self._store(key, response)
+        return response
+
+    async def send_message_async(self, msg, tools=None):
+        key, response = self._cached(msg)
+        if response is None:
+            response = await self.chat.send_message_async(msg, tools=tools)
+            self._store(key, response)
+        return response
+
+    async def stream_message_async(self, msg, tools=None):
+        key, response = self._cached(msg)
+        if response is not None:
+            yield response
+            return
+        text, function_call = [], None
+        async for chunk in self.chat.stream_message_async(msg, tools=tools):
+            text.append(chunk.text)
+            function_call = chunk.function_call or function_call
+            yield chunk
+        # Only complete replies are cached; an abandoned stream leaves no entry
+        self._store(key, LLMResponse("".join(text), function_call))
+
+
+def create_provider(settings, api_key=None):
+    """
+    Build the provider described by the `llm` section of config.yaml.
+
+    Parameters:
+        settings (dict): The llm settings (provider, model, stub_latency_seconds, ...).
+        api_key (str): Gemini API key.
+
+    Returns:
+        LLMProvider: The configured provider.
+    """
+    name = settings.get("provider", "gemini")
+    stub_options = {
+        "latency_seconds": settings.get("stub_latency_seconds", 0.3),
+        "search_every": settings.get("stub_search_every", 3),
+    }
+    if name == "gemini":
+        return GeminiProvider(api_key, model_name=settings.get("model", "gemini-pro"),
+                              generation_config=settings.get("generation_config"))
+    if name == "stub":
+        return StubProvider(**stub_options)
+    if name == "replay":
+        return ReplayProvider(settings["replay_path"], **stub_options)
+    raise ValueError(f"Unknown LLM provider: {name}")
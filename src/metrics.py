@@ -0,0 +1,357 @@
+"""
+Request tracing, hot-path metrics and an opt-in sampling profiler.
+
+    span("encode_text")   Times a block into the span_seconds histogram and the current request trace
+    TracingMiddleware     Starts a trace per HTTP request, records request_seconds and logs slow requests
+    MetricsRegistry       Renders histograms plus registered stats() callbacks in Prometheus text format
+    SamplingProfiler      Profiles one in every N requests with pyinstrument (speedscope JSON) or cProfile (.pstats)
+"""
+import contextvars
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from sub-millisecond vector scoring up to slow LLM round trips
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+class Histogram:
+    """
+    Thread-safe Prometheus histogram with one label (e.g. span or route).
+
+    Parameters:
+        name (str): Metric name including the namespace.
+        help (str): Description shown in the HELP line.
+        label (str): Label name distinguishing the series.
+        buckets (tuple): Upper bounds in seconds.
+    """
+
+    def __init__(self, name, help, label, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._series = {}  # label value -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, seconds):
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += seconds
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {value: (list(counts), total, count) for value, (counts, total, count) in self._series.items()}
+        for value, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels([(self.label, value), ("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels([(self.label, value)])
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+def _flatten(stats, prefix=""):
+    """Flatten nested stats dicts into name -> number, skipping non-numeric values."""
+    flat = {}
+    for key, value in stats.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + "_"))
+        elif isinstance(value, bool):
+            flat[name] = int(value)
+        elif isinstance(value, (int, float)):
+            flat[name] = value
+    return flat
+
+
+class MetricsRegistry:
+    """
+    Collects histograms and stats callbacks and renders them in Prometheus text format.
+
+    Stats callbacks are the existing stats() methods (caches, executors, batch encoder,
+    sessions); every numeric entry becomes a gauge, or a counter when listed in `counters`.
+
+    Parameters:
+        namespace (str): Prefix of every metric name.
+    """
+
+    def __init__(self, namespace="shopping"):
+        self.namespace = namespace
+        self._histograms = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def histogram(self, name, help, label, buckets=DEFAULT_BUCKETS):
+        """Return the histogram with this name, creating it on first use."""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(f"{self.namespace}_{name}", help, label, buckets)
+            return histogram
+
+    def register(self, name, stats_fn, help="", counters=()):
+        """
+        Expose a stats() callback.
+
+        Parameters:
+            name (str): Metric name prefix, e.g. "text_cache".
+            stats_fn (callable): Returns a (possibly nested) dict of numbers.
+            help (str): Description shown in the HELP lines.
+            counters (tuple): Flattened keys that only ever increase.
+        """
+        with self._lock:
+            self._collectors.append((name, stats_fn, help, set(counters)))
+
+    def render(self):
+        """
+        Render every metric.
+
+        Returns:
+            str: Prometheus text exposition format (version 0.0.4).
+        """
+        lines = []
+        with self._lock:
+            histograms, collectors = list(self._histograms.values()), list(self._collectors)
+        for histogram in histograms:
+            lines.extend(histogram.render())
+        for name, stats_fn, help, counters in collectors:
+            try:
+                stats = _flatten(stats_fn())
+            except Exception as e:
+                lines.append(f"# {name} stats unavailable: {str(e)}")
+                continue
+            for key, value in sorted(stats.items()):
+                metric = f"{self.namespace}_{name}_{key}"
+                kind = "counter" if key in counters else "gauge"
+                if kind == "counter":
+                    metric += "_total"
+                lines.append(f"# HELP {metric} {help or name} {key}")
+                lines.append(f"# TYPE {metric} {kind}")
+                lines.append(f"{metric} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+span_seconds = registry.histogram("span_seconds", "Time spent in instrumented hot-path sections", label="span")
+request_seconds = registry.histogram("request_seconds", "HTTP request latency by route", label="route")
+first_token_seconds = registry.histogram("llm_first_token_seconds",
+                                         "Time from sending a chat message to the first streamed token or function call",
+                                         label="provider")
+
+
+class Trace:
+    """Spans recorded while serving one request."""
+
+    def __init__(self, name, route=""):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.route = route
+        self.started = time.perf_counter()
+        self.spans = []  # (name, start offset, duration) in seconds
+
+    def to_dict(self, duration):
+        return {
+            "trace_id": self.trace_id,
+            "request": self.name,
+            "duration_ms": round(1000 * duration, 3),
+            "spans": [{"name": name, "start_ms": round(1000 * start, 3), "duration_ms": round(1000 * seconds, 3)}
+                      for name, start, seconds in self.spans],
+        }
+
+
+def current_trace():
+    """Return the trace of the request being served, or None outside a request."""
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name):
+    """
+    Time a block of code.
+
+    The duration is recorded in the span_seconds histogram and, inside a request, appended to
+    the request's trace. Work handed to BoundedExecutor keeps the request context.
+
+    Parameters:
+        name (str): Span name, e.g. "llm" or "vector_scoring".
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        span_seconds.observe(name, seconds)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.spans.append((name, started - trace.started, seconds))
+
+
+def route_label(path):
+    """Low-cardinality route label: the first path segment, e.g. /images/a.jpg -> /images."""
+    segment = path.strip("/").split("/", 1)[0]
+    return "/" + segment
+
+
+class SamplingProfiler:
+    """
+    Profiles one in every `every` requests.
+
+    pyinstrument (when installed) writes speedscope JSON that opens directly as a flamegraph
+    at https://www.speedscope.app; the cProfile fallback writes .pstats files (flameprof or
+    snakeviz render them). Only one request is profiled at a time, and the profile covers
+    everything the event loop thread ran meanwhile, including other requests.
+
+    Parameters:
+        every (int): Sampling interval in requests (0 disables profiling).
+        output_dir (str): Where profiles are written.
+        engine (str): "pyinstrument", "cprofile" or "auto".
+    """
+
+    def __init__(self, every=0, output_dir=os.path.join(".cache", "profiles"), engine="auto"):
+        self.every = every
+        self.output_dir = output_dir
+        if engine == "auto":
+            try:
+                import pyinstrument  # noqa: F401
+                engine = "pyinstrument"
+            except ImportError:
+                engine = "cprofile"
+        self.engine = engine
+        self.written = 0
+        self._requests = 0
+        self._active = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start profiling if this request is sampled; returns a handle for stop() or None."""
+        if not self.every:
+            return None
+        with self._lock:
+            self._requests += 1
+            if self._active or self._requests % self.every:
+                return None
+            self._active = True
+        try:
+            if self.engine == "pyinstrument":
+                from pyinstrument import Profiler
+                profiler = Profiler(async_mode="enabled")
+                profiler.start()
+            else:
+                import cProfile
+                profiler = cProfile.Profile()
+                profiler.enable()
+        except Exception as e:
+            print(f"Could not start the profiler: {str(e)}")
+            with self._lock:
+                self._active = False
+            return None
+        return profiler
+
+    def stop(self, profiler, trace):
+        """Stop a sampled profile and write it next to the others, named after the trace."""
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            name = f"{time.strftime('%Y%m%d-%H%M%S')}-{trace.route.strip('/') or 'root'}-{trace.trace_id}"
+            if self.engine == "pyinstrument":
+                from pyinstrument.renderers import SpeedscopeRenderer
+                profiler.stop()
+                with open(os.path.join(self.output_dir, name + ".speedscope.json"), "w") as file:
+                    file.write(profiler.output(SpeedscopeRenderer()))
+            else:
+                profiler.disable()
+                profiler.dump_stats(os.path.join(self.output_dir, name + ".pstats"))
+            self.written += 1
+        except Exception as e:
+            print(f"Could not write the profile: {str(e)}")
+        finally:
+            with self._lock:
+                self._active = False
+
+    def stats(self):
+        return {"every": self.every, "requests": self._requests, "written": self.written}
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware that traces every HTTP request.
+
+    Records request_seconds per route, adds an X-Trace-Id response header, logs requests
+    slower than `slow_ms` as one JSON line with their spans, and runs the sampling profiler.
+
+    Parameters:
+        app: The ASGI application.
+        slow_ms (float): Log threshold in milliseconds (None disables logging, 0 logs everything).
+        profiler (SamplingProfiler): Optional profiler.
+        exclude (tuple): Path prefixes that are not traced (long-lived streams, the metrics scrape);
+            "/chat_stream" also excludes "/chat_stream/<id>".
+    """
+
+    def __init__(self, app, slow_ms=None, profiler=None, exclude=("/metrics", "/grid_events", "/chat_stream")):
+        self.app = app
+        self.slow_ms = slow_ms
+        self.profiler = profiler
+        self.exclude = tuple(prefix.rstrip("/") for prefix in exclude)
+
+    def _excluded(self, path):
+        return any(path == prefix or path.startswith(prefix + "/") for prefix in self.exclude)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self._excluded(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        route = route_label(scope["path"])
+        trace = Trace(f"{scope['method']} {scope['path']}", route)
+        token = _current_trace.set(trace)
+
+        async def send_with_trace_id(message):
+            if message["type"] == "http.response.start":
+                message = dict(message)
+                message["headers"] = list(message.get("headers", [])) + [(b"x-trace-id", trace.trace_id.encode())]
+            await send(message)
+
+        profiler = self.profiler.start() if self.profiler is not None else None
+        try:
+            await self.app(scope, receive, send_with_trace_id)
+        finally:
+            if profiler is not None:
+                self.profiler.stop(profiler, trace)
+            _current_trace.reset(token)
+            seconds = time.perf_counter() - trace.started
+            request_seconds.observe(route, seconds)
+            if self.slow_ms is not None and 1000 * seconds >= self.slow_ms:
+                print(json.dumps(trace.to_dict(seconds)))
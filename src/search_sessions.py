@@ -0,0 +1,127 @@
+"""
+Cached search rankings for pagination and infinite scroll.
+
+One scoring pass ranks the top `depth` products; later pages are slices of that ranking,
+so they cost O(page) instead of another CLIP forward pass and a full scan.
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+
+class SearchResults:
+    """
+    A ranked result list for one query.
+
+    Attributes:
+        result_id (str): Opaque id used in page URLs.
+        query (str): Query text.
+        filters (dict): Attribute filters applied to the search.
+        embedding (np.ndarray): Query embedding (read-only).
+        rows (np.ndarray): Vector store rows, best first.
+        scores (np.ndarray): Scores aligned with rows.
+        version (str): Index version the rows refer to.
+        ids (list): Product ids aligned with rows, used to map pages onto a newer index version.
+        created_at (float): Monotonic creation time.
+    """
+
+    def __init__(self, result_id, query, filters, embedding, rows, scores, version=None, ids=None):
+        self.result_id = result_id
+        self.query = query
+        self.filters = filters or {}
+        self.embedding = embedding
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.scores = np.asarray(scores)
+        self.version = version
+        self.ids = ids
+        self.created_at = time.monotonic()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def page(self, cursor, limit, version=None, row_of=None):
+        """
+        Slice the ranking.
+
+        Parameters:
+            cursor (int): Offset of the first result.
+            limit (int): Page size.
+            version (str): Index version the caller will look rows up in.
+            row_of (dict): Product id -> row of that version; when the version differs from the
+                ranking's, the page is mapped by product id and products no longer in the catalog are dropped.
+
+        Returns:
+            tuple: (rows of this page, cursor of the next page or None at the end).
+        """
+        cursor = max(0, int(cursor))
+        end = cursor + max(0, int(limit))
+        next_cursor = end if end < len(self.rows) else None
+        if row_of is not None and version != self.version and self.ids is not None:
+            rows = [row_of[product_id] for product_id in self.ids[cursor:end] if product_id in row_of]
+            return np.array(rows, dtype=np.int64), next_cursor
+        return self.rows[cursor:end], next_cursor
+
+
+class SearchResultsCache:
+    """
+    Thread-safe LRU + TTL store of SearchResults keyed on result id.
+
+    Memory is bounded by `max_entries` times the ranking depth (a few KB per entry).
+
+    Parameters:
+        max_entries (int): Maximum number of cached rankings.
+        ttl (float): Seconds before a ranking expires.
+    """
+
+    def __init__(self, max_entries=1000, ttl=1800):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.expired = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def create(self, query, filters, embedding, rows, scores, version=None, ids=None):
+        """
+        Cache a new ranking.
+
+        Parameters:
+            query (str): Query text.
+            filters (dict): Attribute filters.
+            embedding (np.ndarray): Query embedding.
+            rows (np.ndarray): Ranked vector store rows.
+            scores (np.ndarray): Scores aligned with rows.
+            version (str): Index version the rows refer to.
+            ids (list): Product ids aligned with rows.
+
+        Returns:
+            SearchResults: The cached ranking.
+        """
+        results = SearchResults(uuid.uuid4().hex, query, filters, embedding, rows, scores, version, ids)
+        with self._lock:
+            self._entries[results.result_id] = results
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return results
+
+    def get(self, result_id):
+        """Return a cached ranking, or None if it was evicted or has expired."""
+        with self._lock:
+            results = self._entries.get(result_id)
+            if results is None:
+                return None
+            if time.monotonic() - results.created_at > self.ttl:
+                del self._entries[result_id]
+                self.expired += 1
+                return None
+            self._entries.move_to_end(result_id)
+            return results
+
+    def stats(self):
+        """Return the cached ranking count and the number of expirations so far."""
+        return {"rankings": len(self._entries), "max_entries": self.max_entries, "expired": self.expired}
@@ -0,0 +1,237 @@
+"""
+Per-visitor chat sessions with bounded history and idle eviction.
+"""
+import asyncio
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from .llm import content_role, content_text
+
+# Instructions + greeting seeded by initialize_chat; always kept at the start of the history
+PREAMBLE_LENGTH = 2
+
+# Grid shown before the visitor's first search
+INITIAL_GRID_HTML = "<div>Initial Image Grid</div>"
+
+# Streamed replies kept per session, so a reconnecting EventSource can resume the latest ones
+MAX_REPLY_STREAMS = 4
+
+
+class ReplyStream:
+    """
+    An assistant reply produced by a background task and read over server-sent events.
+
+    Events are kept, so a subscriber that connects late, or reconnects with Last-Event-ID,
+    replays them from where it stopped.
+
+    Attributes:
+        stream_id (str): Id used in the stream URL.
+        events (list): (event name, data) pairs in order.
+        done (bool): Set once the reply is complete.
+    """
+
+    def __init__(self, stream_id):
+        self.stream_id = stream_id
+        self.events = []
+        self.done = False
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def push(self, event, data):
+        """Append an event and wake up subscribers. Call from the event loop."""
+        self.events.append((event, data))
+        self._notify()
+
+    def finish(self):
+        """Mark the reply complete. Call from the event loop."""
+        self.done = True
+        self._notify()
+
+    async def follow(self, start=0):
+        """
+        Yield events from index `start` as they arrive, until the reply is complete.
+
+        Yields:
+            tuple: (index, event name, data).
+        """
+        index = start
+        while True:
+            while index < len(self.events):
+                event, data = self.events[index]
+                yield index, event, data
+                index += 1
+            if self.done:
+                return
+            await self._changed.wait()
+
+
+class ChatSession:
+    """
+    State belonging to one visitor.
+
+    Attributes:
+        session_id (str): Cookie session id.
+        chat: The visitor's own LLM chat object.
+        summary (str): Condensed user requirements from turns dropped out of the history window.
+        lock (asyncio.Lock): Serializes turns, so double submits cannot interleave the history.
+        last_used (float): Monotonic time of the last access.
+        grid_html (str): Rendered image grid for the visitor's latest search.
+        grid_version (int): Incremented on every grid change; used as SSE event id and ETag.
+        replies (OrderedDict): Latest streamed replies by stream id.
+    """
+
+    def __init__(self, session_id, chat):
+        self.session_id = session_id
+        self.chat = chat
+        self.summary = ""
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+        self.grid_html = INITIAL_GRID_HTML
+        self.grid_version = 0
+        self._grid_changed = asyncio.Event()
+        self.replies = OrderedDict()
+
+    def new_reply(self):
+        """Create the ReplyStream of a new turn, dropping the oldest beyond MAX_REPLY_STREAMS."""
+        reply = ReplyStream(uuid.uuid4().hex)
+        self.replies[reply.stream_id] = reply
+        while len(self.replies) > MAX_REPLY_STREAMS:
+            self.replies.popitem(last=False)
+        return reply
+
+    def set_grid(self, grid_html):
+        """Replace the visitor's image grid and wake up any push subscribers. Call from the event loop."""
+        self.grid_html = grid_html
+        self.grid_version += 1
+        changed, self._grid_changed = self._grid_changed, asyncio.Event()
+        changed.set()
+
+    async def wait_for_grid(self, version, timeout):
+        """
+        Wait until the grid moves past `version`.
+
+        Parameters:
+            version (int): Grid version the subscriber already has.
+            timeout (float): Seconds to wait before giving up (used for keep-alives).
+
+        Returns:
+            bool: True if the grid changed.
+        """
+        if self.grid_version != version:
+            return True
+        try:
+            await asyncio.wait_for(self._grid_changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.grid_version != version
+
+
+class SessionManager:
+    """
+    Keeps one ChatSession per session id.
+
+    Memory is capped by `max_sessions` (least recently used sessions are evicted first) times
+    the per-session history window; sessions idle for longer than `idle_timeout` are dropped.
+
+    Parameters:
+        chat_factory (callable): Creates a fresh chat, e.g. initialize_chat.
+        max_sessions (int): Maximum number of live sessions.
+        idle_timeout (float): Seconds of inactivity before a session is evicted.
+        history_turns (int): User/model exchanges kept verbatim after the preamble.
+        summary_chars (int): Maximum length of the summary of dropped user turns.
+    """
+
+    def __init__(self, chat_factory, max_sessions=1000, idle_timeout=1800, history_turns=8, summary_chars=500):
+        self.chat_factory = chat_factory
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.history_turns = history_turns
+        self.summary_chars = summary_chars
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    @staticmethod
+    def new_session_id():
+        return uuid.uuid4().hex
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _evict(self, now):
+        """Drop idle sessions and the least recently used ones beyond max_sessions. Caller holds the lock."""
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if now - oldest.last_used <= self.idle_timeout and len(self._sessions) <= self.max_sessions:
+                break
+            self._sessions.popitem(last=False)
+            self.evicted += 1
+
+    def get(self, session_id):
+        """
+        Return the session for an id, creating it (and its chat) if needed.
+
+        Parameters:
+            session_id (str): Cookie session id.
+
+        Returns:
+            ChatSession: The visitor's session.
+        """
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = ChatSession(session_id, self.chat_factory())
+                self._sessions[session_id] = session
+            session.last_used = now
+            self._sessions.move_to_end(session_id)
+            self._evict(now)
+        return session
+
+    def end(self, session_id):
+        """Forget a session, e.g. when the visitor says goodbye."""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def trim_history(self, session):
+        """
+        Bound the history sent with the next turn.
+
+        Keeps the preamble plus the last `history_turns` exchanges. User messages from dropped
+        turns are folded into a short summary placed right after the preamble, so requirements
+        gathered early in the conversation are not lost.
+
+        Parameters:
+            session (ChatSession): Session whose chat history is trimmed in place.
+        """
+        history = list(session.chat.history)
+        preamble, turns = history[:PREAMBLE_LENGTH], history[PREAMBLE_LENGTH:]
+        if turns and content_role(turns[0]) == "user" and content_text(turns[0]).startswith("Summary of earlier requirements:"):
+            # Drop the previous summary pair; it is rebuilt below
+            turns = turns[2:]
+
+        window = 2 * self.history_turns
+        if len(turns) <= window:
+            return
+
+        dropped, kept = turns[:-window], turns[-window:]
+        # The kept window must start on a user turn
+        while kept and content_role(kept[0]) != "user":
+            dropped.append(kept.pop(0))
+
+        dropped_text = " ".join(content_text(content) for content in dropped if content_role(content) == "user")
+        session.summary = (session.summary + " " + dropped_text).strip()[-self.summary_chars:]
+        summary = [
+            {"role": "user", "parts": [f"Summary of earlier requirements: {session.summary}"]},
+            {"role": "model", "parts": ["Noted."]},
+        ]
+        session.chat.history = preamble + summary + kept
+
+    def stats(self):
+        """Return the live session count and the number of evictions so far."""
+        return {"sessions": len(self._sessions), "max_sessions": self.max_sessions, "evicted": self.evicted}
@@ -0,0 +1,42 @@
+"""
+Shared access to the settings in config.yaml.
+"""
+import yaml
+
+CONFIG_PATH = "config.yaml"
+
+
+def load_config(path=CONFIG_PATH):
+    """
+    Load the YAML configuration file.
+
+    Parameters:
+        path (str): Path to the configuration file.
+
+    Returns:
+        dict: Parsed configuration, or an empty dict if the file could not be read.
+    """
+    try:
+        with open(path, 'rt') as f:
+            return yaml.safe_load(f.read()) or {}
+    except Exception:
+        print("Got an Error While Reading Config")
+        return {}
+
+
+config = load_config()
+
+
+def get_setting(section, key, default=None):
+    """
+    Read a single value from a section of config.yaml.
+
+    Parameters:
+        section (str): Top-level section name, e.g. "search".
+        key (str): Setting name within the section.
+        default: Value returned when the section or key is missing.
+
+    Returns:
+        The configured value or the default.
+    """
+    return (config.get(section) or {}).get(key, default)
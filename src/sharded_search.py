@@ -0,0 +1,175 @@
+"""
+Multi-core exact search: the embedding matrix is split into row shards that a pool of worker
+processes scores in parallel, and the per-shard top-k lists are merged with a heap.
+
+Workers never receive a copy of the matrix. A normalized float32 vector store is memory-mapped
+by every worker from embeddings.bin (shared through the OS page cache); any other matrix is
+normalized once into a multiprocessing.shared_memory block that the workers attach to. Each
+worker runs single-threaded BLAS, so N shards keep N cores busy without oversubscription.
+"""
+import atexit
+import heapq
+import itertools
+import multiprocessing
+import os
+import sys
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .vector_index import l2_normalize, top_k_rows
+
+# Thread-count variables read by the BLAS libraries NumPy may be linked against
+BLAS_THREAD_VARIABLES = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+
+_worker_matrix = None
+_worker_shm = None
+
+
+def _limit_worker_threads():
+    """
+    Pin the calling worker process to one BLAS/OpenMP thread.
+
+    NumPy is already imported when the initializer runs, so the environment variables only
+    cover libraries loaded later; the already-loaded BLAS is limited through threadpoolctl
+    when it is installed, and PyTorch (if imported) through set_num_threads.
+    """
+    os.environ.update({name: "1" for name in BLAS_THREAD_VARIABLES})
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=1)
+    except ImportError:
+        pass
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(1)
+
+
+def _init_worker(source):
+    """Limit a worker process to one thread and attach it to the shared matrix described by `source`."""
+    global _worker_matrix, _worker_shm
+    _limit_worker_threads()
+    kind, location, offset, shape = source
+    if kind == "file":
+        _worker_matrix = np.memmap(location, dtype=np.float32, mode="r", offset=offset, shape=shape)
+    else:
+        _worker_shm = shared_memory.SharedMemory(name=location)
+        _worker_matrix = np.ndarray(shape, dtype=np.float32, buffer=_worker_shm.buf)
+
+
+def _score_shard(start, end, queries, k):
+    """Score one row range against a batch of queries; returns global (rows, scores), best first."""
+    rows, scores = top_k_rows(queries @ _worker_matrix[start:end].T, k)
+    return rows + start, scores
+
+
+def merge_top_k(shard_rows, shard_scores, k):
+    """
+    Merge per-shard top-k lists of one query with a heap.
+
+    Parameters:
+        shard_rows (list): Row arrays per shard, each best first.
+        shard_scores (list): Score arrays aligned with shard_rows.
+        k (int): Number of results to keep.
+
+    Returns:
+        tuple: (rows, scores) arrays of length <= k, best first.
+    """
+    merged = list(itertools.islice(heapq.merge(
+        *[zip(scores.tolist(), rows.tolist()) for rows, scores in zip(shard_rows, shard_scores)],
+        key=lambda item: -item[0]), k))
+    return (np.array([row for _, row in merged], dtype=np.int64),
+            np.array([score for score, _ in merged], dtype=np.float32))
+
+
+class ShardedIndex:
+    """
+    Exact cosine index scored in parallel across worker processes.
+
+    Parameters:
+        matrix (np.ndarray): (count x dim) embedding matrix, e.g. a vector store's memory map.
+        shards (int): Number of row shards (and worker processes by default).
+        normalized (bool): Set when the rows are already unit-length float32.
+        workers (int): Worker processes; defaults to the shard count.
+    """
+
+    def __init__(self, matrix, shards=4, normalized=False, workers=None):
+        count = len(matrix)
+        self.count = count
+        self.dim = matrix.shape[1]
+        self.shards = max(1, min(int(shards), count or 1))
+        bounds = np.linspace(0, count, self.shards + 1).astype(np.int64)
+        self.ranges = [(int(start), int(end)) for start, end in zip(bounds[:-1], bounds[1:])]
+        self._shm = None
+
+        if normalized and matrix.dtype == np.float32 and isinstance(matrix, np.memmap) and matrix.filename:
+            # Workers map the store file themselves: no copy, shared page cache
+            source = ("file", matrix.filename, matrix.offset, matrix.shape)
+            self.matrix = matrix
+        else:
+            self._shm = shared_memory.SharedMemory(create=True, size=max(1, count * self.dim * 4))
+            self.matrix = np.ndarray((count, self.dim), dtype=np.float32, buffer=self._shm.buf)
+            for start, end in self.ranges:
+                self.matrix[start:end] = l2_normalize(matrix[start:end])
+            source = ("shm", self._shm.name, 0, (count, self.dim))
+
+        # Each worker limits its own threads in _init_worker; the parent environment is left alone
+        self._pool = multiprocessing.get_context("spawn").Pool(
+            processes=workers or self.shards, initializer=_init_worker, initargs=(source,))
+
+    def __len__(self):
+        return self.count
+
+    def search_batch(self, query_vectors, k):
+        """
+        Score a batch of queries in one dispatch per shard.
+
+        Sending the whole batch to each shard amortizes the inter-process round trip and turns
+        the per-shard scoring into one matrix-matrix product.
+
+        Parameters:
+            query_vectors (np.ndarray): (queries x dim) query embeddings.
+            k (int): Number of matches per query.
+
+        Returns:
+            tuple: (rows, scores) arrays of shape (queries x <=k), best first per query.
+        """
+        queries = l2_normalize(np.atleast_2d(query_vectors))
+        shard_results = self._pool.starmap(_score_shard, [(start, end, queries, k) for start, end in self.ranges])
+        merged = [merge_top_k([rows[i] for rows, _ in shard_results], [scores[i] for _, scores in shard_results], k)
+                  for i in range(len(queries))]
+        width = min(k, self.count)
+        return (np.vstack([rows for rows, _ in merged]).reshape(len(queries), width),
+                np.vstack([scores for _, scores in merged]).reshape(len(queries), width))
+
+    def search(self, query_vector, k):
+        """
+        Return the k rows most similar to a query vector.
+
+        Parameters:
+            query_vector (np.ndarray): Query embedding of length dim.
+            k (int): Number of matches to return.
+
+        Returns:
+            tuple: (rows, scores) arrays of length <= k, best first.
+        """
+        rows, scores = self.search_batch(query_vector, k)
+        return rows[0], scores[0]
+
+    def close(self):
+        """Stop the workers and release the shared memory block."""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        if self._shm is not None:
+            self.matrix = None
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+
+def open_sharded_index(matrix, shards=4, normalized=False, workers=None):
+    """Create a ShardedIndex that is closed automatically at interpreter exit."""
+    index = ShardedIndex(matrix, shards=shards, normalized=normalized, workers=workers)
+    atexit.register(index.close)
+    return index
@@ -0,0 +1,194 @@
+"""
+"More like this" neighbor lists for catalog products.
+
+A product's query vector is its stored row in the vector store, so no model runs. Neighbor
+lists come from a precomputed table (<store>/neighbors.npy) when one exists, otherwise they
+are computed on demand and kept in an LRU, so frequently clicked products return instantly.
+
+The table holds one record per precomputed product only (its row, neighbor rows and scores),
+sorted by row, and is memory-mapped so server workers share it through the page cache.
+
+Precompute every product (or only the ids listed in a file, e.g. the most clicked ones):
+    python -m src.similar_search --k 48
+    python -m src.similar_search --k 48 --ids popular_products.txt
+"""
+import argparse
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from .vector_index import VectorIndex
+
+NEIGHBORS_FILE = "neighbors.npy"
+
+
+def neighbor_table_dtype(k):
+    """Record type of the neighbor table: the product's row, then its k neighbor rows and scores."""
+    return np.dtype([("row", np.int64), ("rows", np.int32, (k,)), ("scores", np.float32, (k,))])
+
+
+class NeighborCache:
+    """
+    Thread-safe neighbor lists keyed on vector store row.
+
+    Parameters:
+        max_size (int): Neighbor lists computed on demand that are kept (least recently used evicted).
+        table (np.ndarray): Optional precomputed table (see neighbor_table_dtype), sorted by row;
+            products missing from it are computed on demand.
+    """
+
+    def __init__(self, max_size=10000, table=None):
+        self.max_size = max_size
+        self.table = table
+        self.precomputed_hits = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, row, k, compute):
+        """
+        Return the k nearest neighbors of a catalog row, excluding the row itself.
+
+        Parameters:
+            row (int): Vector store row of the product.
+            k (int): Number of neighbors.
+            compute (callable): compute(row, k) -> (rows, scores), called on a miss.
+
+        Returns:
+            tuple: (rows, scores) arrays, best first.
+        """
+        position = self._position(row, k)
+        if position is not None:
+            with self._lock:
+                self.precomputed_hits += 1
+            rows = np.asarray(self.table["rows"][position, :k], dtype=np.int64)
+            scores = np.asarray(self.table["scores"][position, :k])
+            # Catalogs smaller than k + 1 leave -1 padding at the end of a list
+            return rows[rows >= 0], scores[rows >= 0]
+
+        with self._lock:
+            entry = self._entries.get(row)
+            if entry is not None and len(entry[0]) >= k:
+                self._entries.move_to_end(row)
+                self.hits += 1
+                return entry[0][:k], entry[1][:k]
+            self.misses += 1
+
+        rows, scores = compute(row, k)
+        with self._lock:
+            self._entries[row] = (rows, scores)
+            self._entries.move_to_end(row)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return rows, scores
+
+    def _position(self, row, k):
+        """Record of a row in the precomputed table, or None if it has no list of k neighbors."""
+        table = self.table
+        if table is None or table["rows"].shape[1] < k:
+            return None
+        position = int(np.searchsorted(table["row"], row))
+        if position == len(table) or table["row"][position] != row:
+            return None
+        return position
+
+    def stats(self):
+        """Return precomputed/LRU hit counters and the LRU size."""
+        total = self.precomputed_hits + self.hits + self.misses
+        return {
+            "precomputed_hits": self.precomputed_hits,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": (self.precomputed_hits + self.hits) / total if total else 0.0,
+            "size": len(self._entries),
+            "precomputed": len(self.table) if self.table is not None else 0,
+        }
+
+
+def drop_self(row, rows, scores, k):
+    """Remove a product from its own neighbor list and keep k entries."""
+    keep = rows != row
+    return rows[keep][:k], scores[keep][:k]
+
+
+def load_neighbor_table(store_dir, count):
+    """
+    Memory-map the precomputed neighbor table of a store.
+
+    Parameters:
+        store_dir (str): Vector store directory.
+        count (int): Current number of vectors in the store.
+
+    Returns:
+        np.ndarray or None: Read-only table records, or None if missing or built for another store.
+    """
+    path = os.path.join(store_dir, NEIGHBORS_FILE)
+    if not os.path.exists(path):
+        return None
+    table = np.load(path, mmap_mode="r")
+    if table.dtype.names != ("row", "rows", "scores") or (len(table) and table["row"][-1] >= count):
+        print("Neighbor table does not match the vector store, computing neighbors on demand")
+        return None
+    return table
+
+
+def precompute_neighbors(store_dir, k=48, ids=None, batch_size=1024):
+    """
+    Compute and save the neighbor lists of catalog products with exact batched search.
+
+    Parameters:
+        store_dir (str): Vector store directory.
+        k (int): Neighbors kept per product.
+        ids (list): Product ids to precompute, or None for every product.
+        batch_size (int): Products scored per matrix product.
+
+    Returns:
+        int: Number of products precomputed.
+    """
+    from .vector_store import load_vector_store
+
+    store = load_vector_store(store_dir)
+    index = VectorIndex(store.matrix, normalized=store.normalized)
+    targets = np.arange(len(store)) if ids is None else \
+        np.array(sorted({store.row_of[product_id] for product_id in ids if product_id in store.row_of}), dtype=np.int64)
+    if not len(targets):
+        return 0
+
+    # Written through a memory map, so only the current batch is held in memory
+    path = os.path.join(store_dir, NEIGHBORS_FILE)
+    table = np.lib.format.open_memmap(path + ".tmp", mode="w+", dtype=neighbor_table_dtype(k), shape=(len(targets),))
+    table["row"] = targets
+    table["rows"] = -1
+    for start in range(0, len(targets), batch_size):
+        batch = targets[start:start + batch_size]
+        rows, scores = index.search_batch(index.matrix[batch], k + 1)
+        for position, (target, target_rows, target_scores) in enumerate(zip(batch.tolist(), rows, scores), start):
+            kept_rows, kept_scores = drop_self(target, target_rows, target_scores, k)
+            table["rows"][position, :len(kept_rows)] = kept_rows
+            table["scores"][position, :len(kept_scores)] = kept_scores
+        print(f"  {min(start + batch_size, len(targets))}/{len(targets)} products", end="\r")
+    table.flush()
+    del table
+    os.replace(path + ".tmp", path)
+    return len(targets)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute 'more like this' neighbor lists.")
+    parser.add_argument("--store", default="vector_store", help="Vector store directory")
+    parser.add_argument("--k", type=int, default=48, help="Neighbors per product")
+    parser.add_argument("--ids", help="File with one product id per line (default: every product)")
+    parser.add_argument("--batch-size", type=int, default=1024, help="Products scored per batch")
+    args = parser.parse_args()
+
+    product_ids = None
+    if args.ids:
+        with open(args.ids, "r") as file:
+            product_ids = [line.strip() for line in file if line.strip()]
+    started = time.perf_counter()
+    count = precompute_neighbors(args.store, k=args.k, ids=product_ids, batch_size=args.batch_size)
+    print(f"Precomputed {count} neighbor lists in {time.perf_counter() - started:.1f}s")
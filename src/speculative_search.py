@@ -0,0 +1,210 @@
+"""
+Speculative search started while the LLM turn is in flight.
+
+A query built from the conversation's recent user messages is encoded and ranked on an idle
+search worker while the model is still answering. When the model then calls the search
+function, the speculative ranking is reused:
+
+    exact    same normalized query text: the ranking is reused as is (no encode, no scan)
+    rerank   query embedding within `threshold` cosine: the speculative candidates are
+             re-scored with the model's query instead of scanning the whole catalog
+    miss     anything else: the normal search runs (its query embedding is already cached)
+
+Hit rate, the time saved and the time spent on speculation are tracked, so the trade-off
+can be judged from /metrics.
+"""
+import threading
+import time
+
+import numpy as np
+
+from .clip_search import SEARCH_FUSION, MIN_FILTER_MATCHES, encode_query, index_snapshot, rank_search
+from .embedding_cache import normalize_query
+from .llm import content_role, content_text
+from .metrics import span
+from .sessions import PREAMBLE_LENGTH
+from .vector_index import l2_normalize
+
+# User messages (besides the current one) the speculative query is built from
+SPECULATIVE_TURNS = 2
+SUMMARY_PREFIX = "Summary of earlier requirements:"
+
+
+def speculative_query(history, msg, turns=SPECULATIVE_TURNS):
+    """
+    Guess the search query of a turn from the conversation so far.
+
+    Parameters:
+        history (list): Chat history before the current message.
+        msg (str): The user's current message.
+        turns (int): Previous user messages included.
+
+    Returns:
+        str: The speculative query text.
+    """
+    recent = []
+    for content in history[PREAMBLE_LENGTH:]:
+        if content_role(content) == "user":
+            text = content_text(content)
+            recent.append(text[len(SUMMARY_PREFIX):].strip() if text.startswith(SUMMARY_PREFIX) else text)
+    return " ".join(recent[-turns:] + [msg]) if turns else msg
+
+
+class Speculation:
+    """
+    Result of one speculative search.
+
+    Attributes:
+        query (str): Speculative query text.
+        version (str): Index version the rows refer to.
+        embedding (np.ndarray): Query embedding.
+        rows (np.ndarray): Ranked vector store rows, best first.
+        scores (np.ndarray): Scores aligned with rows.
+        encode_seconds (float): Time spent encoding the query.
+        search_seconds (float): Time spent ranking the catalog.
+    """
+
+    def __init__(self, query, version, embedding, rows, scores, encode_seconds, search_seconds):
+        self.query = query
+        self.version = version
+        self.embedding = embedding
+        self.rows = rows
+        self.scores = scores
+        self.encode_seconds = encode_seconds
+        self.search_seconds = search_seconds
+
+
+class SpeculativeSearch:
+    """
+    Runs speculative searches and decides whether the model's search can reuse them.
+
+    Parameters:
+        depth (int): Products ranked per speculative search (the results depth).
+        threshold (float): Minimum cosine between the speculative and the model's query embedding
+            for re-ranking; 1.0 reuses exact query matches only.
+        min_candidates (int): Fewest candidates left after filtering for a re-rank to be used.
+    """
+
+    def __init__(self, depth=500, threshold=0.9, min_candidates=6):
+        self.depth = depth
+        self.threshold = threshold
+        self.min_candidates = min_candidates
+        self.started = 0
+        self.skipped = 0
+        self.late = 0
+        self.exact_hits = 0
+        self.reranked = 0
+        self.misses = 0
+        self.seconds_spent = 0.0
+        self.seconds_saved = 0.0
+        self._lock = threading.Lock()
+
+    def run(self, query):
+        """
+        Encode and rank a speculative query. Call from a search worker.
+
+        Returns:
+            Speculation: The ranking and its cost.
+        """
+        with self._lock:
+            self.started += 1
+        with span("speculative_search"):
+            started = time.perf_counter()
+            embedding = encode_query(query)
+            encoded = time.perf_counter()
+            with index_snapshot() as snapshot:
+                # The embedding is now cached, so rank_search only scores
+                _, rows, scores = rank_search(query, depth=self.depth, snapshot=snapshot)
+            finished = time.perf_counter()
+        with self._lock:
+            self.seconds_spent += finished - started
+        return Speculation(query, snapshot.version, embedding, rows, scores, encoded - started, finished - encoded)
+
+    def record_skip(self):
+        """Count a turn that was not speculated on because no search worker was idle."""
+        with self._lock:
+            self.skipped += 1
+
+    def record_late(self):
+        """Count a speculation that had not finished when the model's search started."""
+        with self._lock:
+            self.late += 1
+
+    def _candidates(self, speculation, filters, snapshot):
+        """Speculative rows restricted to the attribute filters, or None if too few remain."""
+        keyword_index = snapshot.keyword_index
+        rows = np.asarray(speculation.rows, dtype=np.int64)
+        if filters and keyword_index is not None:
+            allowed = keyword_index.filter_rows(filters)
+            if allowed is not None and len(allowed) < MIN_FILTER_MATCHES:
+                # rank_search only boosts matches of such narrow filters; that ranking cannot be re-scored
+                return None
+            if allowed is not None:
+                rows = rows[np.isin(rows, allowed)]
+        return rows if len(rows) >= self.min_candidates else None
+
+    def reuse(self, speculation, text_query, filters, snapshot):
+        """
+        Serve the model's search from a speculation when it is close enough.
+
+        Parameters:
+            speculation (Speculation): Finished speculative search of this turn.
+            text_query (str): Query text the model searched for.
+            filters (dict): Attribute filters the model set.
+            snapshot (IndexSnapshot): Index version the search runs on.
+
+        Returns:
+            tuple or None: (query embedding, rows, scores), or None when the full search must run.
+        """
+        started = time.perf_counter()
+        if speculation.version != snapshot.version:
+            return self._miss()
+
+        exact = normalize_query(text_query) == normalize_query(speculation.query)
+        if exact and not filters:
+            with self._lock:
+                self.exact_hits += 1
+                self.seconds_saved += speculation.encode_seconds + speculation.search_seconds
+            return speculation.embedding, speculation.rows, speculation.scores
+
+        # Fused rankings cannot be re-scored from cosine candidates alone
+        if SEARCH_FUSION == "rrf":
+            return self._miss()
+        embedding = speculation.embedding
+        if not exact:
+            embedding = encode_query(text_query)
+            similarity = float(l2_normalize(embedding).ravel() @ l2_normalize(speculation.embedding).ravel())
+            if similarity < self.threshold:
+                return self._miss()
+        candidates = self._candidates(speculation, filters, snapshot)
+        if candidates is None:
+            return self._miss()
+
+        with span("speculative_rerank"):
+            rows, scores = snapshot.vector_index.search_rows(embedding, candidates, self.depth)
+        with self._lock:
+            self.reranked += 1
+            saved = speculation.search_seconds + (speculation.encode_seconds if exact else 0.0)
+            self.seconds_saved += max(0.0, saved - (time.perf_counter() - started))
+        return embedding, rows, scores
+
+    def _miss(self):
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def stats(self):
+        """Return hit/miss counters, the hit ratio and the seconds saved versus spent."""
+        with self._lock:
+            lookups = self.exact_hits + self.reranked + self.misses + self.late
+            return {
+                "started": self.started,
+                "skipped": self.skipped,
+                "late": self.late,
+                "exact_hits": self.exact_hits,
+                "reranked": self.reranked,
+                "misses": self.misses,
+                "hit_ratio": (self.exact_hits + self.reranked) / lookups if lookups else 0.0,
+                "seconds_spent": self.seconds_spent,
+                "seconds_saved": self.seconds_saved,
+            }
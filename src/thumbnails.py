@@ -0,0 +1,161 @@
+"""
+Resized image derivatives for the product grid.
+
+Thumbnails are generated lazily with Pillow on first request (or in bulk ahead of time) and
+stored in a content-addressed cache directory: the file name is derived from the source
+image's content hash, the width and the format, so a cached derivative never goes stale.
+
+Bulk pre-generation:
+    python -m src.thumbnails --images images
+"""
+import argparse
+import hashlib
+import os
+import threading
+
+from PIL import Image
+
+THUMBNAIL_CACHE_DIR = os.path.join(".cache", "thumbnails")
+THUMBNAIL_WIDTHS = (256, 512, 768)
+THUMBNAIL_FORMATS = {"webp": "WEBP", "jpeg": "JPEG"}
+THUMBNAIL_QUALITY = 80
+# Hex digits of the content hash used as the ?v= cache-busting parameter
+VERSION_LENGTH = 12
+
+_digests = {}  # path -> ((mtime_ns, size), digest)
+_digests_lock = threading.Lock()
+
+
+def safe_image_path(image_dir, image_name):
+    """
+    Resolve a requested image name inside the image directory.
+
+    Parameters:
+        image_dir (str): Directory the images are served from.
+        image_name (str): Name taken from the request URL.
+
+    Returns:
+        str or None: The file path, or None if the name is not a plain file inside image_dir.
+    """
+    if not image_name or image_name != os.path.basename(image_name) or image_name.startswith("."):
+        return None
+    root = os.path.realpath(image_dir)
+    path = os.path.realpath(os.path.join(root, image_name))
+    if os.path.dirname(path) != root or not os.path.isfile(path):
+        return None
+    return path
+
+
+def source_digest(path):
+    """
+    Content hash of a source image, memoized on its mtime and size.
+
+    Parameters:
+        path (str): Image file path.
+
+    Returns:
+        str: Hex SHA-1 of the file contents.
+    """
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _digests.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            sha1.update(block)
+    digest = sha1.hexdigest()
+    with _digests_lock:
+        _digests[path] = (signature, digest)
+    return digest
+
+
+def source_version(path):
+    """Short content version used as the ?v= cache-busting parameter in image URLs."""
+    return source_digest(path)[:VERSION_LENGTH]
+
+
+def nearest_width(width):
+    """Snap a requested width to the closest configured thumbnail width at or above it."""
+    for candidate in THUMBNAIL_WIDTHS:
+        if width <= candidate:
+            return candidate
+    return THUMBNAIL_WIDTHS[-1]
+
+
+def thumbnail_path(digest, width, fmt, cache_dir=THUMBNAIL_CACHE_DIR):
+    """Content-addressed location of a derivative: <cache>/<ab>/<digest>-<width>.<fmt>."""
+    return os.path.join(cache_dir, digest[:2], f"{digest}-{width}.{fmt}")
+
+
+def get_thumbnail(source_path, width, fmt="webp", cache_dir=THUMBNAIL_CACHE_DIR):
+    """
+    Return the path of a resized derivative, generating it if it is not cached yet.
+
+    Parameters:
+        source_path (str): Original image path.
+        width (int): Target width; snapped to one of THUMBNAIL_WIDTHS.
+        fmt (str): "webp" or "jpeg".
+        cache_dir (str): Derivative cache directory.
+
+    Returns:
+        tuple: (derivative path, source digest).
+    """
+    if fmt not in THUMBNAIL_FORMATS:
+        raise ValueError(f"Unsupported thumbnail format: {fmt}")
+    width = nearest_width(width)
+    digest = source_digest(source_path)
+    path = thumbnail_path(digest, width, fmt, cache_dir)
+    if os.path.exists(path):
+        return path, digest
+
+    with Image.open(source_path) as image:
+        image = image.convert("RGB")
+        if image.width > width:
+            height = round(image.height * width / image.width)
+            image = image.resize((width, height), Image.LANCZOS)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write under a name unique across worker processes and threads, then rename, so concurrent
+        # requests never read a partial file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        image.save(tmp_path, THUMBNAIL_FORMATS[fmt], quality=THUMBNAIL_QUALITY)
+    os.replace(tmp_path, path)
+    return path, digest
+
+
+def pregenerate(image_dir, widths=THUMBNAIL_WIDTHS, formats=tuple(THUMBNAIL_FORMATS), cache_dir=THUMBNAIL_CACHE_DIR):
+    """
+    Generate every derivative for every image in a directory.
+
+    Parameters:
+        image_dir (str): Directory of source images.
+        widths (tuple): Widths to generate.
+        formats (tuple): Formats to generate.
+        cache_dir (str): Derivative cache directory.
+
+    Returns:
+        int: Number of derivatives generated or already present.
+    """
+    count = 0
+    for name in sorted(os.listdir(image_dir)):
+        path = safe_image_path(image_dir, name)
+        if path is None:
+            continue
+        for width in widths:
+            for fmt in formats:
+                try:
+                    get_thumbnail(path, width, fmt, cache_dir)
+                    count += 1
+                except Exception as e:
+                    print(f"Could not create thumbnail for {name}: {str(e)}")
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-generate grid thumbnails.")
+    parser.add_argument("--images", default="images", help="Source image directory")
+    parser.add_argument("--cache", default=THUMBNAIL_CACHE_DIR, help="Thumbnail cache directory")
+    args = parser.parse_args()
+    print(f"{pregenerate(args.images, cache_dir=args.cache)} thumbnails ready in {args.cache}")
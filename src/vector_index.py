@@ -0,0 +1,123 @@
+"""
+Exact cosine-similarity search over a pre-normalized embedding matrix.
+"""
+import numpy as np
+
+
+def l2_normalize(vectors):
+    """
+    L2-normalize vectors along the last axis as float32.
+
+    Parameters:
+        vectors (np.ndarray): A single vector or a (count x dim) matrix.
+
+    Returns:
+        np.ndarray: Normalized float32 copy; zero vectors are left as zeros.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def top_k_rows(scores, k):
+    """
+    Select the k highest scores along the last axis, best first.
+
+    Uses argpartition so only the k winners are sorted, not the whole row.
+
+    Parameters:
+        scores (np.ndarray): (count,) or (queries x count) score array.
+        k (int): Number of results to keep.
+
+    Returns:
+        tuple: (rows, scores) arrays with k entries along the last axis.
+    """
+    count = scores.shape[-1]
+    k = min(k, count)
+    if k <= 0:
+        empty_shape = scores.shape[:-1] + (0,)
+        return np.empty(empty_shape, dtype=np.int64), np.empty(empty_shape, dtype=scores.dtype)
+
+    if k < count:
+        candidates = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    else:
+        candidates = np.broadcast_to(np.arange(count), scores.shape)
+    candidate_scores = np.take_along_axis(scores, candidates, axis=-1)
+    order = np.argsort(-candidate_scores, axis=-1, kind="stable")
+    return np.take_along_axis(candidates, order, axis=-1), np.take_along_axis(candidate_scores, order, axis=-1)
+
+
+class VectorIndex:
+    """
+    Brute-force cosine index over an L2-normalized float32 matrix.
+
+    The matrix is normalized once at construction and never modified afterwards, so a
+    single index can be searched from many threads at the same time.
+
+    Parameters:
+        matrix (np.ndarray): (count x dim) embedding matrix.
+        normalized (bool): Set when the rows are already unit-length float32 (e.g. a
+            normalized vector store), so the memory-mapped matrix is used without a copy.
+    """
+
+    def __init__(self, matrix, normalized=False):
+        if normalized and matrix.dtype == np.float32:
+            self.matrix = matrix
+        else:
+            self.matrix = l2_normalize(matrix)
+            self.matrix.setflags(write=False)
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    @property
+    def dim(self):
+        return self.matrix.shape[1]
+
+    def scores(self, query_vector):
+        """Return the cosine similarity of one query vector against every row."""
+        return self.matrix @ l2_normalize(query_vector).ravel()
+
+    def search(self, query_vector, k):
+        """
+        Find the k rows most similar to a single query vector.
+
+        Parameters:
+            query_vector (np.ndarray): Query embedding of length dim.
+            k (int): Number of matches to return.
+
+        Returns:
+            tuple: (rows, scores) arrays of length k, best first.
+        """
+        return top_k_rows(self.scores(query_vector), k)
+
+    def search_batch(self, query_vectors, k):
+        """
+        Find the k most similar rows for each query in a batch with one matrix-matrix product.
+
+        Parameters:
+            query_vectors (np.ndarray): (queries x dim) query embeddings.
+            k (int): Number of matches per query.
+
+        Returns:
+            tuple: (rows, scores) arrays of shape (queries x k), best first per query.
+        """
+        queries = l2_normalize(np.atleast_2d(query_vectors))
+        return top_k_rows(queries @ self.matrix.T, k)
+
+    def search_rows(self, query_vector, rows, k):
+        """
+        Score only a subset of rows and return the best k of them.
+
+        Parameters:
+            query_vector (np.ndarray): Query embedding of length dim.
+            rows (np.ndarray): Row indices to consider.
+            k (int): Number of matches to return.
+
+        Returns:
+            tuple: (rows, scores) arrays of length <= k, best first.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        subset_scores = self.matrix[rows] @ l2_normalize(query_vector).ravel()
+        best, best_scores = top_k_rows(subset_scores, k)
+        return rows[best], best_scores
@@ -0,0 +1,250 @@
+"""
+Binary on-disk store for the precomputed CLIP image embeddings.
+
+A store is a directory with two files:
+    embeddings.bin  Contiguous row-major matrix (count x dim) of float32 or float16 values.
+    index.json      Sidecar with the dtype/shape, whether rows are L2-normalized, and the
+                    row -> product name/image path mapping.
+
+The matrix is opened with np.memmap, so several server workers share the same page cache
+instead of each holding its own parsed copy of the vectors.
+
+One-shot conversion from the notebook output (vectors.csv + paths_dict.json):
+    python -m src.vector_store --csv vectors.csv --paths paths_dict.json --out vector_store
+"""
+import argparse
+import csv
+import json
+import os
+
+import numpy as np
+
+from .vector_index import l2_normalize
+
+EMBEDDINGS_FILE = "embeddings.bin"
+SIDECAR_FILE = "index.json"
+SUPPORTED_DTYPES = ("float32", "float16")
+
+
+class VectorStore:
+    """
+    Read-only view over a vector store directory.
+
+    Attributes:
+        matrix (np.ndarray): (count x dim) embedding matrix, usually a read-only np.memmap.
+        ids (list): Product names, one per matrix row.
+        paths (list): Image file paths, one per matrix row.
+        normalized (bool): Whether the rows are stored L2-normalized.
+        directory (str): Directory the store was loaded from, if any.
+    """
+
+    def __init__(self, matrix, ids, paths, normalized=False, directory=None):
+        if len(ids) != matrix.shape[0] or len(paths) != matrix.shape[0]:
+            raise ValueError("Vector store ids/paths do not match the number of matrix rows")
+        self.matrix = matrix
+        self.ids = ids
+        self.paths = paths
+        self.normalized = normalized
+        self.directory = directory
+        self.row_of = {product_id: row for row, product_id in enumerate(ids)}
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    @property
+    def dim(self):
+        return self.matrix.shape[1]
+
+    @property
+    def dtype(self):
+        return self.matrix.dtype.name
+
+    def vector(self, product_id):
+        """Return the stored embedding row for a product name."""
+        return self.matrix[self.row_of[product_id]]
+
+
+def write_vector_store(directory, matrix, ids, paths, dtype="float32", normalized=False):
+    """
+    Write an embedding matrix and its id/path sidecar to a store directory.
+
+    Both files are written to temporary names first and then renamed into place, so a
+    reader never sees a half-written store.
+
+    Parameters:
+        directory (str): Target store directory (created if missing).
+        matrix (np.ndarray): (count x dim) embedding matrix.
+        ids (list): Product names, one per row.
+        paths (list): Image file paths, one per row.
+        dtype (str): On-disk element type, "float32" or "float16".
+        normalized (bool): Record that the rows are already L2-normalized.
+    """
+    if dtype not in SUPPORTED_DTYPES:
+        raise ValueError(f"Unsupported vector store dtype: {dtype}")
+    matrix = np.ascontiguousarray(matrix, dtype=dtype)
+    if matrix.ndim != 2:
+        raise ValueError("Embedding matrix must be two-dimensional")
+
+    os.makedirs(directory, exist_ok=True)
+    embeddings_path = os.path.join(directory, EMBEDDINGS_FILE)
+
+    matrix.tofile(embeddings_path + ".tmp")
+    os.replace(embeddings_path + ".tmp", embeddings_path)
+    _write_sidecar(directory, dtype, matrix.shape[1], normalized, ids, paths)
+
+
+def _write_sidecar(directory, dtype, dim, normalized, ids, paths):
+    """Atomically replace the sidecar of a store directory."""
+    sidecar_path = os.path.join(directory, SIDECAR_FILE)
+    with open(sidecar_path + ".tmp", "w") as file:
+        json.dump({
+            "dtype": dtype,
+            "count": len(ids),
+            "dim": int(dim),
+            "normalized": bool(normalized),
+            "ids": list(ids),
+            "paths": list(paths),
+        }, file)
+    os.replace(sidecar_path + ".tmp", sidecar_path)
+
+
+def append_to_vector_store(store, matrix, ids, paths):
+    """
+    Append rows to an existing store without rewriting it.
+
+    The new rows are appended to the matrix file before the sidecar is replaced, so readers
+    holding the old sidecar keep seeing a consistent (shorter) matrix.
+
+    Parameters:
+        store (VectorStore): Store loaded from disk.
+        matrix (np.ndarray): (count x dim) rows to append; normalized by the caller if the store is.
+        ids (list): Product names of the new rows.
+        paths (list): Image paths of the new rows.
+    """
+    matrix = np.ascontiguousarray(matrix, dtype=store.dtype)
+    with open(os.path.join(store.directory, EMBEDDINGS_FILE), "ab") as file:
+        matrix.tofile(file)
+    _write_sidecar(store.directory, store.dtype, store.dim, store.normalized,
+                   list(store.ids) + list(ids), list(store.paths) + list(paths))
+
+
+def update_vector_store_rows(store, rows, matrix, chunk_size=65536):
+    """
+    Replace existing rows, e.g. for images whose content changed.
+
+    The matrix is copied to a new file with the rows replaced and renamed into place, rather
+    than written through a writable map, so readers mapping the old file are not changed
+    under them.
+
+    Parameters:
+        store (VectorStore): Store loaded from disk.
+        rows (np.ndarray): Row indices to replace.
+        matrix (np.ndarray): (len(rows) x dim) new rows; normalized by the caller if the store is.
+        chunk_size (int): Rows copied per chunk.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    matrix = np.asarray(matrix, dtype=store.dtype)
+    embeddings_path = os.path.join(store.directory, EMBEDDINGS_FILE)
+    with open(embeddings_path + ".tmp", "wb") as file:
+        for start in range(0, len(store), chunk_size):
+            chunk = np.array(store.matrix[start:start + chunk_size])
+            inside = (rows >= start) & (rows < start + len(chunk))
+            chunk[rows[inside] - start] = matrix[inside]
+            chunk.tofile(file)
+    os.replace(embeddings_path + ".tmp", embeddings_path)
+
+
+def compact_vector_store(store, keep_rows, chunk_size=65536):
+    """
+    Rewrite a store keeping only the given rows, streaming the copy in chunks.
+
+    Parameters:
+        store (VectorStore): Store loaded from disk.
+        keep_rows (np.ndarray): Sorted row indices to keep.
+        chunk_size (int): Rows copied per chunk.
+    """
+    keep_rows = np.asarray(keep_rows, dtype=np.int64)
+    embeddings_path = os.path.join(store.directory, EMBEDDINGS_FILE)
+    with open(embeddings_path + ".tmp", "wb") as file:
+        for start in range(0, len(keep_rows), chunk_size):
+            np.ascontiguousarray(store.matrix[keep_rows[start:start + chunk_size]]).tofile(file)
+    os.replace(embeddings_path + ".tmp", embeddings_path)
+    _write_sidecar(store.directory, store.dtype, store.dim, store.normalized,
+                   [store.ids[row] for row in keep_rows], [store.paths[row] for row in keep_rows])
+
+
+def load_vector_store(directory):
+    """
+    Open a vector store directory with the embedding matrix memory-mapped read-only.
+
+    Parameters:
+        directory (str): Store directory written by write_vector_store.
+
+    Returns:
+        VectorStore: The opened store.
+    """
+    with open(os.path.join(directory, SIDECAR_FILE), "r") as file:
+        sidecar = json.load(file)
+
+    shape = (sidecar["count"], sidecar["dim"])
+    if sidecar["count"] == 0:
+        # np.memmap cannot map an empty file
+        matrix = np.empty(shape, dtype=sidecar["dtype"])
+    else:
+        matrix = np.memmap(os.path.join(directory, EMBEDDINGS_FILE),
+                           dtype=sidecar["dtype"], mode="r", shape=shape)
+    return VectorStore(matrix, sidecar["ids"], sidecar["paths"],
+                       normalized=sidecar.get("normalized", False), directory=directory)
+
+
+def vector_store_exists(directory):
+    """Check whether a directory contains a complete vector store."""
+    return os.path.exists(os.path.join(directory, SIDECAR_FILE)) and \
+        os.path.exists(os.path.join(directory, EMBEDDINGS_FILE))
+
+
+def convert_csv_to_store(csv_path, paths_json, directory, dtype="float32", normalize=True):
+    """
+    Convert the notebook's vectors.csv / paths_dict.json pair into a binary vector store.
+
+    Parameters:
+        csv_path (str): CSV with 'product_name' and 'image_embed' (comma-separated floats) columns.
+        paths_json (str): JSON mapping of product names to image paths.
+        directory (str): Target store directory.
+        dtype (str): On-disk element type, "float32" or "float16".
+        normalize (bool): L2-normalize rows before writing, so cosine search is a plain dot product.
+
+    Returns:
+        int: Number of vectors written.
+    """
+    with open(paths_json, "r") as file:
+        image_paths_dict = json.load(file)
+
+    ids, rows = [], []
+    with open(csv_path, "r", newline="") as file:
+        for record in csv.DictReader(file):
+            # Embeddings were written with np.array2string, which may wrap long rows over several lines
+            rows.append(np.array([float(value) for value in record["image_embed"].split(",")],
+                                 dtype=np.float32))
+            ids.append(record["product_name"])
+
+    matrix = np.vstack(rows) if rows else np.empty((0, 0), dtype=np.float32)
+    if normalize:
+        matrix = l2_normalize(matrix)
+    paths = [image_paths_dict[product_id] for product_id in ids]
+    write_vector_store(directory, matrix, ids, paths, dtype=dtype, normalized=normalize)
+    return len(ids)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert vectors.csv into a binary vector store.")
+    parser.add_argument("--csv", default="vectors.csv", help="Embeddings CSV produced by the notebook")
+    parser.add_argument("--paths", default="paths_dict.json", help="Product name -> image path JSON")
+    parser.add_argument("--out", default="vector_store", help="Output store directory")
+    parser.add_argument("--dtype", default="float32", choices=SUPPORTED_DTYPES)
+    parser.add_argument("--no-normalize", action="store_true", help="Store raw (unnormalized) embeddings")
+    args = parser.parse_args()
+
+    count = convert_csv_to_store(args.csv, args.paths, args.out, dtype=args.dtype,
+                                 normalize=not args.no_normalize)
+    print(f"Wrote {count} vectors to {args.out} ({args.dtype})")